@@ -0,0 +1,64 @@
+import cProfile
+import io
+import pstats
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+import config
+import metrics
+from logs import logger
+
+ROUTE = "/metrics"
+PROFILE_HEADER = "X-Streamflow-Profile"
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4"
+PROFILE_STATS_LINES = 30
+
+_profiler_busy = False  # a single python profiler can run at once
+
+
+def _get_server_timing(spans) -> str:
+    """Formats spans as a Server-Timing header, which browsers developer tools display"""
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in spans)
+
+
+def add_metrics_resources(app: FastAPI):
+    """
+    Adds the metrics resource, and the profiling of the requests sent with the profile header if enabled.
+    The profiling middleware is only added when REQUEST_PROFILING is set, so that other requests do not go through it.
+    """
+
+    @app.get(ROUTE, response_class=PlainTextResponse)
+    async def get_metrics() -> PlainTextResponse:
+        return PlainTextResponse(metrics.render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+    if not config.REQUEST_PROFILING:
+        return
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        """
+        Returns the spans of the request in the Server-Timing header, and logs the python profile of the request.
+        The profile covers the whole event loop thread, so concurrent requests show up in it as well.
+        """
+        global _profiler_busy
+        if request.headers.get(PROFILE_HEADER, "").lower() not in ("1", "true"):
+            return await call_next(request)
+        profiler = None
+        if not _profiler_busy:
+            _profiler_busy = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with metrics.collect_spans() as spans:
+                response = await call_next(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiler_busy = False
+        response.headers["Server-Timing"] = _get_server_timing(spans)
+        if profiler is not None:
+            stats_output = io.StringIO()
+            pstats.Stats(profiler, stream=stats_output).sort_stats("cumulative").print_stats(PROFILE_STATS_LINES)
+            logger.info(f"Profile of {request.method} {request.url.path}:\n{stats_output.getvalue()}")
+        return response
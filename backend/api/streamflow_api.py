@@ -1,9 +1,11 @@
 # coding=utf-8
 from fastapi import FastAPI
 
+from api.metrics import add_metrics_resources
 from api.tasks import add_tasks_resources
 
 app = FastAPI()
 
 # all routes
 add_tasks_resources(app)
+add_metrics_resources(app)
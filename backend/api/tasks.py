@@ -1,15 +1,38 @@
-from typing import Optional, List, Tuple, Union
+import asyncio
+import hashlib
+import time
+from typing import Optional, List, Tuple, Union, Dict, Set, AsyncIterable
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+import backoff
+from pydantic import ValidationError
+from fastapi import FastAPI, Request, HTTPException, Response, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from graph.changes import build_db_changes, build_new_tasks_graph
-from graph.validation import get_orphan_tasks, get_tasks_cycles
-from db import tasks as tasks_db
-from model.db import TasksPage
-from model.task_model import TasksChange
+import config
+from dags import get_task_id_dag, are_dags_overlapping
+from graph.compact import CompactGraph
+from graph.changes import build_db_changes, build_new_graph, get_tasks_with_new_parents
+from graph.dag_trie import DagTrie
+from graph.hashes import is_change_applied
+from graph.utils import is_task_in_dag
+from graph.validation import get_orphan_tasks, get_introduced_cycles, get_tasks_cycles
+from db import tasks as tasks_db, locks as locks_db
+from db.cache import tasks_cache
+from db.locks import DagsLocked, LeaseLost
+from logs import logger
+import metrics
+import streaming
+from model.db import TasksPage, DbTask, DbTasksChange, GraphValidation
+from model.task_model import TasksChange, Task
 
 ROUTE = "/tasks"
+EXPORT_ROUTE = f"{ROUTE}/export"
+IMPORT_ROUTE = f"{ROUTE}/import"
+VALIDATION_ROUTE = f"{ROUTE}/validation"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+EXPORT_CHUNK_SIZE = 100  # tasks sent per chunk of the export response
+
+GRAPH_TASKS = metrics.Gauge("streamflow_graph_tasks", "Number of tasks of the last planned tasks graph.")
 
 
 class CyclesIntroduced(Exception):
@@ -24,42 +47,385 @@ class InconsistentTasksDependencies(Exception):
         self.inconsistent_links = inconsistent_links
 
 
+class InvalidImportRecord(Exception):
+    def __init__(self, message: str, line_number: int, errors: List[Dict]):
+        self.message = message
+        self.line_number = line_number
+        self.errors = errors
+
+
+class ImportTooLarge(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+
+def _plan_tasks_change(tasks_change: TasksChange, current_tasks: Dict[str, DbTask]) -> Tuple[DbTasksChange, Set[str]]:
+    """
+    Evaluates and validates the db changes needed to apply a tasks change.
+    :return: the db changes and the dags they have been evaluated from, which must be locked to apply them
+    :raises InconsistentTasksDependencies: if the change leaves tasks with missing parents
+    :raises CyclesIntroduced: if the change introduces cycles
+    """
+    with metrics.span("plan"):
+        new_graph = build_new_graph(change=tasks_change, current_tasks=current_tasks)
+        db_changes = build_db_changes(current_tasks=current_tasks, change=tasks_change, new_graph=new_graph)
+    GRAPH_TASKS.set(new_graph.tasks_count)
+    if not db_changes:
+        return db_changes, set()
+    with metrics.span("validate"):
+        return _validate_db_changes(db_changes, current_tasks, new_graph)
+
+
+def _validate_db_changes(db_changes: DbTasksChange, current_tasks: Dict[str, DbTask],
+                         new_graph: CompactGraph) -> Tuple[DbTasksChange, Set[str]]:
+    """Checks the new graph has neither orphans nor new cycles. See _plan_tasks_change."""
+    orphan_tasks = get_orphan_tasks(new_graph)
+    if orphan_tasks:
+        raise InconsistentTasksDependencies(
+            message=f"Changes introduced inconsistent {len(orphan_tasks)} task(s) dependencies.",
+            inconsistent_links=[(missing_parents_ids, task_id) for task_id, missing_parents_ids in orphan_tasks]
+        )
+    tasks_with_new_parents_ids = get_tasks_with_new_parents(change=db_changes, current_tasks=current_tasks)
+    tasks_cycle = get_introduced_cycles(
+        new_graph,
+        starting_tasks_ids=tasks_with_new_parents_ids,
+        max_cycles=config.MAX_REPORTED_CYCLES,
+    )
+    if tasks_cycle:
+        raise CyclesIntroduced(
+            message=f"Modification would create at least {len(tasks_cycle)} tasks cycle(s).",
+            cycles=tasks_cycle,
+        )
+    involved_tasks_ids = new_graph.get_ancestors_ids(tasks_with_new_parents_ids)
+    involved_tasks_ids.update(task.id for task in db_changes.tasks_to_update)
+    return db_changes, {get_task_id_dag(task_id) for task_id in involved_tasks_ids}
+
+
+@backoff.on_exception(backoff.expo, DagsLocked, factor=0.1, max_value=2, jitter=backoff.full_jitter,
+                      max_time=lambda: config.LOCK_ACQUIRE_TIMEOUT,
+                      on_backoff=lambda _: locks_db.LOCK_RETRIES.inc(operation="apply"))
+async def _apply_tasks_change(tasks_change: TasksChange) -> DbTasksChange:
+    """
+    Applies a tasks change while holding a lease on the edited dags and on every dag the change is evaluated from.
+    Dags found to be involved once the change is evaluated are locked in turn before evaluating the change again.
+    Changes the edited dags already hold are skipped without locking them.
+    """
+    with metrics.span("load_tasks"):
+        await tasks_cache.get_tasks()
+    if is_change_applied(tasks_change, tasks_cache.get_dags_hashes()):
+        return DbTasksChange(ids_to_remove=set(), tasks_to_update=[])
+    with metrics.span("lock"):
+        lease = await locks_db.acquire_dags_lease(tasks_change.dags)
+    try:
+        while True:
+            with metrics.span("load_tasks"):
+                current_tasks = await tasks_cache.get_tasks()
+            db_changes, involved_dags = _plan_tasks_change(tasks_change, current_tasks)
+            if all(lease.covers(dag) for dag in involved_dags):
+                break
+            with metrics.span("lock"):
+                await locks_db.extend_dags_lease(lease, involved_dags)
+        if db_changes:
+            logger.info(f"Updating tasks of dags {', '.join(tasks_change.dags)}: {_describe_db_changes(db_changes)}")
+            begun_version = await tasks_cache.begin_changes()
+            try:
+                await tasks_db.update_db(db_changes, lease=lease)
+            except Exception:
+                await tasks_cache.invalidate()
+                raise
+            with metrics.span("cache_update"):
+                await tasks_cache.apply_changes(db_changes, begun_version)
+        return db_changes
+    finally:
+        with metrics.span("unlock"):
+            await locks_db.release_dags_lease(lease)
+
+
+class _PendingChange:
+    """Tasks change waiting in the commit queue for the result of its batch"""
+
+    def __init__(self, tasks_change: TasksChange):
+        self.tasks_change = tasks_change
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.submitted_at = time.perf_counter()
+        self.spans = metrics.get_collected_spans()  # spans of the batch are reported to the profiled submitter
+        self.batch_spans: List[Tuple[str, float]] = []
+
+    def observe_queue_wait(self) -> None:
+        duration = time.perf_counter() - self.submitted_at
+        metrics.STAGE_DURATION.observe(duration, stage="queue_wait")
+        if self.spans is not None:
+            self.spans.append(("queue_wait", duration))
+
+    def _report_spans(self) -> None:
+        if self.spans is not None:
+            self.spans.extend(self.batch_spans)
+
+    def set_result(self, db_changes: DbTasksChange) -> None:
+        if not self.result.done():
+            self._report_spans()
+            self.result.set_result(db_changes)
+
+    def set_exception(self, exception: BaseException) -> None:
+        if not self.result.done():
+            self._report_spans()
+            self.result.set_exception(exception)
+
+
+def _merge_tasks_changes(tasks_changes: List[TasksChange]) -> TasksChange:
+    """Merges changes of non overlapping dags. Each change has already been validated."""
+    return TasksChange.construct(
+        dags=[dag for tasks_change in tasks_changes for dag in tasks_change.dags],
+        tasks=[task for tasks_change in tasks_changes for task in tasks_change.tasks],
+    )
+
+
+def _split_db_changes(db_changes: DbTasksChange, tasks_changes: List[TasksChange]) -> List[DbTasksChange]:
+    """
+    Attributes the db changes of a batch to each of its tasks changes. Tasks updated outside of the batch dags are
+    attributed to the changes of their children dags, or to every change if none of their children is in the batch.
+    """
+    batch_dags = DagTrie(dag for tasks_change in tasks_changes for dag in tasks_change.dags)
+    split_changes = []
+    for tasks_change in tasks_changes:
+        change_dags = DagTrie(tasks_change.dags)
+        split_changes.append(DbTasksChange(
+            ids_to_remove={task_id for task_id in db_changes.ids_to_remove if is_task_in_dag(task_id, change_dags)},
+            tasks_to_update=[
+                task for task in db_changes.tasks_to_update
+                if is_task_in_dag(task.id, change_dags) or not is_task_in_dag(task.id, batch_dags) and (
+                    any(is_task_in_dag(child_id, change_dags) for child_id in task.next_tasks_ids)
+                    or not any(is_task_in_dag(child_id, batch_dags) for child_id in task.next_tasks_ids))
+            ],
+        ))
+    return split_changes
+
+
+class TasksCommitQueue:
+    """
+    Groups the tasks changes submitted concurrently into batches of changes on non overlapping dags.
+    A batch is planned, validated and written at once. If the batch is invalid, its changes are applied one by one
+    so that each caller gets the error of its own change.
+    Batches of non overlapping dags are committed concurrently, up to COMMIT_MAX_CONCURRENT_BATCHES at once, so a batch
+    waiting for a lock does not hold back the others. Changes on overlapping dags are applied in their submission
+    order, in distinct batches.
+    """
+
+    def __init__(self):
+        self._pending: List[_PendingChange] = []
+        self._running: Dict[asyncio.Task, List[str]] = {}  # dags of the batches being committed
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def submit(self, tasks_change: TasksChange) -> DbTasksChange:
+        """
+        Applies the tasks change along with the changes submitted concurrently.
+        :return: the db changes performed for this tasks change
+        :raises: the errors of _apply_tasks_change for this tasks change or for its whole batch
+        """
+        pending_change = _PendingChange(tasks_change)
+        self._pending.append(pending_change)
+        self._schedule()
+        # a cancelled caller does not cancel the batch its change is part of
+        return await asyncio.shield(pending_change.result)
+
+    def _schedule(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _pop_batch(self) -> List[_PendingChange]:
+        """Pops the oldest pending changes on non overlapping dags, that do not overlap with the batches running"""
+        batch: List[_PendingChange] = []
+        remaining: List[_PendingChange] = []
+        batch_dags: List[str] = []
+        # changes are kept behind running batches and pending changes of overlapping dags
+        blocked_dags: List[str] = [dag for running_dags in self._running.values() for dag in running_dags]
+        for pending_change in self._pending:
+            dags = pending_change.tasks_change.dags
+            if len(batch) < config.COMMIT_MAX_BATCH_SIZE and not any(
+                    are_dags_overlapping(dag, other_dag) for dag in dags for other_dag in batch_dags + blocked_dags):
+                batch.append(pending_change)
+                batch_dags.extend(dags)
+            else:
+                remaining.append(pending_change)
+                blocked_dags.extend(dags)
+        self._pending = remaining
+        return batch
+
+    async def _dispatch(self) -> None:
+        """Starts committing batches until the pending changes all wait for a running batch or the bound is reached"""
+        while self._pending and len(self._running) < config.COMMIT_MAX_CONCURRENT_BATCHES:
+            if len(self._pending) > 1:  # changes arrive concurrently : lets more of them join the batch
+                await asyncio.sleep(config.COMMIT_BATCH_WINDOW_MS / 1000)
+            batch = self._pop_batch()
+            if not batch:
+                return
+            commit = asyncio.create_task(self._commit(batch))
+            self._running[commit] = [dag for pending_change in batch for dag in pending_change.tasks_change.dags]
+            commit.add_done_callback(self._on_commit_done)
+
+    def _on_commit_done(self, commit: asyncio.Task) -> None:
+        del self._running[commit]
+        if self._pending:
+            self._schedule()
+
+    @staticmethod
+    async def _commit(batch: List[_PendingChange]) -> None:
+        with metrics.collect_spans() as spans:
+            for pending_change in batch:
+                pending_change.observe_queue_wait()
+                pending_change.batch_spans = spans
+            await TasksCommitQueue._commit_batch(batch)
+
+    @staticmethod
+    async def _commit_batch(batch: List[_PendingChange]) -> None:
+        if len(batch) > 1:
+            tasks_changes = [pending_change.tasks_change for pending_change in batch]
+            try:
+                db_changes = await _apply_tasks_change(_merge_tasks_changes(tasks_changes))
+            except (CyclesIntroduced, InconsistentTasksDependencies) as error:
+                logger.info(f"Batch of {len(batch)} tasks changes is invalid ({error.message}), "
+                            f"applying them one by one")
+            except Exception as error:
+                for pending_change in batch:
+                    pending_change.set_exception(error)
+                return
+            else:
+                for pending_change, split_db_changes in zip(batch, _split_db_changes(db_changes, tasks_changes)):
+                    pending_change.set_result(split_db_changes)
+                return
+        for pending_change in batch:
+            try:
+                pending_change.set_result(await _apply_tasks_change(pending_change.tasks_change))
+            except Exception as error:
+                pending_change.set_exception(error)
+
+
+tasks_commit_queue = TasksCommitQueue()
+
+
+def _get_page_etag(page: TasksPage) -> str:
+    """
+    Strong ETag of a page, derived from the content hashes of its tasks and from their children, which are not part of
+    the content hash as they are derived from the parents of other tasks
+    """
+    page_hash = hashlib.blake2b(digest_size=16)
+    for task in page.tasks:
+        page_hash.update(task.content_hash.encode())
+        page_hash.update("\0".join(["", *sorted(task.next_tasks_ids), ""]).encode())
+    page_hash.update((page.next_page_token or "").encode())
+    return f'"{page_hash.hexdigest()}"'
+
+
+def _is_etag_matching(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    return any(tag.strip() in ("*", etag) or tag.strip() == f"W/{etag}" for tag in if_none_match.split(","))
+
+
+async def _export_tasks(dag: Optional[str] = None) -> AsyncIterable[str]:
+    """Serializes tasks one json document per line, as they are read from the table"""
+    tasks = tasks_db.get_dag_tasks(dag) if dag is not None else tasks_db.get_all_tasks()
+    async for tasks_chunk in streaming.async_group(tasks, EXPORT_CHUNK_SIZE):
+        yield "".join(task.json() + "\n" for task in tasks_chunk)
+
+
+async def _read_ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterable[bytes]:
+    """Splits a stream of bytes into lines, holding at most one record in memory besides the current chunk"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > config.IMPORT_MAX_RECORD_BYTES:
+            raise ImportTooLarge(message=f"Records can not exceed {config.IMPORT_MAX_RECORD_BYTES} bytes.")
+        for line in lines:
+            yield line
+    yield buffer
+
+
+async def _read_import_change(dags: List[str], chunks: AsyncIterable[bytes]) -> TasksChange:
+    """
+    Builds a tasks change from newline delimited json tasks, validating each task as soon as its line is received.
+    :raises InvalidImportRecord: on the first invalid task, task outside of the dags or duplicated task
+    :raises ImportTooLarge: if a record or the number of tasks exceeds the import limits
+    """
+    dags_trie = DagTrie(dags)
+    tasks: Dict[str, Task] = {}
+    line_number = 0
+    async for line in _read_ndjson_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            task = Task.parse_raw(line)
+        except ValidationError as error:
+            raise InvalidImportRecord(message=f"Line {line_number} is not a valid task.", line_number=line_number,
+                                      errors=error.errors())
+        if not dags_trie.contains_task(task.id):
+            raise InvalidImportRecord(message=f"Task {task.id} is outside of edited dags.", line_number=line_number,
+                                      errors=[])
+        if task.id in tasks:
+            raise InvalidImportRecord(message=f"Task {task.id} is duplicated.", line_number=line_number, errors=[])
+        if len(tasks) >= config.IMPORT_MAX_TASKS:
+            raise ImportTooLarge(message=f"Imports can not exceed {config.IMPORT_MAX_TASKS} tasks.")
+        tasks[task.id] = task
+    # tasks have been validated one by one against the dags
+    return TasksChange.construct(dags=dags, tasks=list(tasks.values()))
+
+
+def _describe_db_changes(db_changes: DbTasksChange) -> str:
+    if not db_changes:
+        return "No changes to perform."
+    return f"Deleted task(s) :{db_changes.ids_to_remove}" \
+           f"\nUpdated tasks :{[task.id for task in db_changes.tasks_to_update]}"
+
+
 def add_tasks_resources(app: FastAPI):
     """Adds all resources for /tasks resources"""
 
     @app.get(ROUTE, response_model=TasksPage)
-    async def get(limit: int = 50, page_token: Optional[str] = None) -> TasksPage:
-        # todo add right handling
-        return await tasks_db.get_tasks_page(limit, page_token=page_token)
+    async def get(response: Response, limit: int = 50, page_token: Optional[str] = None, dag: Optional[str] = None,
+                  if_none_match: Optional[str] = Header(None)) -> Union[TasksPage, Response]:
+        try:
+            page = await tasks_db.get_tasks_page(limit, page_token=page_token, dag=dag)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        etag = _get_page_etag(page)
+        if _is_etag_matching(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return page
+
+    @app.get(EXPORT_ROUTE, response_class=StreamingResponse)
+    async def export(dag: Optional[str] = None) -> StreamingResponse:
+        """Streams all tasks, or the tasks of a dag, as newline delimited json"""
+        return StreamingResponse(_export_tasks(dag), media_type=NDJSON_MEDIA_TYPE)
+
+    @app.get(VALIDATION_ROUTE, response_model=GraphValidation)
+    async def validate() -> GraphValidation:
+        """Reports the orphan tasks and the cycles of the stored tasks graph, read from its snapshot if there is one"""
+        graph = await tasks_cache.get_graph()
+        return GraphValidation(
+            tasks_count=graph.tasks_count,
+            inconsistent_links=[(missing_parents_ids, task_id)
+                                for task_id, missing_parents_ids in get_orphan_tasks(graph)],
+            cycles=get_tasks_cycles(graph, max_cycles=config.MAX_REPORTED_CYCLES),
+        )
 
     @app.put(ROUTE, response_model=str)  # todo add documentation of errors
     async def put(tasks_change: TasksChange) -> str:
         # todo add right handling
-        await tasks_db.acquire_lock()
-        try:
-            current_tasks = {task.id: task async for task in tasks_db.get_all_tasks()}
-            db_changes = build_db_changes(current_tasks=current_tasks, change=tasks_change)
-            if not db_changes.tasks_to_update and not db_changes.ids_to_remove:
-                return "No changes to perform."
-            new_tasks_graph = build_new_tasks_graph(change=db_changes, current_tasks=current_tasks)
-            orphan_tasks = get_orphan_tasks(new_tasks_graph)
-            if orphan_tasks:
-                raise InconsistentTasksDependencies(
-                    message=f"Changes introduced inconsistent {len(orphan_tasks)} task(s) dependencies.",
-                    inconsistent_links=[(orphan.previous_tasks_ids, orphan.id) for orphan in orphan_tasks]
-                )
-            tasks_cycle = get_tasks_cycles(new_tasks_graph)
-            if tasks_cycle:
-                raise CyclesIntroduced(
-                    message=f"Modification would create {len(tasks_cycle)} tasks cycle(s).",
-                    cycles=[[task.id for task in cycle] for cycle in tasks_cycle],
-                )
-            print("updating tasks ")  # todo: properly log stuff here
-            await tasks_db.update_db(db_changes)
-        finally:
-            await tasks_db.release_lock()
-        return f"Deleted task(s) :{db_changes.ids_to_remove}" \
-               f"\nUpdated tasks :{[task.id for task in db_changes.tasks_to_update]}"
+        db_changes = await tasks_commit_queue.submit(tasks_change)
+        return _describe_db_changes(db_changes)
+
+    @app.put(IMPORT_ROUTE, response_model=str)
+    async def bulk_import(request: Request, dags: List[str] = Query(..., min_items=1)) -> str:
+        """
+        Replaces the tasks of the dags by the tasks of the request body, one json task per line.
+        Tasks are validated as they are received so large dags are never held as a single json document.
+        """
+        tasks_change = await _read_import_change(dags, request.stream())
+        db_changes = await tasks_commit_queue.submit(tasks_change)
+        return _describe_db_changes(db_changes)
 
     async def handle_put_error(request: Request, exception: Union[CyclesIntroduced, InconsistentTasksDependencies]):
         exception_data = {"error_type": type(exception).__name__}
@@ -67,5 +433,19 @@ def add_tasks_resources(app: FastAPI):
         # todo: log errors
         return JSONResponse(status_code=400, content=exception_data)
 
+    async def handle_lock_error(request: Request, exception: Union[DagsLocked, LeaseLost]):
+        exception_data = {"error_type": type(exception).__name__}
+        exception_data.update(exception.__dict__)
+        return JSONResponse(status_code=409, content=exception_data)
+
+    async def handle_import_error(request: Request, exception: Union[InvalidImportRecord, ImportTooLarge]):
+        exception_data = {"error_type": type(exception).__name__}
+        exception_data.update(exception.__dict__)
+        return JSONResponse(status_code=413 if isinstance(exception, ImportTooLarge) else 422, content=exception_data)
+
     app.exception_handler(CyclesIntroduced)(handle_put_error)
     app.exception_handler(InconsistentTasksDependencies)(handle_put_error)
+    app.exception_handler(DagsLocked)(handle_lock_error)
+    app.exception_handler(LeaseLost)(handle_lock_error)
+    app.exception_handler(InvalidImportRecord)(handle_import_error)
+    app.exception_handler(ImportTooLarge)(handle_import_error)
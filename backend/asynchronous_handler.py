@@ -1,6 +1,88 @@
-from typing import Type, Callable
+"""
+Execution of blocking calls, such as boto3 calls, outside of the event loop.
+
+Calls run in thread pools sized per kind of operation, so that scans, lock operations and batch writes do not compete
+for the same threads. Each pool reports its calls in flight, queued calls and queue wait time.
+"""
 import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import config
+import metrics
+
+_T = TypeVar("_T")
+
+CALLS_IN_FLIGHT = metrics.Gauge("streamflow_blocking_calls", "Blocking calls submitted and not finished, by pool.",
+                                label_names=("pool",))
+QUEUED_CALLS = metrics.Gauge("streamflow_blocking_queued_calls", "Blocking calls waiting for a thread, by pool.",
+                             label_names=("pool",))
+QUEUE_WAIT = metrics.Histogram("streamflow_blocking_queue_wait_seconds",
+                               "Time blocking calls waited for a thread, by pool.", label_names=("pool",))
+
+
+class BlockingPool:
+    """Thread pool running blocking calls for the event loop, at most max_workers at once"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.calls_in_flight = 0
+        self._calls_lock = threading.Lock()  # calls end in the threads of the pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"streamflow-{name}")
+        self._update_gauges()
+
+    def _add_calls(self, count: int) -> None:
+        with self._calls_lock:
+            self.calls_in_flight += count
+            self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        CALLS_IN_FLIGHT.set(self.calls_in_flight, pool=self.name)
+        QUEUED_CALLS.set(max(0, self.calls_in_flight - self.max_workers), pool=self.name)
+
+    async def run(self, function: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+        """Runs the function in the pool, with the context variables of the caller like asyncio.to_thread does"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+        started_at: Optional[float] = None
+
+        def call() -> _T:
+            nonlocal started_at
+            started_at = time.perf_counter()
+            return context.run(function, *args, **kwargs)
+
+        self._add_calls(1)
+        future = self._executor.submit(call)
+        # a cancelled caller does not stop a started call : it is in flight until its thread is done with it
+        future.add_done_callback(lambda _: self._add_calls(-1))
+        try:
+            return await asyncio.wrap_future(future, loop=loop)
+        finally:
+            if started_at is not None:
+                QUEUE_WAIT.observe(started_at - submitted_at, pool=self.name)
+
+
+read_pool = BlockingPool("read", config.READ_POOL_SIZE)
+write_pool = BlockingPool("write", config.WRITE_POOL_SIZE)
+lock_pool = BlockingPool("lock", config.LOCK_POOL_SIZE)
+
+
+def make_async(synchronous_function: Optional[Callable[..., _T]] = None, *,
+               pool: BlockingPool = read_pool) -> Callable[..., Awaitable[_T]]:
+    """
+    Makes a blocking function awaitable, its calls running in the pool.
+    Usable as `@make_async` or as `@make_async(pool=write_pool)`.
+    """
+    if synchronous_function is None:
+        return functools.partial(make_async, pool=pool)
 
-def make_async(synchronous_function: Callable[Any, _T]):
-    async def wrapper(*args, **kwargs):
-        return asyncio.to_thread(synchronous_function, *args, **kwargs)
+    @functools.wraps(synchronous_function)
+    async def wrapper(*args: Any, **kwargs: Any) -> _T:
+        return await pool.run(synchronous_function, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,74 @@
+"""
+Regression benchmark of the change planning on large graphs.
+Run from the backend folder with : `python -m benchmarks.bench_changes`
+"""
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from config import DAG_DELIMITER
+from api.tasks import _plan_tasks_change
+from graph.utils import get_children_index
+from model.db import DbTask
+from model.task_model import Task, TasksChange
+
+SIZES = (10_000, 50_000, 100_000)
+TASKS_PER_DAG = 200
+# planning is expected to be linear : 10 times more tasks should not cost much more than 10 times more time
+MAX_SCALING_RATIO = 20
+
+
+def make_graph(size: int, seed: int = 0) -> Dict[str, DbTask]:
+    """Generates dags of TASKS_PER_DAG tasks, each task depending on up to 2 previous tasks of its dag"""
+    rand = random.Random(seed)
+    tasks: Dict[str, DbTask] = {}
+    for task_index in range(size):
+        dag_index, position = divmod(task_index, TASKS_PER_DAG)
+        parents_positions = {rand.randrange(position) for _ in range(2)} if position else set()
+        task = DbTask.construct(
+            id=f"dag_{dag_index}{DAG_DELIMITER}task_{position}",
+            pod_template="template",
+            call_templates=None,
+            previous_tasks_ids=sorted(f"dag_{dag_index}{DAG_DELIMITER}task_{p}" for p in parents_positions),
+            next_tasks_ids=[],
+        )
+        tasks[task.id] = task
+    for parent_id, children_ids in get_children_index(tasks.values()).items():
+        tasks[parent_id].next_tasks_ids = children_ids
+    return tasks
+
+
+def make_change(tasks: Dict[str, DbTask]) -> TasksChange:
+    """Edits the first dag by appending one task"""
+    dag_tasks: List[Task] = [Task.construct(**task.dict(exclude={"next_tasks_ids"})) for task in tasks.values()
+                             if task.id.startswith(f"dag_0{DAG_DELIMITER}")]
+    dag_tasks.append(Task.construct(id=f"dag_0{DAG_DELIMITER}new_task", pod_template="template",
+                                    previous_tasks_ids=[dag_tasks[-1].id]))
+    return TasksChange.construct(dags=[f"dag_0{DAG_DELIMITER}"], tasks=dag_tasks)
+
+
+def bench_plan_tasks_change(size: int) -> Tuple[float, int]:
+    """Times the evaluation of the db changes along with the orphans and cycles checks"""
+    current_tasks = make_graph(size)
+    change = make_change(current_tasks)
+    start = time.perf_counter()
+    db_changes, _ = _plan_tasks_change(change, current_tasks)
+    return time.perf_counter() - start, len(db_changes)
+
+
+def main() -> int:
+    timings = {}
+    for size in SIZES:
+        duration, changes_count = bench_plan_tasks_change(size)
+        timings[size] = duration
+        print(f"plan_tasks_change {size:>7} tasks : {duration:8.3f}s ({changes_count} changes)")
+    ratio = timings[SIZES[-1]] / timings[SIZES[0]]
+    if ratio > MAX_SCALING_RATIO:
+        print(f"Planning does not scale linearly : x{ratio:.1f} for x{SIZES[-1] // SIZES[0]} tasks")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+Benchmark of the decoding of tasks table items, validated against trusted.
+Run from the backend folder with : `python -m benchmarks.bench_decoding`
+"""
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.bench_changes import make_graph
+from db.tasks import _serialize_downward_task, _deserialize_downward_task
+
+SIZE = 100_000
+# trusted decoding is expected to be several times faster than validated decoding
+MIN_SPEEDUP = 3
+
+
+def bench_decoding(items: List[Dict], trusted: bool) -> float:
+    start = time.perf_counter()
+    for item in items:
+        _deserialize_downward_task(item, trusted=trusted)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    items = [_serialize_downward_task(task) for task in make_graph(SIZE).values()]
+    validated_duration = bench_decoding(items, trusted=False)
+    trusted_duration = bench_decoding(items, trusted=True)
+    print(f"validated decoding {SIZE:>7} items : {validated_duration:8.3f}s")
+    print(f"trusted decoding   {SIZE:>7} items : {trusted_duration:8.3f}s")
+    speedup = validated_duration / trusted_duration
+    if speedup < MIN_SPEEDUP:
+        print(f"Trusted decoding is only x{speedup:.1f} faster than validated decoding")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
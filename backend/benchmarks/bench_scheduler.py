@@ -0,0 +1,46 @@
+"""
+Throughput benchmark of dag runs against an in memory runs table.
+Run from the backend folder with : `STREAMFLOW.TEST_MODE=True python -m benchmarks.bench_scheduler`
+"""
+import asyncio
+import sys
+import time
+from unittest import mock
+
+from config import DAG_DELIMITER
+from benchmarks.bench_changes import make_graph, TASKS_PER_DAG
+from model.db import DbTask
+from scheduler import run_dag
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+SIZE = 20_000
+# instances scheduled per second, table calls included
+MIN_THROUGHPUT = 1_000
+
+
+async def run_task(task: DbTask, run_id: str) -> None:
+    await asyncio.sleep(0)
+
+
+def main() -> int:
+    # nests the generated dags in a single dag of SIZE tasks
+    tasks = [DbTask.construct(**{**task.dict(), "id": f"dag{DAG_DELIMITER}{task.id}",
+                                 "previous_tasks_ids": [f"dag{DAG_DELIMITER}{parent_id}"
+                                                        for parent_id in task.previous_tasks_ids]})
+             for task in make_graph(SIZE).values()]
+    with mock.patch("db.runs.RUNS_TABLE", ThreadedTable(MemoryTable(page_size=1000))):
+        start = time.perf_counter()
+        report = asyncio.run(run_dag("dag", run_task, tasks=tasks))
+        duration = time.perf_counter() - start
+    throughput = report.succeeded_count / duration
+    print(f"run of {SIZE} instances ({SIZE // TASKS_PER_DAG} nested dags of {TASKS_PER_DAG}) : {duration:8.3f}s, "
+          f"{throughput:,.0f} instances/s")
+    if not report.succeeded or throughput < MIN_THROUGHPUT:
+        print(f"Scheduling throughput is below {MIN_THROUGHPUT} instances/s")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Generation of synthetic task graphs for the benchmarks. Graphs only depend on their parameters and seed.
+"""
+import random
+from typing import Dict, List
+
+from config import DAG_DELIMITER
+from graph.utils import get_children_index
+from model.db import DbTask
+from model.task_model import Task, TasksChange
+
+DAGS_PER_PARENT_DAG = 10
+
+
+def get_dag_name(dag_index: int, nesting: int) -> str:
+    """Name of the dag_index-th dag, nested nesting levels deep with DAGS_PER_PARENT_DAG dags per parent dag"""
+    return DAG_DELIMITER.join(f"dag_{dag_index // DAGS_PER_PARENT_DAG ** level}" for level in reversed(range(nesting)))
+
+
+def generate_tasks(size: int, dag_size: int = 200, depth: int = 10, fan_out: int = 2, nesting: int = 2,
+                   seed: int = 0) -> Dict[str, DbTask]:
+    """
+    Generates dags of dag_size tasks spread over depth layers. Each task depends on up to fan_out tasks of the previous
+    layer of its dag, so tasks have about fan_out children as well.
+    :param nesting: number of dag levels above the tasks
+    """
+    rand = random.Random(seed)
+    tasks: Dict[str, DbTask] = {}
+    for dag_index in range((size + dag_size - 1) // dag_size):
+        dag = get_dag_name(dag_index, nesting)
+        layers: List[List[str]] = [[] for _ in range(min(depth, dag_size))]
+        for position in range(min(dag_size, size - dag_index * dag_size)):
+            layer = position * len(layers) // dag_size
+            parents_ids = rand.sample(layers[layer - 1], min(fan_out, len(layers[layer - 1]))) if layer else []
+            task = DbTask.construct(
+                id=f"{dag}{DAG_DELIMITER}task_{position}",
+                pod_template="apiVersion: v1\nkind: Pod\nmetadata:\n  name: {{ task_id }}\n",
+                call_templates=None,
+                previous_tasks_ids=sorted(parents_ids),
+                next_tasks_ids=[],
+            )
+            layers[layer].append(task.id)
+            tasks[task.id] = task
+    for parent_id, children_ids in get_children_index(tasks.values()).items():
+        tasks[parent_id].next_tasks_ids = children_ids
+    return tasks
+
+
+def make_dag_change(tasks: Dict[str, DbTask], dag: str) -> TasksChange:
+    """Edits a dag the way a deploy does : a task is added below the last one, and a task without children is removed"""
+    prefix = f"{dag}{DAG_DELIMITER}"
+    dag_tasks = [task for task in tasks.values() if task.id.startswith(prefix)]
+    removed_task = next(task for task in dag_tasks if not task.next_tasks_ids)
+    new_tasks: List[Task] = [Task.construct(**task.dict(exclude={"next_tasks_ids"})) for task in dag_tasks
+                             if task is not removed_task]
+    new_tasks.append(Task.construct(id=f"{prefix}new_task", pod_template="template", call_templates=None,
+                                    previous_tasks_ids=[new_tasks[-1].id]))
+    return TasksChange.construct(dags=[dag], tasks=new_tasks)
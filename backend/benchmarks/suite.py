@@ -0,0 +1,163 @@
+"""
+Benchmark suite of the stages of PUT /tasks, against an in memory tasks table.
+Run from the backend folder with : `STREAMFLOW.TEST_MODE=True python -m benchmarks.suite`
+
+Graphs are generated from fixed seeds so results of two commits are comparable : save the results of each with
+--output and compare them with --compare.
+Each stage is timed over --repeat runs, and run once more under tracemalloc to measure its peak memory.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from api.tasks import ROUTE
+from benchmarks.generator import generate_tasks, make_dag_change, get_dag_name
+from db import tasks as tasks_db
+from db.cache import tasks_cache
+from graph.changes import build_new_graph, build_db_changes
+from graph.validation import get_orphan_tasks, get_tasks_cycles
+from main_api import app
+from model.db import DbTasksChange
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+
+class Stage(NamedTuple):
+    name: str
+    setup: Callable[[], Any]  # prepares a fresh state, not measured
+    run: Callable[[Any], Any]  # measured, given the result of setup
+
+
+class StageResult(NamedTuple):
+    name: str
+    duration: float
+    peak_memory: int
+
+
+def make_table(items: List[Dict], args: argparse.Namespace) -> MemoryTable:
+    return MemoryTable(items=items, page_size=args.page_size, latency=args.latency)
+
+
+def get_stages(args: argparse.Namespace) -> List[Stage]:
+    tasks = generate_tasks(args.size, dag_size=args.dag_size, depth=args.depth, fan_out=args.fan_out,
+                           nesting=args.nesting)
+    items = [tasks_db._serialize_downward_task(task) for task in tasks.values()]
+    change = make_dag_change(tasks, get_dag_name(0, args.nesting))
+    new_graph = build_new_graph(change, tasks)
+    db_changes = build_db_changes(change, tasks, new_graph)
+    all_tasks_change = DbTasksChange(ids_to_remove=set(), tasks_to_update=list(tasks.values()))
+
+    async def get_all_tasks():
+        return [task async for task in tasks_db.get_all_tasks()]
+
+    def run_with_table(table: MemoryTable, coroutine_function: Callable) -> Any:
+        with mock.patch("db.tasks.TASK_TABLE", ThreadedTable(table)):
+            return asyncio.run(coroutine_function())
+
+    def put_change(table: MemoryTable) -> None:
+        tasks_cache.clear()
+        with mock.patch("db.tasks.TASK_TABLE", ThreadedTable(table)):
+            response = TestClient(app).put(ROUTE, data=change.json())
+        assert response.status_code == 200, response.text
+
+    return [
+        Stage("build_new_graph", lambda: None, lambda _: build_new_graph(change, tasks)),
+        Stage("build_db_changes", lambda: None, lambda _: build_db_changes(change, tasks, new_graph)),
+        Stage("get_orphan_tasks", lambda: None, lambda _: get_orphan_tasks(new_graph)),
+        Stage("get_tasks_cycles", lambda: None, lambda _: get_tasks_cycles(new_graph)),
+        Stage("get_all_tasks", lambda: make_table(items, args), lambda table: run_with_table(table, get_all_tasks)),
+        Stage("update_db_dag_change", lambda: make_table(items, args),
+              lambda table: run_with_table(table, lambda: tasks_db.update_db(db_changes))),
+        Stage("update_db_full_table", lambda: make_table([], args),
+              lambda table: run_with_table(table, lambda: tasks_db.update_db(all_tasks_change))),
+        Stage("put_tasks", lambda: make_table(items, args), put_change),
+    ]
+
+
+def measure(stage: Stage, repeat: int) -> StageResult:
+    """Keeps the best duration of repeat runs, which is the least disturbed by the rest of the machine"""
+    durations = []
+    for _ in range(repeat):
+        state = stage.setup()
+        start = time.perf_counter()
+        stage.run(state)
+        durations.append(time.perf_counter() - start)
+    state = stage.setup()
+    tracemalloc.start()
+    try:
+        stage.run(state)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return StageResult(stage.name, min(durations), peak_memory)
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_graph_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Parameters results depend on"""
+    return {key: value for key, value in parameters.items() if key not in ("repeat", "stages", "output", "compare")}
+
+
+def print_results(results: List[StageResult], previous: Optional[Dict[str, Dict]] = None) -> None:
+    header = f"{'stage':<24}{'time (s)':>10}{'peak (MB)':>11}"
+    print(header + ("  time ratio  memory ratio" if previous else ""))
+    for result in results:
+        line = f"{result.name:<24}{result.duration:>10.3f}{result.peak_memory / 1e6:>11.1f}"
+        previous_result = (previous or {}).get(result.name)
+        if previous_result:
+            line += f"{result.duration / previous_result['duration']:>12.2f}" \
+                    f"{result.peak_memory / max(previous_result['peak_memory'], 1):>14.2f}"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000, help="number of tasks")
+    parser.add_argument("--dag-size", type=int, default=200, help="number of tasks per dag")
+    parser.add_argument("--depth", type=int, default=10, help="number of layers of tasks per dag")
+    parser.add_argument("--fan-out", type=int, default=2, help="number of parents, and children, per task")
+    parser.add_argument("--nesting", type=int, default=2, help="number of dag levels above the tasks")
+    parser.add_argument("--page-size", type=int, default=1000, help="items evaluated per scan or query call")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per table call")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage to time")
+    parser.add_argument("--stages", nargs="*", help="names of the stages to run, all by default")
+    parser.add_argument("--output", help="file to write the results to, as json")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stages = [stage for stage in get_stages(args) if not args.stages or stage.name in args.stages]
+    results = [measure(stage, args.repeat) for stage in stages]
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous_run = json.load(previous_file)
+        if get_graph_parameters(previous_run["parameters"]) != get_graph_parameters(vars(args)):
+            print(f"Warning : {args.compare} was run with other parameters")
+        previous = {result["name"]: result for result in previous_run["results"]}
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"commit": get_commit(), "parameters": vars(args),
+                       "results": [result._asdict() for result in results]}, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
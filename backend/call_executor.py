@@ -0,0 +1,199 @@
+"""
+Execution of the HTTP calls of call tasks.
+
+All calls share one pooled client keeping connections alive, so the thousands of calls triggered by an event reuse a
+few connections per host instead of opening one each. Concurrency is also bounded per host so a slow api can not use
+up the whole pool.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import backoff
+import httpx
+from jinja2 import Template, TemplateError
+
+import config
+from db import runs as runs_db
+from logs import logger
+from model.db import DbTask
+from model.task_model import CallTask
+from templates import templates_cache, compile_template
+
+REQUEST_ARGUMENTS = {"params", "headers", "cookies", "json", "content", "data"}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# errors raised before the request is sent, after which any call can be performed again
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_hosts_semaphores: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+
+
+class CallTemplateError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+
+class CallFailed(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        self.message = message
+        self.status_code = status_code
+
+
+class RetryableCallFailed(CallFailed):
+    """Failure of a call that may succeed if performed again"""
+
+
+# Client pool
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client of the running event loop, created at first use"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:  # connections are bound to the loop that opened them
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=config.CALL_MAX_CONNECTIONS,
+                                max_keepalive_connections=config.CALL_MAX_CONNECTIONS,
+                                keepalive_expiry=config.CALL_KEEPALIVE_SECONDS),
+            timeout=httpx.Timeout(config.CALL_TIMEOUT_SECONDS),
+        )
+        _client_loop = loop
+        _hosts_semaphores.clear()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client, _client_loop = None, None
+    _hosts_semaphores.clear()
+
+
+def _get_host_semaphore(url: httpx.URL) -> asyncio.Semaphore:
+    host = (url.scheme, url.host, url.port)
+    if host not in _hosts_semaphores:
+        _hosts_semaphores[host] = asyncio.Semaphore(config.CALL_MAX_CONNECTIONS_PER_HOST)
+    return _hosts_semaphores[host]
+
+
+# Rendering
+def _get_template(source: str, task_hash: Optional[str], path: str) -> Template:
+    return templates_cache.get(task_hash, path, source) if task_hash is not None else compile_template(source)
+
+
+def render_call(call_task: CallTask, context: Dict[str, Any],
+                task_hash: Optional[str] = None, call_index: int = 0) -> Tuple[str, Dict[str, Any]]:
+    """
+    Renders the url and the request arguments of a call
+    :param task_hash: content hash of the task of the call, to use compiled templates from the cache
+    :param call_index: position of the call in the call templates of the task
+    :raises CallTemplateError: if a template does not render or the arguments are not a json object of request arguments
+    """
+    try:
+        url = _get_template(call_task.url_template, task_hash, f"call_templates.{call_index}.url_template") \
+            .render(context)
+        rendered_arguments = _get_template(call_task.template, task_hash, f"call_templates.{call_index}.template") \
+            .render(context).strip()
+    except TemplateError as error:
+        raise CallTemplateError(message=f"Failed to render the templates of call {call_task.url_template}: {error}")
+    try:
+        arguments = json.loads(rendered_arguments) if rendered_arguments else {}
+    except ValueError as error:
+        raise CallTemplateError(message=f"Arguments of call {call_task.url_template} are not valid json: {error}")
+    if not isinstance(arguments, dict) or not set(arguments) <= REQUEST_ARGUMENTS:
+        raise CallTemplateError(message=f"Arguments of call {call_task.url_template} must be a json object "
+                                        f"with keys among {', '.join(sorted(REQUEST_ARGUMENTS))}")
+    return url, arguments
+
+
+# Calls
+async def _read_response(response: httpx.Response, keep_body: bool) -> Optional[bytes]:
+    """Streams the response body. The body is drained without being kept when it is not needed."""
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        if keep_body:
+            body.extend(chunk)
+            if len(body) > config.CALL_MAX_RESPONSE_BYTES:
+                raise CallFailed(message=f"Response of {response.url} exceeds {config.CALL_MAX_RESPONSE_BYTES} bytes",
+                                 status_code=response.status_code)
+    return bytes(body) if keep_body else None
+
+
+@backoff.on_exception(backoff.expo, (*UNSENT_REQUEST_ERRORS, RetryableCallFailed),
+                      max_tries=config.CALL_MAX_RETRIES + 1, jitter=backoff.full_jitter)
+async def perform_call(method: str, url: str, arguments: Dict[str, Any], keep_body: bool) -> Optional[bytes]:
+    """
+    Performs a call through the shared client, retrying connection errors and throttling.
+    Transport errors once the request is sent and server errors are only retried for idempotent methods : the server
+    may have processed the request already.
+    :raises CallFailed: if the response status is not a success
+    :return: the response body if it is kept
+    """
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    client = get_http_client()
+    request = client.build_request(method, url, **arguments)
+    async with _get_host_semaphore(request.url):
+        try:
+            response = await client.send(request, stream=True)
+            try:
+                if response.status_code == 429 or (idempotent and response.status_code >= 500):
+                    raise RetryableCallFailed(message=f"{method} {url} returned {response.status_code}",
+                                              status_code=response.status_code)
+                if response.is_error:
+                    raise CallFailed(message=f"{method} {url} returned {response.status_code}",
+                                     status_code=response.status_code)
+                return await _read_response(response, keep_body)
+            finally:
+                await response.aclose()
+        except UNSENT_REQUEST_ERRORS:
+            raise
+        except httpx.TransportError as error:
+            error_type = RetryableCallFailed if idempotent else CallFailed
+            raise error_type(message=f"{method} {url} failed: {error!r}")
+
+
+def _decode_response(body: bytes) -> Any:
+    text = body.decode(errors="replace")
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+async def execute_call_task(call_task: CallTask, context: Dict[str, Any],
+                            task_hash: Optional[str] = None, call_index: int = 0) -> Optional[Any]:
+    """
+    Renders and performs one call
+    :return: the decoded response data if the call is named, None otherwise
+    """
+    url, arguments = render_call(call_task, context, task_hash, call_index)
+    body = await perform_call(call_task.method, url, arguments, keep_body=call_task.response_name is not None)
+    if body is None:
+        return None
+    if call_task.log_response:
+        logger.info(f"Response {call_task.response_name} of {call_task.method} {url}: {body[:1000]!r}")
+    return _decode_response(body)
+
+
+async def run_call_task(task: DbTask, run_id: str) -> Dict[str, Any]:
+    """
+    Runs the calls of a task in order, as a scheduler task runner. Named responses are available to the templates of the
+    following calls under "responses", and written to the task instance when their call allows logging.
+    :return: the named responses data
+    """
+    if not task.call_templates:
+        raise ValueError(f"Task {task.id} has no call to perform")
+    responses: Dict[str, Any] = {}
+    logged_responses: List[Tuple[str, str]] = []
+    for call_index, call_task in enumerate(task.call_templates):
+        data = await execute_call_task(call_task, {"run_id": run_id, "task_id": task.id, "responses": responses},
+                                       task.content_hash, call_index)
+        if call_task.response_name is not None:
+            responses[call_task.response_name] = data
+            if call_task.log_response:
+                logged_responses.append((call_task.response_name, json.dumps(data)))
+    if logged_responses:
+        await runs_db.set_instance_responses(run_id, task.id, dict(logged_responses))
+    return responses
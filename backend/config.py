@@ -18,4 +18,39 @@ def _get_os_env_variable(environment_key: str, default: _Opt[str] = None) -> str
 LOGGING_LEVEL: str = getattr(_logging, _get_os_env_variable(f"LOGGING_LEVEL", "info").upper())
 TASKS_TABLE: str = _get_os_env_variable(f"TASKS_TABLE_NAME")
 TASKS_RUNS_TABLE: str = _get_os_env_variable(f"TASKS_RUNS_TABLE_NAME")
+TASKS_DAG_INDEX: str = _get_os_env_variable(f"TASKS_DAG_INDEX_NAME", "dag_index")
 DAG_DELIMITER: str = _get_os_env_variable(f"DAG_DELIMITER_CHAR", "/")
+MAX_REPORTED_CYCLES: int = int(_get_os_env_variable(f"MAX_REPORTED_CYCLES", "10"))
+SCAN_TOTAL_SEGMENTS: int = int(_get_os_env_variable(f"SCAN_TOTAL_SEGMENTS", "4"))
+SCAN_MAX_CONCURRENCY: int = int(_get_os_env_variable(f"SCAN_MAX_CONCURRENCY", "4"))
+WRITE_MAX_CONCURRENCY: int = int(_get_os_env_variable(f"WRITE_MAX_CONCURRENCY", "8"))
+WRITE_MAX_RETRIES: int = int(_get_os_env_variable(f"WRITE_MAX_RETRIES", "10"))
+LOCK_LEASE_SECONDS: int = int(_get_os_env_variable(f"LOCK_LEASE_SECONDS", "30"))
+LOCK_LEASE_SAFETY_MARGIN: int = int(_get_os_env_variable(f"LOCK_LEASE_SAFETY_MARGIN", "5"))
+LOCK_ACQUIRE_TIMEOUT: int = int(_get_os_env_variable(f"LOCK_ACQUIRE_TIMEOUT", "30"))
+COMMIT_BATCH_WINDOW_MS: int = int(_get_os_env_variable(f"COMMIT_BATCH_WINDOW_MS", "10"))
+COMMIT_MAX_BATCH_SIZE: int = int(_get_os_env_variable(f"COMMIT_MAX_BATCH_SIZE", "50"))
+COMMIT_MAX_CONCURRENT_BATCHES: int = int(_get_os_env_variable(f"COMMIT_MAX_CONCURRENT_BATCHES", "4"))
+IMPORT_MAX_TASKS: int = int(_get_os_env_variable(f"IMPORT_MAX_TASKS", "100000"))
+IMPORT_MAX_RECORD_BYTES: int = int(_get_os_env_variable(f"IMPORT_MAX_RECORD_BYTES", "1000000"))
+SCHEDULER_MAX_CONCURRENCY: int = int(_get_os_env_variable(f"SCHEDULER_MAX_CONCURRENCY", "64"))
+CALL_MAX_CONNECTIONS: int = int(_get_os_env_variable(f"CALL_MAX_CONNECTIONS", "100"))
+CALL_MAX_CONNECTIONS_PER_HOST: int = int(_get_os_env_variable(f"CALL_MAX_CONNECTIONS_PER_HOST", "10"))
+CALL_KEEPALIVE_SECONDS: int = int(_get_os_env_variable(f"CALL_KEEPALIVE_SECONDS", "30"))
+CALL_TIMEOUT_SECONDS: int = int(_get_os_env_variable(f"CALL_TIMEOUT_SECONDS", "30"))
+CALL_MAX_RETRIES: int = int(_get_os_env_variable(f"CALL_MAX_RETRIES", "3"))
+CALL_MAX_RESPONSE_BYTES: int = int(_get_os_env_variable(f"CALL_MAX_RESPONSE_BYTES", "300000"))
+TEMPLATES_CACHE_MAX_ENTRIES: int = int(_get_os_env_variable(f"TEMPLATES_CACHE_MAX_ENTRIES", "10000"))
+TEMPLATES_CACHE_MAX_BYTES: int = int(_get_os_env_variable(f"TEMPLATES_CACHE_MAX_BYTES", "64000000"))
+REQUEST_PROFILING: bool = _get_os_env_variable(f"REQUEST_PROFILING", "false").lower() == "true"
+READ_POOL_SIZE: int = int(_get_os_env_variable(f"READ_POOL_SIZE", "16"))
+WRITE_POOL_SIZE: int = int(_get_os_env_variable(f"WRITE_POOL_SIZE", "16"))
+LOCK_POOL_SIZE: int = int(_get_os_env_variable(f"LOCK_POOL_SIZE", "4"))
+STORAGE_BACKEND: str = _get_os_env_variable(f"STORAGE_BACKEND", "threaded").lower()
+DYNAMODB_ENDPOINT_URL: str = _get_os_env_variable(f"DYNAMODB_ENDPOINT_URL", "")
+DYNAMODB_MAX_CONNECTIONS: int = int(_get_os_env_variable(f"DYNAMODB_MAX_CONNECTIONS", "64"))
+DYNAMODB_KEEPALIVE_SECONDS: int = int(_get_os_env_variable(f"DYNAMODB_KEEPALIVE_SECONDS", "30"))
+DYNAMODB_TIMEOUT_SECONDS: int = int(_get_os_env_variable(f"DYNAMODB_TIMEOUT_SECONDS", "10"))
+DYNAMODB_MAX_RETRIES: int = int(_get_os_env_variable(f"DYNAMODB_MAX_RETRIES", "3"))
+GRAPH_SNAPSHOT_PATH: str = _get_os_env_variable(f"GRAPH_SNAPSHOT_PATH", "")
+GRAPH_SNAPSHOT_MAX_DELTAS: int = int(_get_os_env_variable(f"GRAPH_SNAPSHOT_MAX_DELTAS", "100"))
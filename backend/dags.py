@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Union, List
 
 from config import DAG_DELIMITER
 from model.db import DbTask
@@ -8,4 +8,36 @@ from model.task_model import Task
 def get_task_dag(task: Union[Task, DbTask], dag_level: int):
     """Get the dag in which a task belongs"""
     tasks_dags = task.id.split(DAG_DELIMITER)
-    return DAG_DELIMITER.join(tasks_dags[:min(dag_level+1, len(tasks_dags)-1)])
\ No newline at end of file
+    return DAG_DELIMITER.join(tasks_dags[:min(dag_level+1, len(tasks_dags)-1)])
+
+
+def get_task_id_dag(task_id: str) -> str:
+    """Get the most nested dag in which a task id belongs"""
+    return task_id.rsplit(DAG_DELIMITER, 1)[0]
+
+
+def get_task_id_dags(task_id: str) -> List[str]:
+    """Get all the dags in which a task id belongs, from the top level dag to the most nested one"""
+    dag_parts = task_id.split(DAG_DELIMITER)[:-1]
+    return [DAG_DELIMITER.join(dag_parts[:level]) for level in range(1, len(dag_parts) + 1)]
+
+
+def get_root_dag(dag: str) -> str:
+    """Get the top level dag of a dag or of a task id"""
+    return normalize_dag(dag).split(DAG_DELIMITER, 1)[0]
+
+
+def normalize_dag(dag: str) -> str:
+    """Strips the delimiters surrounding a dag id"""
+    return dag.strip(DAG_DELIMITER)
+
+
+def is_dag_nested(dag: str, parent_dag: str) -> bool:
+    """Indicates whether a dag is parent_dag itself or one of its nested dags"""
+    return dag == parent_dag or dag.startswith(parent_dag + DAG_DELIMITER)
+
+
+def are_dags_overlapping(first_dag: str, second_dag: str) -> bool:
+    """Indicates whether a dag is nested in the other one"""
+    first_dag, second_dag = normalize_dag(first_dag), normalize_dag(second_dag)
+    return is_dag_nested(first_dag, second_dag) or is_dag_nested(second_dag, first_dag)
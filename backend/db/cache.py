@@ -0,0 +1,152 @@
+from typing import Dict, Optional
+
+import config
+from asynchronous_handler import read_pool, write_pool
+from db import tasks as tasks_db
+from graph import snapshot
+from graph.compact import CompactGraph
+from graph.hashes import get_dags_hashes, update_dags_hashes
+from model.db import DbTask, DbTasksChange
+import metrics
+
+CACHE_LOOKUPS = metrics.Counter("streamflow_tasks_cache_lookups_total",
+                                "Lookups of the cached tasks, by result : hit or miss when the table is scanned again.",
+                                label_names=("result",))
+
+
+class TasksCache:
+    """
+    Process local copy of the tasks table keyed by the tasks table version.
+    The table is only scanned again when another writer bumped the version.
+    Cached tasks are replaced rather than mutated so writers of the process can keep on reading the tasks they got.
+    When GRAPH_SNAPSHOT_PATH is set, the structure of the graph is also kept in a snapshot file, from which get_graph
+    reads it without loading the tasks : changes of the process are appended to it as deltas.
+    Only get_graph reads the snapshot : writers need the tasks contents, which it does not hold. The snapshot and its
+    deltas are local files, shared by the processes of a host only.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.tasks: Dict[str, DbTask] = {}
+        self._dags_hashes: Optional[Dict[str, int]] = None
+        self._graph: Optional[CompactGraph] = None
+        self._graph_version: Optional[int] = None
+        self._snapshot_deltas: int = 0  # deltas appended by this process since it wrote the snapshot
+        self.hits: int = 0
+        self.misses: int = 0
+
+    async def get_tasks(self) -> Dict[str, DbTask]:
+        """Returns all tasks of the table, refreshing them if the cached version is outdated. Must not be mutated."""
+        await self._load_tasks()
+        return self.tasks
+
+    async def _load_tasks(self) -> bool:
+        """
+        Scans the tasks table if the cached version is outdated
+        :return: whether the tasks have been reloaded
+        """
+        version = await tasks_db.get_tasks_version()
+        if version == self.version:
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return False
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        self.tasks = {task.id: task async for task in tasks_db.get_all_tasks()}
+        self._dags_hashes = None
+        self.version = version
+        return True
+
+    def _get_tasks_graph(self) -> CompactGraph:
+        """Structure of the tasks returned by get_tasks"""
+        if self._graph is None or self._graph_version != self.version:
+            self._graph = CompactGraph((task.id, task.previous_tasks_ids) for task in self.tasks.values())
+            self._graph_version = self.version
+        return self._graph
+
+    async def _write_snapshot(self) -> None:
+        """Writes the snapshot of the cached tasks structure, dropping the deltas it includes"""
+        graph, version = self._get_tasks_graph(), self.version
+        await write_pool.run(snapshot.write_snapshot, config.GRAPH_SNAPSHOT_PATH, graph, version)
+        await write_pool.run(snapshot.drop_deltas, config.GRAPH_SNAPSHOT_PATH, version)
+        self._snapshot_deltas = 0
+
+    async def get_graph(self) -> CompactGraph:
+        """
+        Returns the structure of the tasks graph at the current table version. Must not be mutated.
+        It is built from the cached tasks if they are current, and read from the snapshot and its deltas otherwise.
+        The table is scanned and the snapshot written again if neither reaches the current version.
+        """
+        version = await tasks_db.get_tasks_version()
+        if self._graph is not None and self._graph_version is not None and self._graph_version >= version:
+            return self._graph
+        if version != self.version and config.GRAPH_SNAPSHOT_PATH:
+            loaded_graph = await read_pool.run(snapshot.load_graph, config.GRAPH_SNAPSHOT_PATH)
+            if loaded_graph is not None and loaded_graph[1] >= version:  # newer versions were committed meanwhile
+                self._graph, self._graph_version = loaded_graph
+                return self._graph
+        if await self._load_tasks() and config.GRAPH_SNAPSHOT_PATH:
+            await self._write_snapshot()
+        return self._get_tasks_graph()
+
+    def get_dags_hashes(self) -> Dict[str, int]:
+        """Returns the aggregated content hashes of the dags of the tasks returned by get_tasks. Must not be mutated."""
+        if self._dags_hashes is None:
+            self._dags_hashes = get_dags_hashes(self.tasks.values())
+        return self._dags_hashes
+
+    async def begin_changes(self) -> int:
+        """
+        Bumps the table version before changes are written, then bumped again by apply_changes once they are.
+        A process which cached the tasks before the write reloads them even if the writer dies halfway through.
+        :return: the bumped version, to give to apply_changes
+        """
+        begun_version = await tasks_db.bump_tasks_version()
+        if config.GRAPH_SNAPSHOT_PATH:  # keeps the deltas versions contiguous : the structure changes with the next one
+            delta = snapshot.GraphDelta(version=begun_version, removed_ids=[], tasks_parents={})
+            await write_pool.run(snapshot.append_delta, config.GRAPH_SNAPSHOT_PATH, delta)
+        return begun_version
+
+    async def apply_changes(self, db_changes: DbTasksChange, begun_version: int) -> None:
+        """
+        Bumps the table version once db_changes are written and applies them to the cached tasks
+        :param begun_version: version returned by begin_changes before the write
+        """
+        new_version = await tasks_db.bump_tasks_version()
+        if config.GRAPH_SNAPSHOT_PATH:
+            delta = snapshot.GraphDelta(
+                version=new_version,
+                removed_ids=sorted(db_changes.ids_to_remove),
+                tasks_parents={task.id: task.previous_tasks_ids for task in db_changes.tasks_to_update},
+            )
+            await write_pool.run(snapshot.append_delta, config.GRAPH_SNAPSHOT_PATH, delta)
+            self._snapshot_deltas += 1
+        if self.version is None or begun_version != self.version + 1 or new_version != begun_version + 1:
+            self.clear()  # another writer bumped the version in between
+            return
+        tasks = dict(self.tasks)
+        replaced_tasks = [tasks.pop(task_id) for task_id in db_changes.ids_to_remove if task_id in tasks]
+        replaced_tasks.extend(tasks[task.id] for task in db_changes.tasks_to_update if task.id in tasks)
+        tasks.update({task.id: task for task in db_changes.tasks_to_update})
+        if self._dags_hashes is not None:
+            dags_hashes = dict(self._dags_hashes)
+            update_dags_hashes(dags_hashes, removed_tasks=replaced_tasks, added_tasks=db_changes.tasks_to_update)
+            self._dags_hashes = dags_hashes
+        self.tasks, self.version = tasks, new_version
+        if config.GRAPH_SNAPSHOT_PATH and self._snapshot_deltas >= config.GRAPH_SNAPSHOT_MAX_DELTAS:
+            await self._write_snapshot()
+
+    async def invalidate(self) -> None:
+        """Bumps the table version after a failed write so that every process reloads the table"""
+        self.clear()
+        await tasks_db.bump_tasks_version()
+
+    def clear(self) -> None:
+        """Drops the cached tasks of this process only"""
+        self.version = None
+        self.tasks = {}
+        self._dags_hashes = None
+        self._graph, self._graph_version = None, None
+
+
+tasks_cache = TasksCache()
@@ -1,5 +1,10 @@
 import boto3
+from botocore.config import Config
 
 import config
 
-dynamodb = boto3.resource("dynamodb") if not config.TEST_ENV else None
+# one connection per thread of the pools running the calls, instead of the 10 connections urllib3 pools by default
+dynamodb = boto3.resource(
+    "dynamodb",
+    config=Config(max_pool_connections=config.READ_POOL_SIZE + config.WRITE_POOL_SIZE + config.LOCK_POOL_SIZE),
+) if not config.TEST_ENV else None
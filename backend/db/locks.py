@@ -0,0 +1,302 @@
+"""
+Hierarchical leases on dags, stored as items of the tasks table.
+
+Locking a dag exclusively registers an intent on each of its parent dags : a dag can not be locked while one of its
+parent dags is locked or while one of its children dags holds an intent on it.
+Holders liveness is tracked by one lease item per holder, renewed in background. Locks of holders which lease item
+expired are reclaimed by the next writer so a crashed writer can not stall the others.
+The lease item fences the writes of its holder : a reclaiming writer deletes it before taking over any of its locks, and
+writes under a lease are conditioned on its lease item still existing. A writer which lease was reclaimed can then not
+overwrite its successor, and writers of unrelated dags do not check any common item.
+"""
+import asyncio
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Callable, Awaitable
+
+import backoff
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import config
+from asynchronous_handler import lock_pool
+from config import DAG_DELIMITER
+from dags import normalize_dag, is_dag_nested
+from db import tasks as tasks_db
+from db import writes
+from logs import logger
+import metrics
+
+LOCK_RETRIES = metrics.Counter("streamflow_lock_retries_total", "Retries of operations failing on locked dags.",
+                               label_names=("operation",))
+
+
+class DagsLocked(Exception):
+    def __init__(self, message: str, dags: List[str]):
+        self.message = message
+        self.dags = dags
+
+
+class LeaseLost(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+
+class DagsLease:
+    """Lease held on a set of dags until it is released or expires"""
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.dags: List[str] = []
+        self.intents: Set[str] = set()
+        self.expires_at: float = 0.
+        self.lost: bool = False
+        self.heartbeat: Optional[asyncio.Task] = None
+
+    def covers(self, dag: str) -> bool:
+        """Indicates whether the dag is one of the locked dags or is nested in one of them"""
+        return any(is_dag_nested(normalize_dag(dag), locked_dag) for locked_dag in self.dags)
+
+    def ensure_held(self) -> None:
+        """
+        Checks locally that the lease has not expired nor been reclaimed. Must be called before each write.
+        :raises LeaseLost: if the lease may have been reclaimed by another writer
+        """
+        if self.lost or time.time() > self.expires_at - config.LOCK_LEASE_SAFETY_MARGIN:
+            raise LeaseLost(message=f"Lease {self.owner} on dags {self.dags} has expired.")
+
+    def get_fencing_check(self, table_name: str) -> Dict:
+        """Transaction condition check that the lease item has not been deleted by a writer reclaiming its locks"""
+        return {'ConditionCheck': {
+            'TableName': table_name,
+            'Key': _lease_key(self.owner),
+            'ConditionExpression': 'attribute_exists(#id)',  # boto3 only builds the conditions of top level parameters
+            'ExpressionAttributeNames': {'#id': 'id'},
+        }}
+
+
+# Utils
+def _get_parent_dags(dag: str) -> List[str]:
+    dag_parts = dag.split(DAG_DELIMITER)
+    return [DAG_DELIMITER.join(dag_parts[:level]) for level in range(1, len(dag_parts))]
+
+
+def normalize_dags(dags: Iterable[str]) -> List[str]:
+    """Sorted dags to lock, without the dags nested in another one of the list"""
+    normalized_dags: List[str] = []
+    for dag in sorted({normalize_dag(dag) for dag in dags} - {""}):
+        if not any(is_dag_nested(dag, kept_dag) for kept_dag in normalized_dags):
+            normalized_dags.append(dag)
+    return normalized_dags
+
+
+def _lock_key(dag: str) -> Dict[str, str]:
+    return {'id': f"{tasks_db.LOCK_TASK_ID}{DAG_DELIMITER}{dag}"}
+
+
+def _lease_key(owner: str) -> Dict[str, str]:
+    return {'id': f"{tasks_db.LEASE_KEY_PREFIX}{owner}"}
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+# Lease item
+@backoff.on_exception(backoff.expo, ClientError, factor=0.05, max_value=1, jitter=backoff.full_jitter,
+                      max_time=lambda: config.LOCK_LEASE_SECONDS / 3,
+                      giveup=lambda error: not writes.is_transaction_conflict(error))
+async def _renew_lease(lease: DagsLease, create: bool = False) -> None:
+    """
+    Extends the lease expiry. Renewal fails if the lease has expired in between as it may have been reclaimed.
+    It is retried while it conflicts with a write of the lease, which checks the lease item in a transaction.
+    """
+    expires_at = time.time() + config.LOCK_LEASE_SECONDS
+    condition = Attr('id').not_exists() if create else Attr('expires_at').gte(_now_ms())
+    await tasks_db.TASK_TABLE.update_item(
+        pool=lock_pool,
+        Key=_lease_key(lease.owner),
+        UpdateExpression='SET expires_at = :expires_at',
+        ConditionExpression=condition,
+        ExpressionAttributeValues={':expires_at': int(expires_at * 1000)},
+    )
+    lease.expires_at = expires_at
+
+
+async def _keep_alive(lease: DagsLease) -> None:
+    """Renews the lease until cancelled or lost"""
+    while True:
+        await asyncio.sleep(config.LOCK_LEASE_SECONDS / 3)
+        try:
+            await _renew_lease(lease)
+        except ClientError as error:
+            if writes.is_condition_failure(error):
+                lease.lost = True
+                logger.error(f"Lease {lease.owner} on dags {lease.dags} expired before being renewed")
+                return
+            logger.warning(f"Failed to renew lease {lease.owner}: {error}")
+
+
+async def _reclaim_lease(owner: str) -> bool:
+    """
+    Deletes the lease item of a holder if it expired, which fences the writes of the holder.
+    :return: whether the lease is reclaimed, False if the holder is alive
+    """
+    try:
+        await tasks_db.TASK_TABLE.delete_item(
+            pool=lock_pool,
+            Key=_lease_key(owner),
+            ConditionExpression=Attr('id').not_exists() | Attr('expires_at').lt(_now_ms()),
+        )
+        return True
+    except ClientError as error:
+        # a write of the holder in progress also involves its lease item : the holder is not considered dead
+        if writes.is_condition_failure(error) or writes.is_transaction_conflict(error):
+            return False
+        raise
+
+
+# Locks items
+async def _lock_exclusively(lease: DagsLease, dag: str) -> None:
+    await tasks_db.TASK_TABLE.update_item(
+        pool=lock_pool,
+        Key=_lock_key(dag),
+        UpdateExpression='SET #owner = :owner',
+        ConditionExpression=(
+            Attr('owner').not_exists()
+            & (Attr('intents').not_exists() | Attr('intents').eq({lease.owner}))
+        ),
+        ExpressionAttributeNames={'#owner': 'owner'},
+        ExpressionAttributeValues={':owner': lease.owner},
+    )
+    lease.dags.append(dag)
+
+
+async def _lock_intent(lease: DagsLease, dag: str) -> None:
+    await tasks_db.TASK_TABLE.update_item(
+        pool=lock_pool,
+        Key=_lock_key(dag),
+        UpdateExpression='ADD intents :owners',
+        ConditionExpression=Attr('owner').not_exists(),
+        ExpressionAttributeValues={':owners': {lease.owner}},
+    )
+    lease.intents.add(dag)
+
+
+async def _unlock_exclusively(owner: str, dag: str) -> None:
+    await tasks_db.TASK_TABLE.update_item(
+        pool=lock_pool,
+        Key=_lock_key(dag),
+        UpdateExpression='REMOVE #owner',
+        ConditionExpression=Attr('owner').eq(owner),
+        ExpressionAttributeNames={'#owner': 'owner'},
+    )
+
+
+async def _unlock_intent(owner: str, dag: str) -> None:
+    await tasks_db.TASK_TABLE.update_item(
+        pool=lock_pool,
+        Key=_lock_key(dag),
+        UpdateExpression='DELETE intents :owners',
+        ExpressionAttributeValues={':owners': {owner}},
+    )
+
+
+async def _reclaim_dead_locks(lease: DagsLease, dag: str) -> bool:
+    """
+    Removes the locks of dead holders on a dag, once their lease item is deleted. The tasks version is then bumped as a
+    dead holder may have died halfway through a write : every process reloads the tasks.
+    :return: whether a lock has been reclaimed
+    """
+    response = await tasks_db.TASK_TABLE.get_item(pool=lock_pool, Key=_lock_key(dag), ConsistentRead=True)
+    lock_item = response.get('Item', {})
+    reclaimed = False
+    if lock_item.get('owner') and lock_item['owner'] != lease.owner and await _reclaim_lease(lock_item['owner']):
+        logger.warning(f"Reclaiming lock on dag {dag} from expired holder {lock_item['owner']}")
+        try:
+            await _unlock_exclusively(lock_item['owner'], dag)
+            reclaimed = True
+        except ClientError as error:
+            if not writes.is_condition_failure(error):
+                raise
+    for holder in lock_item.get('intents', set()) - {lease.owner}:
+        if await _reclaim_lease(holder):
+            logger.warning(f"Reclaiming intent on dag {dag} from expired holder {holder}")
+            await _unlock_intent(holder, dag)
+            reclaimed = True
+    if reclaimed:
+        await tasks_db.bump_tasks_version()
+    return reclaimed
+
+
+async def _try_lock(lock: Callable[[DagsLease, str], Awaitable[None]], lease: DagsLease, dag: str) -> bool:
+    """:return: False if the lock is held by another writer"""
+    try:
+        await lock(lease, dag)
+        return True
+    except ClientError as error:
+        if writes.is_condition_failure(error):
+            return False
+        raise
+
+
+async def _lock_dags(lease: DagsLease, dags: Iterable[str]) -> None:
+    """
+    Locks the dags not yet covered by the lease, in a global order.
+    :raises DagsLocked: if one of the dags is held by a live writer. Locks already taken are kept in the lease.
+    """
+    dags_to_lock = [dag for dag in normalize_dags(dags) if not lease.covers(dag)]
+    steps = {parent_dag: _lock_intent for dag in dags_to_lock for parent_dag in _get_parent_dags(dag)
+             if parent_dag not in lease.intents}
+    steps.update({dag: _lock_exclusively for dag in dags_to_lock})
+    for dag in sorted(steps):
+        if not await _try_lock(steps[dag], lease, dag) \
+                and not (await _reclaim_dead_locks(lease, dag) and await _try_lock(steps[dag], lease, dag)):
+            raise DagsLocked(message=f"Dag {dag} is locked by another writer.", dags=dags_to_lock)
+
+
+# Lease
+@backoff.on_exception(backoff.expo, DagsLocked, factor=0.1, max_value=2, jitter=backoff.full_jitter,
+                      max_time=lambda: config.LOCK_ACQUIRE_TIMEOUT,
+                      on_backoff=lambda _: LOCK_RETRIES.inc(operation="acquire"))
+async def acquire_dags_lease(dags: Iterable[str]) -> DagsLease:
+    """
+    Locks the dags for the current writer, waiting for other writers of these dags to release them.
+    :raises DagsLocked: if dags are still locked after LOCK_ACQUIRE_TIMEOUT seconds
+    """
+    dags = list(dags)
+    lease = DagsLease(owner=uuid.uuid4().hex)
+    await _renew_lease(lease, create=True)
+    try:
+        await _lock_dags(lease, dags)
+    except BaseException:
+        await release_dags_lease(lease)
+        raise
+    lease.heartbeat = asyncio.create_task(_keep_alive(lease))
+    return lease
+
+
+async def extend_dags_lease(lease: DagsLease, dags: Iterable[str]) -> None:
+    """
+    Locks additional dags without waiting
+    :raises DagsLocked: if one of the dags is locked by another writer
+    """
+    lease.ensure_held()
+    await _lock_dags(lease, dags)
+
+
+async def release_dags_lease(lease: DagsLease) -> None:
+    """Releases all locks of the lease. Locks already reclaimed by other writers are left untouched."""
+    if lease.heartbeat is not None:
+        lease.heartbeat.cancel()
+    for dag in lease.dags:
+        try:
+            await _unlock_exclusively(lease.owner, dag)
+        except ClientError as error:
+            if not writes.is_condition_failure(error):
+                raise
+            logger.warning(f"Lock on dag {dag} was reclaimed from lease {lease.owner}")
+    for dag in lease.intents:
+        await _unlock_intent(lease.owner, dag)
+    await tasks_db.TASK_TABLE.delete_item(pool=lock_pool, Key=_lease_key(lease.owner))
+    lease.dags, lease.intents = [], set()
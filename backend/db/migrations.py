@@ -0,0 +1,64 @@
+"""
+Migrations of the tasks table layout. Run with `python -m db.migrations`.
+
+Dag index migration:
+1. apply the terraform module, which adds the dag index to the tasks table
+2. deploy the api : task items are then written with their dag attribute
+3. run this module to set the dag attribute of the task items written before. Items are only listed by the dag index
+   once they have this attribute.
+"""
+import asyncio
+from typing import Dict
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import config
+from dags import get_root_dag
+from db import tasks as tasks_db
+from logs import logger
+
+
+async def _set_item_dag(item_id: str, semaphore: asyncio.Semaphore) -> bool:
+    """:return: False if the item has been deleted in between"""
+    async with semaphore:
+        try:
+            await tasks_db.TASK_TABLE.update_item(
+                Key={'id': item_id},
+                UpdateExpression='SET #dag = :dag',
+                ConditionExpression=Attr('id').exists(),  # does not recreate tasks deleted since the scan
+                ExpressionAttributeNames={'#dag': tasks_db.DAG_ATTRIBUTE},
+                ExpressionAttributeValues={':dag': get_root_dag(item_id[len(tasks_db.TASK_KEY_PREFIX):])},
+            )
+            return True
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            return False
+
+
+async def add_tasks_dag_attribute(max_concurrency: int = config.WRITE_MAX_CONCURRENCY) -> int:
+    """
+    Sets the dag attribute of the task items missing it. Idempotent, it can be run while the api is serving.
+    :return: the number of migrated items
+    """
+    scan_args: Dict = dict(
+        ProjectionExpression='id',
+        FilterExpression=Attr('id').begins_with(tasks_db.TASK_KEY_PREFIX) & Attr(tasks_db.DAG_ATTRIBUTE).not_exists(),
+    )
+    semaphore = asyncio.Semaphore(max_concurrency)
+    migrated_count = 0
+    while True:
+        response = await tasks_db._scan_table(**scan_args)
+        results = await asyncio.gather(*(_set_item_dag(item['id'], semaphore) for item in response.get('Items', [])))
+        migrated_count += sum(results)
+        start_key = response.get('LastEvaluatedKey')
+        if start_key is None:
+            break
+        scan_args.update(ExclusiveStartKey=start_key)
+    logger.info(f"Set the dag attribute of {migrated_count} task item(s)")
+    return migrated_count
+
+
+if __name__ == "__main__":
+    asyncio.run(add_tasks_dag_attribute())
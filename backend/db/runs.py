@@ -0,0 +1,155 @@
+"""
+Dag runs state, stored in the tasks runs table.
+
+Each run has one run item and one instance item per task of the run. An instance item counts the parents of the task
+that have not succeeded yet in the run, and records the ones which did so that each parent is counted once : the update
+bringing the counter to zero is the one which starts the task.
+"""
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import backoff
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import config
+from config import DAG_DELIMITER
+from db import writes
+from db.storage import open_table
+
+RUNS_TABLE = open_table(config.TASKS_RUNS_TABLE) if not config.TEST_ENV else None
+RUN_KEY_PREFIX = "RUN-"
+INSTANCE_KEY_PREFIX = "TASK_INSTANCE-"
+assert not RUN_KEY_PREFIX.startswith(INSTANCE_KEY_PREFIX) and not INSTANCE_KEY_PREFIX.startswith(RUN_KEY_PREFIX), \
+    f'Invalid config : RUN_KEY_PREFIX "{RUN_KEY_PREFIX}" and INSTANCE_KEY_PREFIX "{INSTANCE_KEY_PREFIX}" overlap'
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+# Utils
+def _run_key(run_id: str) -> Dict[str, str]:
+    return {'id': f"{RUN_KEY_PREFIX}{run_id}"}
+
+
+def _instance_key(run_id: str, task_id: str) -> Dict[str, str]:
+    return {'id': f"{INSTANCE_KEY_PREFIX}{run_id}{DAG_DELIMITER}{task_id}"}
+
+
+# Runs
+@backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
+async def create_run(run_id: str, dag: str, tasks_count: int) -> None:
+    await RUNS_TABLE.put_item(
+        Item={**_run_key(run_id), 'dag': dag, 'tasks_count': tasks_count, 'state': RUNNING,
+              'started_at': int(time.time() * 1000)},
+        ConditionExpression=Attr('id').not_exists(),
+    )
+
+
+@backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
+async def end_run(run_id: str, state: str, succeeded_count: int, failed_count: int) -> None:
+    await RUNS_TABLE.update_item(
+        Key=_run_key(run_id),
+        UpdateExpression='SET #state = :state, succeeded_count = :succeeded, failed_count = :failed, '
+                         'ended_at = :ended_at',
+        ExpressionAttributeNames={'#state': 'state'},
+        ExpressionAttributeValues={':state': state, ':succeeded': succeeded_count, ':failed': failed_count,
+                                   ':ended_at': int(time.time() * 1000)},
+    )
+
+
+@backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
+async def get_run(run_id: str) -> Optional[Dict]:
+    response = await RUNS_TABLE.get_item(Key=_run_key(run_id), ConsistentRead=True)
+    return response.get('Item')
+
+
+# Instances
+async def create_instances(run_id: str,
+                           pending_parents: Dict[str, int],
+                           next_tasks_ids: Dict[str, List[str]],
+                           max_concurrency: int = config.WRITE_MAX_CONCURRENCY) -> None:
+    """
+    Writes the instance items of a run, in batches
+    :param pending_parents: number of parents of each task in the run, by task id
+    :param next_tasks_ids: ids of the tasks of the run depending on each task, by task id
+    :raises UnprocessedItemsError: if dynamodb keeps on not processing some items
+    """
+    await writes.write_in_batches(
+        ({'PutRequest': {'Item': {**_instance_key(run_id, task_id), 'run_id': run_id, 'task_id': task_id,
+                                  'state': PENDING, 'pending_parents': parents_count,
+                                  'next_tasks_ids': next_tasks_ids.get(task_id, [])}}}
+         for task_id, parents_count in pending_parents.items()),
+        lambda batch: writes.write_batch(RUNS_TABLE, batch),
+        max_concurrency,
+    )
+
+
+async def set_instance_state(run_id: str, task_id: str, state: str, expected_state: str) -> bool:
+    """
+    Moves an instance to a new state if it is in the expected state.
+    The update records a transition id, by which a retry following a lost success recognises its own update.
+    :return: False if the instance was not in the expected state, which means another worker already moved it
+    """
+    return await _update_instance_state(run_id, task_id, state, expected_state, transition_id=uuid.uuid4().hex)
+
+
+@backoff.on_exception(backoff.expo, ClientError, max_time=30, jitter=backoff.full_jitter)
+async def _update_instance_state(run_id: str, task_id: str, state: str, expected_state: str,
+                                 transition_id: str) -> bool:
+    try:
+        await RUNS_TABLE.update_item(
+            Key=_instance_key(run_id, task_id),
+            UpdateExpression='SET #state = :state, transition_id = :transition_id',
+            ConditionExpression=Attr('state').eq(expected_state),
+            ExpressionAttributeNames={'#state': 'state'},
+            ExpressionAttributeValues={':state': state, ':transition_id': transition_id},
+        )
+        return True
+    except ClientError as error:
+        if not writes.is_condition_failure(error):
+            raise
+    response = await RUNS_TABLE.get_item(Key=_instance_key(run_id, task_id), ConsistentRead=True)
+    return response.get('Item', {}).get('transition_id') == transition_id
+
+
+@backoff.on_exception(backoff.expo, ClientError, max_time=30, jitter=backoff.full_jitter,
+                      giveup=writes.is_condition_failure)
+async def decrement_pending_parents(run_id: str, task_id: str, parent_id: str) -> int:
+    """
+    Atomically records that a parent of the instance succeeded and decrements the counter of parents it still waits for.
+    Each parent is counted once : releasing a parent again, as a retry following a lost success does, returns the
+    current counter. The instance may then be reported ready twice, its state transition only starts it once.
+    :raises ClientError: ConditionalCheckFailedException if no parent is pending anymore
+    :return: the number of parents still pending
+    """
+    try:
+        response = await RUNS_TABLE.update_item(
+            Key=_instance_key(run_id, task_id),
+            UpdateExpression='ADD pending_parents :decrement, done_parents :parents',
+            ConditionExpression=Attr('pending_parents').gt(0) & ~Attr('done_parents').contains(parent_id),
+            ExpressionAttributeValues={':decrement': -1, ':parents': {parent_id}},
+            ReturnValues='UPDATED_NEW',
+        )
+        return int(response['Attributes']['pending_parents'])
+    except ClientError as error:
+        if not writes.is_condition_failure(error):
+            raise
+        response = await RUNS_TABLE.get_item(Key=_instance_key(run_id, task_id), ConsistentRead=True)
+        instance_item = response.get('Item', {})
+        if parent_id not in instance_item.get('done_parents', set()):
+            raise
+        return int(instance_item['pending_parents'])
+
+
+@backoff.on_exception(backoff.expo, ClientError, max_time=30, jitter=backoff.full_jitter)
+async def set_instance_responses(run_id: str, task_id: str, responses: Dict[str, str]) -> None:
+    """:param responses: json encoded responses data, by response name"""
+    await RUNS_TABLE.update_item(
+        Key=_instance_key(run_id, task_id),
+        UpdateExpression='SET responses = :responses',
+        ExpressionAttributeValues={':responses': responses},
+    )
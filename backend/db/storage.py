@@ -0,0 +1,297 @@
+"""
+Storage interface of the dynamodb tables, with two implementations selected by the STORAGE_BACKEND config:
+- "threaded" runs the calls of the boto3 Table resource in the thread pools of asynchronous_handler
+- "native" calls the dynamodb http api from the event loop, through a pooled async http client. It needs no thread per
+  call in flight, so a worker can run thousands of concurrent reads.
+
+Both take and return the same values as the boto3 Table resource : conditions built with boto3.dynamodb.conditions,
+python values, and ClientError exceptions.
+"""
+import abc
+import asyncio
+import copy
+import uuid
+from typing import Any, Dict, Optional
+
+import backoff
+import botocore.session
+import httpx
+from boto3.dynamodb.transform import TransformationInjector
+from botocore import parsers, serialize
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials, ReadOnlyCredentials
+from botocore.exceptions import ClientError
+
+import config
+from asynchronous_handler import BlockingPool, read_pool, write_pool
+
+THREADED_BACKEND = "threaded"
+NATIVE_BACKEND = "native"
+# client errors of throttled calls, which dynamodb answers with a 400 status
+THROTTLING_ERROR_CODES = {"ThrottlingException", "ProvisionedThroughputExceededException", "RequestLimitExceeded"}
+# operations which can be performed again once they may have reached dynamodb, besides the ones of _is_idempotent
+IDEMPOTENT_OPERATIONS = {"GetItem", "Query", "Scan", "BatchWriteItem"}
+# errors raised before the request is sent, after which any call can be performed again
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class AsyncTable(abc.ABC):
+    """
+    Awaitable version of the boto3 Table resource calls used by streamflow.
+    :param pool: thread pool of the call for the threaded implementation, ignored by the native one
+    """
+    name: str
+
+    @abc.abstractmethod
+    async def get_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def put_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def update_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def delete_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def scan(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def query(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        ...
+
+    @abc.abstractmethod
+    async def batch_write_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        """Batch write of the table items. Same arguments as the client call : RequestItems={table_name: requests}"""
+        ...
+
+    @abc.abstractmethod
+    async def transact_write_items(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        """Transactional write of the table items. Same arguments as the client call : TransactItems=[...]"""
+        ...
+
+
+class ThreadedTable(AsyncTable):
+    """Runs the calls of a boto3 Table resource, or of a stand-in of it, in thread pools"""
+
+    def __init__(self, table, read_calls_pool: BlockingPool = read_pool, write_calls_pool: BlockingPool = write_pool):
+        self.table = table
+        self.name = table.name
+        self.read_calls_pool = read_calls_pool
+        self.write_calls_pool = write_calls_pool
+
+    async def get_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.read_calls_pool).run(self.table.get_item, **kwargs)
+
+    async def put_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.write_calls_pool).run(self.table.put_item, **kwargs)
+
+    async def update_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.write_calls_pool).run(self.table.update_item, **kwargs)
+
+    async def delete_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.write_calls_pool).run(self.table.delete_item, **kwargs)
+
+    async def scan(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.read_calls_pool).run(self.table.scan, **kwargs)
+
+    async def query(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.read_calls_pool).run(self.table.query, **kwargs)
+
+    async def batch_write_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.write_calls_pool).run(self.table.meta.client.batch_write_item, **kwargs)
+
+    async def transact_write_items(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await (pool or self.write_calls_pool).run(self.table.meta.client.transact_write_items, **kwargs)
+
+
+class RetryableHttpError(Exception):
+    def __init__(self, message: str, response: Optional[httpx.Response]):
+        self.message = message
+        self.response = response
+
+
+class DynamoDbHttpClient:
+    """
+    Calls the dynamodb json api with a pooled httpx client keeping connections alive.
+    Requests are validated, serialized, signed and parsed by botocore, and values are transformed like boto3 does.
+    """
+
+    def __init__(self, region_name: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 max_connections: int = config.DYNAMODB_MAX_CONNECTIONS, credentials: Optional[Credentials] = None):
+        session = botocore.session.get_session()
+        self.region_name = region_name or session.get_config_variable("region")
+        self.endpoint_url = endpoint_url or f"https://dynamodb.{self.region_name}.amazonaws.com"
+        self.max_connections = max_connections
+        self._credentials = credentials or session.get_credentials()
+        self._frozen_credentials: Optional[ReadOnlyCredentials] = None
+        self._service_model = session.get_service_model("dynamodb")
+        self._serializer = serialize.create_serializer("json")
+        self._parser = parsers.create_parser("json")
+        self._injector = TransformationInjector()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._credentials_lock: Optional[asyncio.Lock] = None
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:  # connections are bound to the loop that opened them
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=config.DYNAMODB_KEEPALIVE_SECONDS),
+                timeout=httpx.Timeout(config.DYNAMODB_TIMEOUT_SECONDS),
+            )
+            self._client_loop = loop
+            # calls wait for a free connection here rather than in the pool, which only frees slots on close
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._credentials_lock = asyncio.Lock()
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client, self._client_loop, self._semaphore, self._credentials_lock = None, None, None, None
+
+    async def _get_frozen_credentials(self) -> ReadOnlyCredentials:
+        """Credentials of the signatures, refreshed only once they are about to expire"""
+        refresh_needed = getattr(self._credentials, "refresh_needed", None)  # static credentials never expire
+        async with self._credentials_lock:  # concurrent calls wait for one refresh
+            if self._frozen_credentials is None or (refresh_needed is not None and refresh_needed()):
+                # refreshing credentials may call the instance metadata endpoint, which blocks
+                self._frozen_credentials = await read_pool.run(self._credentials.get_frozen_credentials)
+        return self._frozen_credentials
+
+    async def _sign(self, request: AWSRequest) -> None:
+        SigV4Auth(await self._get_frozen_credentials(), "dynamodb", self.region_name).add_auth(request)
+
+    def _is_throttled(self, response: httpx.Response) -> bool:
+        if response.status_code != 400:
+            return False
+        parsed_error = self._parser.parse({"status_code": response.status_code, "headers": response.headers,
+                                           "body": response.content}, None)
+        return parsed_error.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+    @staticmethod
+    def _is_idempotent(operation_name: str, params: Dict) -> bool:
+        """
+        Indicates whether performing the call twice has the effect of performing it once. Updates may increment
+        counters, and conditional writes would fail on the item they wrote.
+        """
+        if operation_name in ("PutItem", "DeleteItem"):
+            return "ConditionExpression" not in params
+        return operation_name in IDEMPOTENT_OPERATIONS or "ClientRequestToken" in params
+
+    @backoff.on_exception(backoff.expo, (*UNSENT_REQUEST_ERRORS, RetryableHttpError),
+                          max_tries=config.DYNAMODB_MAX_RETRIES + 1, jitter=backoff.full_jitter)
+    async def _send(self, operation_name: str, request_dict: Dict, idempotent: bool) -> httpx.Response:
+        """
+        Signs and sends the serialized request, retrying connection errors and throttled calls.
+        Transport errors once the request is sent and server errors are only retried for idempotent calls : dynamodb
+        may have performed the call already.
+        """
+        request = AWSRequest(method=request_dict["method"], url=self.endpoint_url + request_dict["url_path"],
+                             data=request_dict["body"], headers=request_dict["headers"])
+        client = self._get_http_client()
+        await self._sign(request)  # signatures expire : each attempt is signed again
+        async with self._semaphore:
+            try:
+                response = await client.post(request.url, content=request.body, headers=dict(request.headers))
+            except UNSENT_REQUEST_ERRORS:
+                raise
+            except httpx.TransportError as error:
+                if not idempotent:
+                    raise
+                raise RetryableHttpError(message=f"Dynamodb {operation_name} call failed: {error!r}",
+                                         response=None) from error
+        if self._is_throttled(response) or (idempotent and response.status_code >= 500):
+            raise RetryableHttpError(message=f"Dynamodb {operation_name} call returned {response.status_code}",
+                                     response=response)
+        return response
+
+    async def call(self, operation_name: str, **params: Any) -> Dict:
+        """
+        Performs an api call
+        :raises ClientError: if dynamodb rejects the call
+        """
+        operation_model = self._service_model.operation_model(operation_name)
+        params = copy.deepcopy(params)  # transformed in place : the keys and items of the caller are left untouched
+        if operation_name == "TransactWriteItems":  # dynamodb performs a transaction sent again with its token once
+            params.setdefault("ClientRequestToken", uuid.uuid4().hex)
+        idempotent = self._is_idempotent(operation_name, params)
+        self._injector.inject_condition_expressions(params, operation_model)
+        self._injector.inject_attribute_value_input(params, operation_model)
+        request_dict = self._serializer.serialize_to_request(params, operation_model)
+        try:
+            response = await self._send(operation_name, request_dict, idempotent)
+        except RetryableHttpError as error:  # retries exhausted
+            if error.response is None:
+                raise error.__cause__
+            response = error.response  # raised as the ClientError of the last response
+        response_dict = {"status_code": response.status_code, "headers": response.headers, "body": response.content}
+        parsed_response = self._parser.parse(response_dict, operation_model.output_shape)
+        if response.status_code >= 300:
+            # fields of modeled errors, such as the cancellation reasons of transactions
+            error_shape = self._service_model.shape_for_error_code(parsed_response.get("Error", {}).get("Code"))
+            if error_shape is not None:
+                parsed_response.update(self._parser.parse(response_dict, error_shape))
+            raise ClientError(parsed_response, operation_name)
+        self._injector.inject_attribute_value_output(parsed_response, operation_model)
+        return parsed_response
+
+
+class NativeTable(AsyncTable):
+    """Table called through the dynamodb http api from the event loop"""
+
+    def __init__(self, name: str, client: DynamoDbHttpClient):
+        self.name = name
+        self.client = client
+
+    async def get_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("GetItem", TableName=self.name, **kwargs)
+
+    async def put_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("PutItem", TableName=self.name, **kwargs)
+
+    async def update_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("UpdateItem", TableName=self.name, **kwargs)
+
+    async def delete_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("DeleteItem", TableName=self.name, **kwargs)
+
+    async def scan(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("Scan", TableName=self.name, **kwargs)
+
+    async def query(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("Query", TableName=self.name, **kwargs)
+
+    async def batch_write_item(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("BatchWriteItem", **kwargs)
+
+    async def transact_write_items(self, pool: Optional[BlockingPool] = None, **kwargs) -> Dict:
+        return await self.client.call("TransactWriteItems", **kwargs)
+
+
+_http_client: Optional[DynamoDbHttpClient] = None
+
+
+def open_table(name: str) -> AsyncTable:
+    """Opens the table with the storage backend of the config. Native tables share one http client."""
+    global _http_client
+    if config.STORAGE_BACKEND == NATIVE_BACKEND:
+        if _http_client is None:
+            _http_client = DynamoDbHttpClient(endpoint_url=config.DYNAMODB_ENDPOINT_URL or None)
+        return NativeTable(name, _http_client)
+    if config.STORAGE_BACKEND != THREADED_BACKEND:
+        raise EnvironmentError(f'Invalid STORAGE_BACKEND "{config.STORAGE_BACKEND}", '
+                               f'expected "{THREADED_BACKEND}" or "{NATIVE_BACKEND}"')
+    from db.dynamodb import dynamodb
+    return ThreadedTable(dynamodb.Table(name))
@@ -1,52 +1,97 @@
-import itertools
-from typing import AsyncIterable, Optional, Dict
+import time
+from typing import AsyncIterable, Optional, Dict, List, Iterable, TYPE_CHECKING
 import asyncio
 
 import backoff
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 from pydantic import ValidationError
 
 import config
-from db.dynamodb import dynamodb
-from model.db import TasksPage, DbTasksChange, DbTask
-from model.pagination import serialize_token, deserialize_token
+from config import DAG_DELIMITER
+from dags import get_root_dag, normalize_dag
+from db import writes
+from db.storage import open_table
+from model.db import TasksPage, DbTasksChange, DbTask, DbWriteReport
+from model.task_model import CallTask
+from model.pagination import serialize_token, deserialize_token, DynamoPageToken
 from logs import logger
-import streaming
+import metrics
 
-TASK_TABLE = dynamodb.Table(config.TASKS_TABLE) if not config.TEST_ENV else None
+if TYPE_CHECKING:
+    from db.locks import DagsLease
+
+TASK_TABLE = open_table(config.TASKS_TABLE) if not config.TEST_ENV else None
 LOCK_TASK_ID = "TASK_LOCK"  # todo use this as env config variable
+LEASE_KEY_PREFIX = "TASK_LEASE-"
+VERSION_TASK_ID = "TASK_VERSION"
 TASK_KEY_PREFIX = "TASK-"
+DAG_ATTRIBUTE = "dag"  # hash key of the dag index, only set on task items
+HASH_ATTRIBUTE = "content_hash"
+assert DAG_ATTRIBUTE not in DbTask.__fields__, \
+    f'Invalid config : DAG_ATTRIBUTE "{DAG_ATTRIBUTE}" is a task field'
+assert HASH_ATTRIBUTE not in DbTask.__fields__, \
+    f'Invalid config : HASH_ATTRIBUTE "{HASH_ATTRIBUTE}" is a task field'
 assert not LOCK_TASK_ID.startswith(TASK_KEY_PREFIX), \
     f'Invalid config : LOCK_TASK_ID "{LOCK_TASK_ID}" begins with TASK_KEY_PREFIX "{TASK_KEY_PREFIX}"'
+assert not LEASE_KEY_PREFIX.startswith(TASK_KEY_PREFIX), \
+    f'Invalid config : LEASE_KEY_PREFIX "{LEASE_KEY_PREFIX}" begins with TASK_KEY_PREFIX "{TASK_KEY_PREFIX}"'
+assert not VERSION_TASK_ID.startswith(TASK_KEY_PREFIX), \
+    f'Invalid config : VERSION_TASK_ID "{VERSION_TASK_ID}" begins with TASK_KEY_PREFIX "{TASK_KEY_PREFIX}"'
+
+SCANNED_ITEMS = metrics.Counter("streamflow_scanned_items_total", "Items read by scans and queries of the tasks table.")
 
 
-# Lock
+# Version
 @backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
-async def acquire_lock():
-    """ Gets the lock on the tasks table to ensure tasks checks are ok for a given modification"""
-    await asyncio.to_thread(
-        TASK_TABLE.put_item,
-        Item={'id': LOCK_TASK_ID}, ConditionExpression='attribute_not_exists(id)'
-    )
+async def get_tasks_version() -> int:
+    """Gets the version of the tasks table. It is bumped by every writer once its changes are written."""
+    response = await TASK_TABLE.get_item(Key={'id': VERSION_TASK_ID}, ConsistentRead=True)
+    return int(response.get('Item', {}).get('version', 0))
 
 
 @backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
-async def release_lock():
-    """ Gets the lock on the tasks table to ensure tasks checks are ok"""
-    await asyncio.to_thread(TASK_TABLE.delete_item, Key={'id': LOCK_TASK_ID})
+async def bump_tasks_version() -> int:
+    """Increments the version of the tasks table and returns the new version"""
+    response = await TASK_TABLE.update_item(
+        Key={'id': VERSION_TASK_ID},
+        UpdateExpression='ADD #version :increment',
+        ExpressionAttributeNames={'#version': 'version'},
+        ExpressionAttributeValues={':increment': 1},
+        ReturnValues='UPDATED_NEW',
+    )
+    return int(response['Attributes']['version'])
 
 
 # Utils
-def _deserialize_downward_task(item: Dict, do_raise: bool = True) -> Optional[DbTask]:
+def _construct_downward_task(item: Dict) -> DbTask:
+    """Builds a DownTask from a trusted dynamodb item without running pydantic validation"""
+    values = {field: item[field] for field in DbTask.__fields__ if field in item}
+    values["id"] = values["id"][len(TASK_KEY_PREFIX):]
+    if values.get("call_templates"):
+        values["call_templates"] = [CallTask.construct(**call_template) for call_template in values["call_templates"]]
+    return DbTask.construct(**values)
+
+
+def _deserialize_downward_task(item: Dict, do_raise: bool = True, trusted: bool = False) -> Optional[DbTask]:
     """
     Transforms a dynamodb item into a DownTask
+    :param trusted: skips validation for items of the tasks table, which have been validated before being written.
+    Tasks are validated again when rebuilt by a change.
     :raises if the  key has a bad format
     """
     try:
-        clean_item = dict(item)
-        clean_item["id"] = item["id"][len(TASK_KEY_PREFIX):]
-        return DbTask(**clean_item)
+        if trusted:
+            task = _construct_downward_task(item)
+        else:
+            clean_item = dict(item)
+            clean_item["id"] = item["id"][len(TASK_KEY_PREFIX):]
+            clean_item.pop(DAG_ATTRIBUTE, None)
+            clean_item.pop(HASH_ATTRIBUTE, None)
+            task = DbTask(**clean_item)
+        if trusted and HASH_ATTRIBUTE in item:  # items written before content hashes are hashed on demand
+            task._content_hash = item[HASH_ATTRIBUTE]
+        return task
     except (ValidationError, TypeError, KeyError):
         logger.error(f"Failed to parse item {item}")
         if do_raise:
@@ -58,7 +103,8 @@ def _deserialize_downward_task(item: Dict, do_raise: bool = True) -> Optional[Db
 def _serialize_downward_task(task: DbTask) -> Dict:
     """Transforms a DownTask into a dynamodb item."""
     item = task.dict(exclude={"id"}, exclude_defaults=True)
-    item.update(id=TASK_KEY_PREFIX + task.id)
+    item.update(id=TASK_KEY_PREFIX + task.id,
+                **{DAG_ATTRIBUTE: get_root_dag(task.id), HASH_ATTRIBUTE: task.content_hash})
     return item
 
 
@@ -66,80 +112,210 @@ def _serialize_downward_task(task: DbTask) -> Dict:
 @backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
 async def _scan_table(**kwargs):
     """Dummy function to add backoff logic to table scan"""
-    return await asyncio.to_thread(TASK_TABLE.scan, **kwargs)
+    response = await TASK_TABLE.scan(**kwargs)
+    SCANNED_ITEMS.inc(response.get('ScannedCount', len(response.get('Items', []))))
+    return response
+
+
+async def _scan_segment(scan_args: Dict, segment: int, total_segments: int,
+                        pages: asyncio.Queue, semaphore: asyncio.Semaphore) -> None:
+    """
+    Scans one segment of the table page by page and puts each page items in the pages queue.
+    Puts None once the segment is fully scanned or the raised exception if the scan failed.
+    """
+    try:
+        segment_args = dict(scan_args, Segment=segment, TotalSegments=total_segments)
+        while True:
+            async with semaphore:
+                response = await _scan_table(**segment_args)
+            await pages.put(response.get('Items', []))
+            start_key = response.get('LastEvaluatedKey')
+            if start_key is None:
+                break
+            segment_args.update(ExclusiveStartKey=start_key)
+    except Exception as error:
+        await pages.put(error)
+    else:
+        await pages.put(None)
 
 
-async def get_all_tasks() -> AsyncIterable[DbTask]:  # todo: add option to filter on a given dag or list of dags
-    """ Get all tasks corresponding to filters"""
-    start_key = None
+async def get_all_tasks(total_segments: int = config.SCAN_TOTAL_SEGMENTS,
+                        max_concurrency: int = config.SCAN_MAX_CONCURRENCY
+                        ) -> AsyncIterable[DbTask]:
+    """
+    Get all tasks of the table. Use get_dag_tasks to read the tasks of a single dag.
+    The table is scanned in total_segments parallel segments, at most max_concurrency scan calls running at once.
+    """
     scan_args = dict(
-        ProjectionExpression=', '.join(sorted(DbTask.__fields__)),
-        KeyConditionExpression=Key('id').begins_with(TASK_KEY_PREFIX)
+        ProjectionExpression=', '.join(sorted([*DbTask.__fields__, HASH_ATTRIBUTE])),
+        FilterExpression=Attr('id').begins_with(TASK_KEY_PREFIX)
     )
+    pages = asyncio.Queue(maxsize=max_concurrency)  # bounds the number of pages held in memory
+    semaphore = asyncio.Semaphore(max_concurrency)
+    segments_scans = [
+        asyncio.create_task(_scan_segment(scan_args, segment, total_segments, pages, semaphore))
+        for segment in range(total_segments)
+    ]
+    remaining_segments = total_segments
+    scan_duration = 0.  # time waiting for pages, leaving out the time the caller spends on the yielded tasks
+    try:
+        while remaining_segments:
+            waited_at = time.perf_counter()
+            page = await pages.get()
+            scan_duration += time.perf_counter() - waited_at
+            if page is None:
+                remaining_segments -= 1
+                continue
+            if isinstance(page, Exception):
+                raise page
+            for task_data in page:
+                task = _deserialize_downward_task(task_data, do_raise=True, trusted=True)
+                if task is not None:
+                    yield task
+    finally:
+        for segment_scan in segments_scans:
+            segment_scan.cancel()
+        metrics.observe_stage("scan", scan_duration)
+
+
+@backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
+async def _query_dag_index(**kwargs):
+    """Dummy function to add backoff logic to dag index queries"""
+    response = await TASK_TABLE.query(IndexName=config.TASKS_DAG_INDEX, **kwargs)
+    SCANNED_ITEMS.inc(response.get('ScannedCount', len(response.get('Items', []))))
+    return response
+
+
+def _get_dag_key_condition(dag: str):
+    """Key condition of the dag index selecting the tasks of a dag, its nested dags included"""
+    return Key(DAG_ATTRIBUTE).eq(get_root_dag(dag)) \
+        & Key('id').begins_with(TASK_KEY_PREFIX + normalize_dag(dag) + DAG_DELIMITER)
+
+
+async def get_dag_tasks(dag: str) -> AsyncIterable[DbTask]:
+    """
+    Get the tasks of a dag and of its nested dags by querying the dag index.
+    The index is eventually consistent : the tasks cache remains the source for consistent reads.
+    """
+    query_args = dict(KeyConditionExpression=_get_dag_key_condition(dag))
     while True:
-        if start_key:
-            scan_args.update(ExclusiveStartKey=start_key)
-        response = await _scan_table(**scan_args)
+        response = await _query_dag_index(**query_args)
         for task_data in response.get('Items', []):
-            task = _deserialize_downward_task(task_data, do_raise=True)
-            if task is not None:
-                yield task
+            yield _deserialize_downward_task(task_data, do_raise=True, trusted=True)
         start_key = response.get('LastEvaluatedKey')
         if start_key is None:
             break
+        query_args.update(ExclusiveStartKey=start_key)
 
 
 async def get_tasks_page(page_size: int = 50,  # todo pass default page size in config
                          page_token: Optional[str] = None,
-                         filter_expression: Optional[str] = None) -> TasksPage:
-    """Store all tasks in dynamodb"""
-    scan_args = dict(
-        ProjectionExpression=', '.join(sorted(DbTask.__fields__)),
-        Limit=page_size,
-    )
-
+                         dag: Optional[str] = None) -> TasksPage:
+    """
+    Get a page of tasks from the dag index, querying the dag partition if a dag is given.
+    :param page_token: token of the previous page. The dag the token was issued for takes precedence over dag.
+    :raises ValueError: if the page token is invalid
+    """
+    read_args = dict(Limit=page_size)
     if page_token is not None:
         parsed_token = deserialize_token(page_token)
-        scan_args.update(ExclusiveStartKey=parsed_token.start_key)
-        scan_args.update(FilterExpression=parsed_token.filters)
-        if filter_expression is not None and filter_expression != parsed_token.filters:
-            logger.warn("filter_expression has been passed along with page_token and will be ignored")
-    elif filter_expression is not None:
-        scan_args.update(FilterExpression=filter_expression)
-    response = await _scan_table(**scan_args)
+        read_args.update(ExclusiveStartKey=parsed_token.start_key)
+        if dag is not None and dag != parsed_token.dag:
+            logger.warning("dag has been passed along with page_token and will be ignored")
+        dag = parsed_token.dag
+    if dag is not None:
+        response = await _query_dag_index(KeyConditionExpression=_get_dag_key_condition(dag), **read_args)
+    else:  # the index is sparse : only task items are scanned
+        response = await _scan_table(IndexName=config.TASKS_DAG_INDEX, **read_args)
     next_key = response.get('LastEvaluatedKey')
     return TasksPage(
-        tasks=[_deserialize_downward_task(task_data) for task_data in response.get('Items', [])],
-        next_page_token=serialize_token(next_key) if next_key else None,
+        tasks=[_deserialize_downward_task(task_data, trusted=True) for task_data in response.get('Items', [])],
+        next_page_token=serialize_token(DynamoPageToken(start_key=next_key, dag=dag)) if next_key else None,
     )
 
 
 # Updates
 
 
-@backoff.on_exception(backoff.constant, ClientError, interval=1, max_time=10)
-async def _batch_changes(tasks_list: DbTasksChange):
-    """Dummy function to add backoff & async logic to table batch write"""
-    await asyncio.to_thread(_sync_batch_changes, tasks_list)
+# a transaction holds the writes of a batch and the fencing check of the lease
+FENCED_BATCH_SIZE = writes.TRANSACT_WRITE_SIZE - 1
 
 
-def _sync_batch_changes(tasks_list: DbTasksChange):
-    """Dummy function to perform the write in db"""
-    with TASK_TABLE.batch_writer() as batch:
-        for task in tasks_list.tasks_to_update:
-            batch.put_item(Item=_serialize_downward_task(task))
-        for task_id in tasks_list.ids_to_remove:
-            batch.delete_item(Key={"id": task_id})
+def _is_fencing_failure(error: ClientError) -> bool:
+    reasons = error.response.get('CancellationReasons', [])
+    return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons)
 
 
-async def update_db(db_changes: DbTasksChange) -> None:
-    all_change_batches = streaming.group(
-        itertools.chain(db_changes.tasks_to_update, db_changes.ids_to_remove),
-        25  # dynamodb does not support more than 25 elements in a batch call at the moment
-    )
-    for change_batch_elements in all_change_batches:
-        task_change_batch = DbTasksChange(
-            tasks_to_update=[update for update in change_batch_elements if isinstance(update, DbTask)],
-            ids_to_remove={deletion for deletion in change_batch_elements if isinstance(deletion, str)},
+@backoff.on_exception(backoff.expo, ClientError, factor=0.05, max_value=1, jitter=backoff.full_jitter,
+                      max_tries=lambda: config.WRITE_MAX_RETRIES + 1,
+                      giveup=lambda error: not writes.is_transaction_conflict(error),
+                      on_backoff=lambda _: writes.TRANSACTION_CONFLICTS.inc(table=TASK_TABLE.name))
+@backoff.on_exception(backoff.expo, ClientError, max_time=30, jitter=backoff.full_jitter,
+                      giveup=lambda error: _is_fencing_failure(error) or writes.is_transaction_conflict(error))
+async def _transact_write_items(write_requests: List[Dict], lease: 'DagsLease') -> None:
+    """
+    Performs the requests in one transaction, conditioned on the lease item not having been reclaimed.
+    Transactions cancelled by a conflicting write, such as the renewal of the lease, are retried a few times only.
+    """
+    transact_items = [
+        {'Put': {'TableName': TASK_TABLE.name, **request['PutRequest']}} if 'PutRequest' in request
+        else {'Delete': {'TableName': TASK_TABLE.name, **request['DeleteRequest']}}
+        for request in write_requests
+    ]
+    await TASK_TABLE.transact_write_items(TransactItems=transact_items + [lease.get_fencing_check(TASK_TABLE.name)])
+
+
+async def _write_fenced_batch(write_requests: List[Dict], report: DbWriteReport, lease: 'DagsLease') -> None:
+    """Writes a batch of requests of dags locked by the lease, failing if the lease has been reclaimed since"""
+    lease.ensure_held()
+    report.batches += 1
+    writes.WRITTEN_BATCHES.inc(table=TASK_TABLE.name)
+    try:
+        await _transact_write_items(write_requests, lease)
+    except ClientError as error:
+        if not _is_fencing_failure(error):
+            raise
+        lease.lost = True  # another writer reclaimed the locks of the lease and deleted its lease item
+        lease.ensure_held()
+    report.items_written += len(write_requests)
+
+
+async def _write_phase(write_requests: Iterable[Dict], report: DbWriteReport,
+                       lease: Optional['DagsLease'], max_concurrency: int) -> None:
+    """
+    Writes all requests in batches, running at most max_concurrency batch calls at once.
+    The transactions of a lease all check its lease item, so they are written one at a time not to cancel each other.
+    """
+    if lease is not None:
+        await writes.write_in_batches(write_requests, lambda batch: _write_fenced_batch(batch, report, lease),
+                                      max_concurrency=1, batch_size=FENCED_BATCH_SIZE)
+    else:
+        await writes.write_in_batches(write_requests, lambda batch: writes.write_batch(TASK_TABLE, batch, report),
+                                      max_concurrency)
+
+
+async def update_db(db_changes: DbTasksChange,
+                    lease: Optional['DagsLease'] = None,
+                    max_concurrency: int = config.WRITE_MAX_CONCURRENCY) -> DbWriteReport:
+    """
+    Writes db_changes in the tasks table. Puts are all written before any deletion starts.
+    :param lease: lease on the changed dags. Batches are then written in transactions fenced by its lease item.
+    :raises UnprocessedItemsError: if dynamodb keeps on not processing some items
+    :raises LeaseLost: if the lease expired during the write
+    """
+    report = DbWriteReport()
+    start = time.perf_counter()
+    with metrics.span("write"):
+        await _write_phase(
+            ({'PutRequest': {'Item': _serialize_downward_task(task)}} for task in db_changes.tasks_to_update),
+            report, lease, max_concurrency
+        )
+        await _write_phase(
+            ({'DeleteRequest': {'Key': {'id': TASK_KEY_PREFIX + task_id}}}
+             for task_id in sorted(db_changes.ids_to_remove)),
+            report, lease, max_concurrency
         )
-        await _batch_changes(task_change_batch)
+    report.duration = time.perf_counter() - start
+    logger.info(f"Wrote {report.items_written} task(s) in {report.duration:.3f}s "
+                f"({report.throughput:.1f} items/s, {report.batches} batch calls, {report.retries} retries)")
+    return report
@@ -0,0 +1,102 @@
+"""
+Batch writes shared by the writers of the dynamodb tables.
+
+Requests are grouped in batches written by a bounded number of concurrent workers. Items dynamodb leaves unprocessed
+are resubmitted with a jittered exponential backoff.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import backoff
+from botocore.exceptions import ClientError
+
+import config
+from db.storage import AsyncTable
+from model.db import DbWriteReport
+import metrics
+import streaming
+
+BATCH_WRITE_SIZE = 25  # dynamodb does not support more than 25 elements in a batch call at the moment
+TRANSACT_WRITE_SIZE = 100  # dynamodb does not support more than 100 actions in a transaction
+
+WRITTEN_BATCHES = metrics.Counter("streamflow_written_batches_total",
+                                  "Batch write calls to the tables, retries included.", label_names=("table",))
+UNPROCESSED_ITEMS = metrics.Counter("streamflow_unprocessed_items_total",
+                                    "Items returned unprocessed by batch write calls to the tables.",
+                                    label_names=("table",))
+TRANSACTION_CONFLICTS = metrics.Counter("streamflow_transaction_conflicts_total",
+                                        "Writes cancelled as they overlapped a transaction in progress on an item.",
+                                        label_names=("table",))
+
+
+class UnprocessedItemsError(Exception):
+    def __init__(self, message: str, unprocessed_items: List[Dict]):
+        self.message = message
+        self.unprocessed_items = unprocessed_items
+
+
+def is_condition_failure(error: ClientError) -> bool:
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def is_transaction_conflict(error: ClientError) -> bool:
+    """Indicates whether the write was rejected as a transaction in progress involved one of its items"""
+    if error.response.get('Error', {}).get('Code') == 'TransactionConflictException':
+        return True
+    return any(reason.get('Code') == 'TransactionConflict' for reason in error.response.get('CancellationReasons', []))
+
+
+@backoff.on_exception(backoff.expo, ClientError, max_time=30, jitter=backoff.full_jitter)
+async def batch_write_item(table: AsyncTable, write_requests: List[Dict]) -> List[Dict]:
+    """Performs one BatchWriteItem call and returns the requests dynamodb did not process"""
+    response = await table.batch_write_item(RequestItems={table.name: write_requests})
+    return response.get('UnprocessedItems', {}).get(table.name, [])
+
+
+async def write_batch(table: AsyncTable, write_requests: List[Dict], report: Optional[DbWriteReport] = None,
+                      before_call: Optional[Callable[[], None]] = None) -> None:
+    """
+    Writes a batch of requests, resubmitting unprocessed items with a jittered exponential backoff
+    :param report: report counting the calls, retries and items written
+    :param before_call: called before each batch call, raises to stop writing
+    :raises UnprocessedItemsError: if dynamodb keeps on not processing some items
+    """
+    report = report if report is not None else DbWriteReport()
+    wait_times = backoff.expo(factor=0.05, max_value=5)
+    for _ in range(config.WRITE_MAX_RETRIES + 1):
+        if before_call is not None:
+            before_call()
+        report.batches += 1
+        WRITTEN_BATCHES.inc(table=table.name)
+        unprocessed_requests = await batch_write_item(table, write_requests)
+        report.items_written += len(write_requests) - len(unprocessed_requests)
+        if not unprocessed_requests:
+            return
+        report.unprocessed_items += len(unprocessed_requests)
+        UNPROCESSED_ITEMS.inc(len(unprocessed_requests), table=table.name)
+        report.retries += 1
+        write_requests = unprocessed_requests
+        await asyncio.sleep(backoff.full_jitter(next(wait_times)))
+    raise UnprocessedItemsError(
+        message=f"Dynamodb did not process {len(write_requests)} item(s) after {config.WRITE_MAX_RETRIES} retries.",
+        unprocessed_items=write_requests,
+    )
+
+
+async def write_in_batches(write_requests: Iterable[Dict],
+                           write: Callable[[List[Dict]], Awaitable[None]],
+                           max_concurrency: int = config.WRITE_MAX_CONCURRENCY,
+                           batch_size: int = BATCH_WRITE_SIZE) -> None:
+    """Writes all requests in batches with the write function, running at most max_concurrency batch calls at once"""
+    batches = streaming.group(write_requests, batch_size)
+
+    async def write_batches():
+        for batch in batches:  # the generator is shared by all workers so each batch is written once
+            await write(batch)
+
+    workers = [asyncio.create_task(write_batches()) for _ in range(max_concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
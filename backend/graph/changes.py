@@ -1,35 +1,61 @@
-from typing import List, Dict
+import itertools
+from typing import List, Dict, Optional
 
 from model.db import DbTasksChange, DbTask
+from graph.compact import CompactGraph
+from graph.dag_trie import DagTrie
 from graph.utils import is_task_in_dag
 from model.task_model import TasksChange
 
 
-def build_db_changes(change: TasksChange, current_tasks: Dict[str, DbTask]) -> DbTasksChange:
-    """Evaluate all changes that must be performed on task to apply the requested changes"""
-    deleted_tasks_ids = (
-        {task_id for task_id in current_tasks.keys() if is_task_in_dag(task_id, change.dags)}
-        - {task.id for task in change.tasks}
-    )
-    new_tasks_mixed = change.tasks + [task for task in current_tasks.values()
-                                      if not is_task_in_dag(task.id, change.dags)]
-    new_tasks_db = [
-        DbTask(
-            **task.dict(exclude={"next_tasks_ids"}, exclude_unset=True),
-            next_tasks_ids=sorted(other_task.id for other_task in new_tasks_mixed
-                                  if task.id in other_task.previous_tasks_ids)
-        )
-        for task in new_tasks_mixed
-    ]
+def build_new_graph(change: TasksChange, current_tasks: Dict[str, DbTask]) -> CompactGraph:
+    """Builds the structure of the tasks graph effective once the change is applied"""
+    dags = DagTrie(change.dags)
+    return CompactGraph(itertools.chain(
+        ((task.id, task.previous_tasks_ids) for task in current_tasks.values() if not is_task_in_dag(task.id, dags)),
+        ((task.id, task.previous_tasks_ids) for task in change.tasks),
+    ))
+
+
+def build_db_changes(change: TasksChange, current_tasks: Dict[str, DbTask],
+                     new_graph: Optional[CompactGraph] = None) -> DbTasksChange:
+    """
+    Evaluate all changes that must be performed on task to apply the requested changes.
+    Only tasks of the edited dags and parents whose children changed are considered.
+    Among them, only those which content hash or children differ from current_tasks are returned to be written.
+    :param new_graph: the graph built by build_new_graph for this change, built if not given
+    """
+    if new_graph is None:
+        new_graph = build_new_graph(change, current_tasks)
+    # current tasks of the edited dags are either deleted, hence missing from the new graph, or replaced
+    deleted_tasks_ids = {task_id for task_id in current_tasks if task_id not in new_graph}
+    current_dags_tasks = [current_tasks[task_id] for task_id in sorted(deleted_tasks_ids)]
+    current_dags_tasks.extend(current_tasks[task.id] for task in change.tasks if task.id in current_tasks)
+    parents_with_changed_children_ids = {parent_id for task in itertools.chain(change.tasks, current_dags_tasks)
+                                         for parent_id in task.previous_tasks_ids}
+    changed_tasks_ids = {task.id for task in change.tasks}
+    candidate_tasks = change.tasks + [current_tasks[task_id] for task_id in sorted(parents_with_changed_children_ids)
+                                      if task_id in current_tasks
+                                      and task_id not in changed_tasks_ids
+                                      and task_id not in deleted_tasks_ids]
+    tasks_to_update: List[DbTask] = []
+    for task in candidate_tasks:
+        children_ids = new_graph.get_children_ids(task.id)
+        current_task = current_tasks.get(task.id)
+        if current_task is None or current_task.content_hash != task.content_hash:
+            tasks_to_update.append(DbTask(**task.dict(exclude={"next_tasks_ids"}, exclude_unset=True),
+                                          next_tasks_ids=children_ids))
+        elif current_task.next_tasks_ids != children_ids:  # same content : only the children links are rewritten
+            tasks_to_update.append(current_task.copy(update={"next_tasks_ids": children_ids}))
     return DbTasksChange(
-        tasks_to_update=sorted([task_db for task_db in new_tasks_db if task_db.id != current_tasks.get(task_db.id)],
-                               key=lambda task: task.id),
+        tasks_to_update=sorted(tasks_to_update, key=lambda task: task.id),
         ids_to_remove=deleted_tasks_ids,)
 
 
-def build_new_tasks_graph(change: DbTasksChange, current_tasks: Dict[str, DbTask]) -> List[DbTask]:
-    """Create the new list of tasks effective after the DbChanges has been performed"""
-    all_tasks: Dict[str, DbTask] = {task.id: task for task in current_tasks.values()
-                                    if task.id not in change.ids_to_remove}
-    all_tasks.update({task.id: task for task in change.tasks_to_update})
-    return sorted(all_tasks.values(), key=lambda task: task.id)
+def get_tasks_with_new_parents(change: DbTasksChange, current_tasks: Dict[str, DbTask]) -> List[str]:
+    """List ids of the updated tasks that gained parents links. Cycles can only be introduced through those links."""
+    return [
+        task.id for task in change.tasks_to_update
+        if task.id not in current_tasks
+        or not set(task.previous_tasks_ids).issubset(current_tasks[task.id].previous_tasks_ids)
+    ]
@@ -0,0 +1,89 @@
+from array import array
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+
+class CompactGraph:
+    """
+    Structure of a tasks graph, without the tasks content.
+    Task ids are interned to integer nodes and links are stored in CSR form : the parents of node n are
+    parents[parents_offsets[n]:parents_offsets[n + 1]], and likewise for children.
+    Nodes from tasks_count onwards are parents ids referenced by tasks but missing from the graph.
+    """
+
+    def __init__(self, tasks_parents: Iterable[Tuple[str, Sequence[str]]]):
+        """:param tasks_parents: id and parents ids of each task. The last occurrence of a task id is kept."""
+        tasks_parents = dict(tasks_parents)
+        self.ids: List[str] = list(tasks_parents)
+        self.nodes: Dict[str, int] = {task_id: node for node, task_id in enumerate(self.ids)}
+        self.tasks_count = len(self.ids)
+        self.parents = array('l')
+        self.parents_offsets = array('l', [0])
+        ids, nodes, parents = self.ids, self.nodes, self.parents  # local names speed up the loop
+        for parents_ids in tasks_parents.values():
+            for parent_id in parents_ids:
+                parent = nodes.get(parent_id)
+                if parent is None:  # interns the missing parent
+                    parent = nodes[parent_id] = len(ids)
+                    ids.append(parent_id)
+                parents.append(parent)
+            self.parents_offsets.append(len(parents))
+        self.parents_offsets.extend([len(parents)] * (len(ids) - self.tasks_count))
+        self.children_offsets, self.children = self._build_children()
+
+    def _build_children(self) -> Tuple[array, array]:
+        """Transposes the parents links with a counting sort"""
+        children_offsets = array('l', [0]) * (len(self.ids) + 1)
+        for parent in self.parents:
+            children_offsets[parent + 1] += 1
+        for node in range(len(self.ids)):
+            children_offsets[node + 1] += children_offsets[node]
+        children = array('l', [0]) * len(self.parents)
+        next_positions = array('l', children_offsets)
+        for node in range(self.tasks_count):
+            for parent in self.get_parents(node):
+                children[next_positions[parent]] = node
+                next_positions[parent] += 1
+        return children_offsets, children
+
+    def __contains__(self, task_id: str) -> bool:
+        node = self.nodes.get(task_id)
+        return node is not None and node < self.tasks_count
+
+    def get_parents(self, node: int) -> array:
+        return self.parents[self.parents_offsets[node]:self.parents_offsets[node + 1]]
+
+    def get_children(self, node: int) -> array:
+        return self.children[self.children_offsets[node]:self.children_offsets[node + 1]]
+
+    def get_children_ids(self, task_id: str) -> List[str]:
+        """:return: the sorted ids of the tasks depending on the task"""
+        node = self.nodes.get(task_id)
+        return sorted({self.ids[child] for child in self.get_children(node)}) if node is not None else []
+
+    def get_missing_parents(self) -> Dict[str, List[str]]:
+        """:return: the parents ids missing from the graph, by id of the tasks referencing them"""
+        if len(self.ids) == self.tasks_count:
+            return {}
+        missing_parents: Dict[str, List[str]] = {}
+        for node in range(self.tasks_count):
+            for parent in self.get_parents(node):
+                if parent >= self.tasks_count:
+                    missing_parents.setdefault(self.ids[node], []).append(self.ids[parent])
+        return missing_parents
+
+    def get_ancestors_ids(self, tasks_ids: Iterable[str]) -> Set[str]:
+        """List the ids of the given tasks and of all the tasks they depend on, directly or not"""
+        tasks_ids = list(tasks_ids)
+        visited = bytearray(len(self.ids))
+        to_visit = [self.nodes[task_id] for task_id in tasks_ids if task_id in self.nodes]
+        ancestors_ids = {task_id for task_id in tasks_ids if task_id not in self.nodes}
+        for node in to_visit:
+            visited[node] = 1
+        while to_visit:
+            node = to_visit.pop()
+            ancestors_ids.add(self.ids[node])
+            for parent in self.get_parents(node):
+                if not visited[parent]:
+                    visited[parent] = 1
+                    to_visit.append(parent)
+        return ancestors_ids
@@ -0,0 +1,42 @@
+from typing import Dict, Iterable, Optional
+
+from config import DAG_DELIMITER
+
+_DAG_KEY = None  # key of the dag ending at a trie node, never a dag part
+
+
+class DagTrie:
+    """
+    Set of dags split on DAG_DELIMITER.
+    Finds the dag containing a task id in a time proportional to the task id length, whatever the number of dags.
+    """
+
+    def __init__(self, dags: Iterable[str] = ()):
+        self._root: Dict = {}
+        for dag in dags:
+            self.add(dag)
+
+    def add(self, dag: str) -> None:
+        node = self._root
+        normalized_dag = dag.strip(DAG_DELIMITER)
+        if normalized_dag:  # the empty dag is the root of all dags
+            for dag_part in normalized_dag.split(DAG_DELIMITER):
+                node = node.setdefault(dag_part, {})
+        node.setdefault(_DAG_KEY, dag)
+
+    def find_task_dag(self, task_id: str) -> Optional[str]:
+        """
+        :return: the least nested dag of the trie containing the task, None if no dag contains it.
+        Dags match on whole parts : dag "dag1" does not contain task "dag10/task".
+        """
+        node = self._root
+        for dag_part in task_id.split(DAG_DELIMITER)[:-1]:
+            if _DAG_KEY in node:
+                return node[_DAG_KEY]
+            node = node.get(dag_part)
+            if node is None:
+                return None
+        return node.get(_DAG_KEY)
+
+    def contains_task(self, task_id: str) -> bool:
+        return self.find_task_dag(task_id) is not None
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable, Mapping
+
+from dags import get_task_id_dags, normalize_dag
+from model.task_model import Task, TasksChange
+
+
+def _get_task_hash(task: Task) -> int:
+    return int(task.content_hash, 16)
+
+
+def get_dags_hashes(tasks: Iterable[Task]) -> Dict[str, int]:
+    """
+    Aggregates the tasks content hashes of each dag, nested dags included.
+    Hashes are combined with a xor so that the aggregate does not depend on the tasks order and can be updated in place.
+    """
+    dags_hashes: Dict[str, int] = {}
+    for task in tasks:
+        task_hash = _get_task_hash(task)
+        for dag in get_task_id_dags(task.id):
+            dags_hashes[dag] = dags_hashes.get(dag, 0) ^ task_hash
+    return dags_hashes
+
+
+def update_dags_hashes(dags_hashes: Dict[str, int], removed_tasks: Iterable[Task], added_tasks: Iterable[Task]) -> None:
+    """Updates dags aggregated hashes in place with the removed and added tasks"""
+    for task in [*removed_tasks, *added_tasks]:
+        task_hash = _get_task_hash(task)
+        for dag in get_task_id_dags(task.id):
+            dags_hashes[dag] = dags_hashes.get(dag, 0) ^ task_hash
+            if not dags_hashes[dag]:
+                del dags_hashes[dag]
+
+
+def is_change_applied(change: TasksChange, dags_hashes: Mapping[str, int]) -> bool:
+    """
+    Indicates whether the edited dags already hold exactly the tasks of the change, in which case the change is a no-op.
+    :param dags_hashes: aggregated hashes of the current tasks
+    """
+    dags = [normalize_dag(dag) for dag in change.dags]
+    if "" in dags or len({task.id for task in change.tasks}) != len(change.tasks):
+        return False  # the root dag has no aggregated hash and duplicated tasks would cancel each other
+    change_dags_hashes = get_dags_hashes(change.tasks)
+    return all(change_dags_hashes.get(dag, 0) == dags_hashes.get(dag, 0) for dag in dags)
@@ -0,0 +1,297 @@
+"""
+Binary snapshot of the structure of the tasks graph, memory-mapped by the processes reading it.
+
+A snapshot holds the arrays of a CompactGraph at a version of the tasks table : the interned ids, the parents and
+children links in CSR form, and a hash index of the ids. Processes map the file read-only and query it without
+deserializing it, so they start without scanning the table and processes of a host share its pages.
+Changes committed after the snapshot are appended to a deltas file next to it, in ndjson. They are replayed on top of
+the snapshot as long as their versions follow each other, the snapshot being rewritten once enough of them piled up.
+
+Layout, in the native byte order which the header records, each section starting on 8 bytes :
+header | ids offsets | ids utf-8 | parents offsets | parents | children offsets | children | ids index
+"""
+import contextlib
+import fcntl
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+from graph.compact import CompactGraph
+from logs import logger
+
+MAGIC = b"SFGRAPH\0"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sHBxxxxxQQQQQQ")  # magic, format version, little endian, table version, then counts
+_ITEM = 'i'
+_EMPTY_SLOT = -1
+assert array(_ITEM).itemsize == 4
+
+
+def _deltas_path(path: str) -> str:
+    return f"{path}.deltas"
+
+
+@contextlib.contextmanager
+def _lock_deltas(path: str) -> Iterator[None]:
+    """
+    Holds the lock of the deltas file of the snapshot, between processes of the host.
+    A lock file is used as the deltas file itself is replaced when deltas are dropped.
+    """
+    lock_file = os.open(f"{_deltas_path(path)}.lock", os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(lock_file)  # releases the lock
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+def _get_index_slot(encoded_id: bytes, mask: int) -> int:
+    return zlib.crc32(encoded_id) & mask
+
+
+def _build_index(encoded_ids: Sequence[bytes]) -> array:
+    """Open addressing table of the nodes by id hash, with linear probing. Half of its slots at least are empty."""
+    size = 1 << max(len(encoded_ids) * 2 - 1, 1).bit_length()
+    mask = size - 1
+    index = array(_ITEM, [_EMPTY_SLOT]) * size
+    for node, encoded_id in enumerate(encoded_ids):
+        slot = _get_index_slot(encoded_id, mask)
+        while index[slot] != _EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        index[slot] = node
+    return index
+
+
+def write_snapshot(path: str, graph: CompactGraph, version: int) -> None:
+    """
+    Writes the snapshot of the graph at a version of the tasks table.
+    The file is replaced atomically : processes mapping the previous snapshot keep on reading it.
+    """
+    encoded_ids = [task_id.encode() for task_id in graph.ids]
+    ids_offsets = array(_ITEM, [0])
+    ids_offsets.extend(itertools.accumulate(len(encoded_id) for encoded_id in encoded_ids))
+    index = _build_index(encoded_ids)
+    sections = [
+        ids_offsets.tobytes(),
+        b"".join(encoded_ids),
+        array(_ITEM, graph.parents_offsets).tobytes(),
+        array(_ITEM, graph.parents).tobytes(),
+        array(_ITEM, graph.children_offsets).tobytes(),
+        array(_ITEM, graph.children).tobytes(),
+        index.tobytes(),
+    ]
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, sys.byteorder == "little", version, graph.tasks_count,
+                          len(graph.ids), len(graph.parents), len(sections[1]), len(index))
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        for section in [header, *sections]:
+            snapshot_file.write(section)
+            snapshot_file.write(bytes(_padding(len(section))))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+
+
+class _MappedIds(Sequence[str]):
+    """Ids of the nodes, decoded from the snapshot on access"""
+
+    def __init__(self, offsets: memoryview, encoded_ids: memoryview):
+        self.offsets = offsets
+        self.encoded_ids = encoded_ids
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, node: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(node, slice):  # like the list of ids of a CompactGraph
+            return [self[sliced_node] for sliced_node in range(*node.indices(len(self)))]
+        return str(self.encoded_ids[self.offsets[node]:self.offsets[node + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        encoded_ids, offsets = bytes(self.encoded_ids), self.offsets.tolist()
+        return (encoded_ids[start:end].decode() for start, end in zip(offsets, offsets[1:]))
+
+
+class _MappedNodes(Mapping[str, int]):
+    """Nodes by id, looked up in the hash index of the snapshot"""
+
+    def __init__(self, ids: _MappedIds, index: memoryview):
+        self.ids = ids
+        self.index = index
+        self.mask = len(index) - 1
+
+    def get(self, task_id: str, default: Optional[int] = None) -> Optional[int]:
+        encoded_id = task_id.encode()
+        offsets, encoded_ids, index = self.ids.offsets, self.ids.encoded_ids, self.index
+        slot = _get_index_slot(encoded_id, self.mask)
+        while index[slot] != _EMPTY_SLOT:
+            node = index[slot]
+            if encoded_ids[offsets[node]:offsets[node + 1]] == encoded_id:
+                return node
+            slot = (slot + 1) & self.mask
+        return default
+
+    def __getitem__(self, task_id: str) -> int:
+        node = self.get(task_id)
+        if node is None:
+            raise KeyError(task_id)
+        return node
+
+    def __contains__(self, task_id: object) -> bool:
+        return isinstance(task_id, str) and self.get(task_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+
+class MappedGraph(CompactGraph):
+    """CompactGraph reading the arrays of a snapshot in place"""
+
+    def __init__(self, buffer, version: int, tasks_count: int, counts: Tuple[int, int, int, int]):
+        """Use open_snapshot to map a snapshot file"""
+        self.version = version
+        self.tasks_count = tasks_count
+        self._buffer = buffer
+        ids_count, links_count, ids_size, index_size = counts
+        sections_bounds = []
+        position = _HEADER.size + _padding(_HEADER.size)
+        for size, item in [(ids_count + 1, _ITEM), (ids_size, 'B'), (ids_count + 1, _ITEM), (links_count, _ITEM),
+                           (ids_count + 1, _ITEM), (links_count, _ITEM), (index_size, _ITEM)]:
+            section_size = size * array(item).itemsize
+            sections_bounds.append((position, position + section_size, item))
+            position += section_size + _padding(section_size)
+        if position > len(buffer):
+            raise ValueError("Truncated graph snapshot")
+        view = memoryview(buffer)
+        sections = [view[start:end].cast(item) for start, end, item in sections_bounds]
+        ids_offsets, encoded_ids, self.parents_offsets, self.parents, self.children_offsets, self.children, index = \
+            sections
+        self.ids = _MappedIds(ids_offsets, encoded_ids)
+        self.nodes = _MappedNodes(self.ids, index)
+
+
+def open_snapshot(path: str) -> Optional[MappedGraph]:
+    """:return: the graph of the snapshot file, None if it is missing or can not be read by this process"""
+    try:
+        with open(path, "rb") as snapshot_file:
+            buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):  # mapping an empty file raises ValueError
+        return None
+    if len(buffer) < _HEADER.size:
+        logger.warning(f"Ignoring truncated graph snapshot {path}")
+        return None
+    magic, format_version, little_endian, version, tasks_count, *counts = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or format_version != FORMAT_VERSION or bool(little_endian) != (sys.byteorder == "little"):
+        logger.warning(f"Ignoring graph snapshot {path} of another format")
+        return None
+    try:
+        return MappedGraph(buffer, version, tasks_count, tuple(counts))
+    except ValueError:
+        logger.warning(f"Ignoring truncated graph snapshot {path}")
+        return None
+
+
+# Deltas
+class GraphDelta(NamedTuple):
+    """Structural change of a commit, bringing the graph from version - 1 to version"""
+    version: int
+    removed_ids: List[str]
+    tasks_parents: Dict[str, List[str]]  # parents ids of the added and updated tasks
+
+
+def append_delta(path: str, delta: GraphDelta) -> None:
+    """
+    Appends the delta to the deltas of the snapshot with a single write, so that appending processes do not mix.
+    Holds the deltas lock so that the delta is not appended to a deltas file being replaced by drop_deltas.
+    """
+    line = json.dumps(delta._asdict(), separators=(",", ":")) + "\n"
+    with _lock_deltas(path):
+        deltas_file = os.open(_deltas_path(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(deltas_file, line.encode())
+        finally:
+            os.close(deltas_file)
+
+
+def _read_deltas_by_version(path: str) -> Dict[int, GraphDelta]:
+    deltas_by_version: Dict[int, GraphDelta] = {}
+    try:
+        with open(_deltas_path(path)) as deltas_file:
+            for line in deltas_file:
+                try:
+                    delta = GraphDelta(**json.loads(line))
+                except (ValueError, TypeError):  # line being appended, or of another format
+                    continue
+                deltas_by_version[delta.version] = delta
+    except FileNotFoundError:
+        pass
+    return deltas_by_version
+
+
+def read_deltas(path: str, version: int) -> List[GraphDelta]:
+    """:return: the deltas following the version, up to the first missing version"""
+    deltas_by_version = _read_deltas_by_version(path)
+    deltas = []
+    while version + 1 in deltas_by_version:
+        version += 1
+        deltas.append(deltas_by_version[version])
+    return deltas
+
+
+def drop_deltas(path: str, version: int) -> None:
+    """
+    Removes the deltas up to the version, once a snapshot of the version is written. Appends wait meanwhile.
+    Newer deltas are all kept : the ones following a missing version are replayed once its delta is appended.
+    """
+    with _lock_deltas(path):
+        deltas = [delta for delta_version, delta in sorted(_read_deltas_by_version(path).items())
+                  if delta_version > version]
+        temporary_path = f"{_deltas_path(path)}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as deltas_file:
+            deltas_file.writelines(json.dumps(delta._asdict(), separators=(",", ":")) + "\n" for delta in deltas)
+        os.replace(temporary_path, _deltas_path(path))
+
+
+def apply_deltas(graph: CompactGraph, deltas: Sequence[GraphDelta]) -> CompactGraph:
+    """Builds the graph with the deltas applied in order"""
+    changed_tasks_parents: Dict[str, Optional[List[str]]] = {}  # None for removed tasks
+    for delta in deltas:
+        changed_tasks_parents.update(dict.fromkeys(delta.removed_ids))
+        changed_tasks_parents.update(delta.tasks_parents)
+    ids = list(graph.ids)  # decodes the ids of a mapped graph once
+    parents, offsets = graph.parents.tolist(), graph.parents_offsets.tolist()
+    unchanged_tasks_parents = (
+        (task_id, [ids[parent] for parent in parents[offsets[node]:offsets[node + 1]]])
+        for node, task_id in enumerate(ids[:graph.tasks_count]) if task_id not in changed_tasks_parents
+    )
+    return CompactGraph(itertools.chain(
+        unchanged_tasks_parents,
+        ((task_id, parents_ids) for task_id, parents_ids in changed_tasks_parents.items() if parents_ids is not None),
+    ))
+
+
+def load_graph(path: str) -> Optional[Tuple[CompactGraph, int]]:
+    """
+    Maps the snapshot and replays the deltas following it.
+    :return: the graph and the version of the tasks table it matches, None if there is no readable snapshot
+    """
+    graph = open_snapshot(path)
+    if graph is None:
+        return None
+    deltas = read_deltas(path, graph.version)
+    if not deltas:
+        return graph, graph.version
+    return apply_deltas(graph, deltas), deltas[-1].version
@@ -1,8 +1,97 @@
-from typing import List
+import itertools
+from collections import defaultdict, deque
+from typing import List, Dict, Iterable, Set, Iterator, Tuple, Optional, Hashable, TypeVar, Callable, Union
 
+from graph.dag_trie import DagTrie
 from model.task_model import Task
 
+Node = TypeVar('Node', bound=Hashable)
 
-def is_task_in_dag(task_id: str, dags: List[str]) -> bool:
-    """Indicates whether a given task is in a list of dag ids"""
-    return any(task_id.startswith(dag) for dag in dags)
+
+def is_task_in_dag(task_id: str, dags: Union[DagTrie, Iterable[str]]) -> bool:
+    """Indicates whether a given task is in a list of dag ids. Pass a DagTrie to check many tasks."""
+    if not isinstance(dags, DagTrie):
+        dags = DagTrie(dags)
+    return dags.contains_task(task_id)
+
+
+def get_children_index(tasks: Iterable[Task]) -> Dict[str, List[str]]:
+    """
+    Builds the reverse adjacency of the tasks graph in a single pass over previous_tasks_ids.
+    :return: mapping of every parent task id to the sorted ids of the tasks depending on it
+    """
+    children_index: Dict[str, Set[str]] = defaultdict(set)
+    for task in tasks:
+        for parent_id in task.previous_tasks_ids:
+            children_index[parent_id].add(task.id)
+    return {parent_id: sorted(children_ids) for parent_id, children_ids in children_index.items()}
+
+
+def get_strongly_connected_components(sources: Iterable[Node],
+                                      get_successors: Callable[[Node], Iterable[Node]]) -> Iterator[List[Node]]:
+    """
+    Iterative Tarjan's algorithm : yields the strongly connected components reachable from sources.
+    Only the nodes reachable from sources are visited, get_successors giving the edges of the graph.
+    Runs in linear time in the number of nodes and edges traversed and never recurses, whatever the graph depth.
+    """
+    index_counter = itertools.count()
+    indexes: Dict[Node, int] = {}
+    low_links: Dict[Node, int] = {}
+    stack: List[Node] = []
+    on_stack: Set[Node] = set()
+    for source in sources:
+        if source in indexes:
+            continue
+        indexes[source] = low_links[source] = next(index_counter)
+        stack.append(source)
+        on_stack.add(source)
+        visits: List[Tuple[Node, Iterator[Node]]] = [(source, iter(get_successors(source)))]
+        while visits:
+            node, children = visits[-1]
+            for child in children:
+                if child not in indexes:
+                    indexes[child] = low_links[child] = next(index_counter)
+                    stack.append(child)
+                    on_stack.add(child)
+                    visits.append((child, iter(get_successors(child))))
+                    break
+                if child in on_stack:
+                    low_links[node] = min(low_links[node], indexes[child])
+            else:
+                visits.pop()
+                if visits:
+                    parent = visits[-1][0]
+                    low_links[parent] = min(low_links[parent], low_links[node])
+                if low_links[node] == indexes[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    yield component
+
+
+def get_component_cycle(component: List[Node],
+                        get_successors: Callable[[Node], Iterable[Node]]) -> Optional[List[Node]]:
+    """
+    Finds one elementary cycle within a strongly connected component with a breadth first search.
+    :return: the nodes of the cycle in edges order or None if the component holds no cycle
+    """
+    start = component[0]
+    members = set(component)
+    predecessors: Dict[Node, Optional[Node]] = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for child in get_successors(node):
+            if child == start:
+                cycle = [node]
+                while predecessors[cycle[-1]] is not None:
+                    cycle.append(predecessors[cycle[-1]])
+                return cycle[::-1]
+            if child in members and child not in predecessors:
+                predecessors[child] = node
+                queue.append(child)
+    return None
@@ -1,26 +1,33 @@
-from typing import List, Dict, Set
+from typing import List, Tuple, Optional, Iterable
 
-from networkx import simple_cycles, DiGraph
+from graph.compact import CompactGraph
+from graph.utils import get_strongly_connected_components, get_component_cycle
 
-from model.db import DbTask
 
+def get_orphan_tasks(graph: CompactGraph) -> List[Tuple[str, List[str]]]:
+    """List all orphans tasks of the graph, along with their missing parents ids"""
+    return sorted(graph.get_missing_parents().items())
 
-def get_orphan_tasks(all_tasks: List[DbTask]) -> List[DbTask]:
-    """List all orphans tasks if the change is applied to the current state"""
-    tasks_ids: Set[str] = {task.id for task in all_tasks}
-    orphans = [
-        DbTask(**task.dict(exclude={"previous_tasks_ids"}),
-               previous_tasks_ids=[parent_id for parent_id in task.previous_tasks_ids if parent_id not in tasks_ids])
-        for task in all_tasks if not all(parent_id in tasks_ids for parent_id in task.previous_tasks_ids)
-    ]
-    return sorted(orphans, key=lambda o: o.id)
 
+def get_tasks_cycles(graph: CompactGraph, max_cycles: Optional[int] = None) -> List[List[str]]:
+    """List cycles of the graph : one witness cycle of tasks ids per strongly connected component"""
+    return get_introduced_cycles(graph, starting_tasks_ids=graph.ids[:graph.tasks_count], max_cycles=max_cycles)
 
-def get_tasks_cycles(all_tasks: List[DbTask]) -> List[List[DbTask]]:
-    """List all cycles if the change is applied to the current state"""
-    tasks_map: Dict[str, DbTask] = {task.id: task for task in all_tasks}
-    dag = DiGraph(
-        [(task.id, downstream_task_id) for task in all_tasks for downstream_task_id in task.next_tasks_ids]
-    )
-    all_cycles = list(simple_cycles(dag))
-    return [[tasks_map[task_id] for task_id in cycle] for cycle in all_cycles]
+
+def get_introduced_cycles(graph: CompactGraph,
+                          starting_tasks_ids: Iterable[str],
+                          max_cycles: Optional[int] = None) -> List[List[str]]:
+    """
+    List cycles reachable from the starting tasks : one witness cycle of tasks ids per strongly connected component.
+    The search walks up parents links so only the ancestors of the starting tasks are visited.
+    :param max_cycles: stops the search once this number of cycles has been found
+    """
+    starting_nodes = [graph.nodes[task_id] for task_id in starting_tasks_ids if task_id in graph.nodes]
+    cycles: List[List[str]] = []
+    for component in get_strongly_connected_components(starting_nodes, get_successors=graph.get_parents):
+        if max_cycles is not None and len(cycles) >= max_cycles:
+            break
+        reversed_cycle = get_component_cycle(component, get_successors=graph.get_parents)
+        if reversed_cycle is not None:
+            cycles.append([graph.ids[node] for node in reversed(reversed_cycle)])
+    return cycles
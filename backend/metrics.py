@@ -0,0 +1,143 @@
+"""
+Process metrics, exposed in the Prometheus text format.
+
+Stages of the tasks pipeline are timed with spans, which feed the stage duration histogram. Spans of a request are also
+collected when it is profiled.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str], **extra_labels: str) -> str:
+    labels = [*zip(label_names, label_values), *extra_labels.items()]
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """Monotonic value, by labels values"""
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        _registry[name] = self
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def inc(self, value: float = 1., **labels: str) -> None:
+        label_values = self._label_values(labels)
+        self.values[label_values] = self.values.get(label_values, 0.) + value
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self._label_values(labels), 0.)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+                for label_values, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, by labels values"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._label_values(labels)] = value
+
+
+class Histogram(Counter):
+    """Distribution of observed values in cumulative buckets, by labels values"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.observations: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}  # buckets counts, [sum]
+
+    def observe(self, value: float, **labels: str) -> None:
+        label_values = self._label_values(labels)
+        if label_values not in self.observations:
+            self.observations[label_values] = ([0] * len(self.buckets), [0.])
+        buckets_counts, total = self.observations[label_values]
+        for bucket_index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                buckets_counts[bucket_index] += 1
+        total[0] += value
+        self.values[label_values] = self.values.get(label_values, 0) + 1  # count
+
+    def render(self) -> List[str]:
+        lines = []
+        for label_values, (buckets_counts, total) in sorted(self.observations.items()):
+            for bucket, bucket_count in zip(self.buckets, buckets_counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le=str(bucket))} "
+                             f"{bucket_count}")
+            count = self.values[label_values]
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {count}")
+        return lines
+
+
+_registry: Dict[str, Counter] = {}
+
+
+def render_metrics() -> str:
+    """All metrics of the process in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Spans
+STAGE_DURATION = Histogram("streamflow_stage_duration_seconds", "Duration of the stages of the tasks pipeline.",
+                           label_names=("stage",))
+_collected_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("collected_spans", default=None)
+
+
+def observe_stage(stage: str, duration: float) -> None:
+    STAGE_DURATION.observe(duration, stage=stage)
+    spans = _collected_spans.get()
+    if spans is not None:
+        spans.append((stage, duration))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Times the stage, whether it succeeds or not"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def get_collected_spans() -> Optional[List[Tuple[str, float]]]:
+    """:return: the list spans of the current context are collected in, None if they are not collected"""
+    return _collected_spans.get()
+
+
+@contextmanager
+def collect_spans() -> Iterator[List[Tuple[str, float]]]:
+    """Collects the stages names and durations of the spans run in the context, tasks it creates included"""
+    spans: List[Tuple[str, float]] = []
+    token = _collected_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected_spans.reset(token)
@@ -1,4 +1,4 @@
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -22,6 +22,18 @@ class TasksPage(BaseModel):
     )
 
 
+class GraphValidation(BaseModel):
+    """Consistency report of the tasks graph stored in the database"""
+    tasks_count: int = Field(description="Number of tasks of the graph.")
+    inconsistent_links: List[Tuple[List[str], str]] = Field(
+        description="Missing parents ids of the tasks depending on them, along with the id of each of these tasks."
+    )
+    cycles: List[List[str]] = Field(
+        description="Tasks ids of the cycles of the graph, one per strongly connected component, at most "
+                    "MAX_REPORTED_CYCLES."
+    )
+
+
 class DbTasksChange(BaseModel):
     ids_to_remove: Set[str] = Field(description="List of all task ids to be deleted.")
     tasks_to_update: List[DbTask] = Field(description="List of all task to be created or updated")
@@ -39,3 +51,17 @@ class DbTasksChange(BaseModel):
             except ValueError:
                 return False
         return len(other_tasks_to_update) == 0  # todo: add test
+
+
+class DbWriteReport(BaseModel):
+    """Statistics of a write of tasks changes in the database"""
+    items_written: int = Field(default=0, description="Number of items put or deleted.")
+    batches: int = Field(default=0, description="Number of batch write calls performed, retries included.")
+    retries: int = Field(default=0, description="Number of batch write calls resubmitting unprocessed items.")
+    unprocessed_items: int = Field(default=0, description="Number of items returned unprocessed, at each attempt.")
+    duration: float = Field(default=0., description="Duration of the write in seconds.")
+
+    @property
+    def throughput(self) -> float:
+        """Items written per second"""
+        return self.items_written / self.duration if self.duration else 0.
@@ -2,18 +2,18 @@ from base64 import b64encode, b64decode
 from binascii import Error as Base64Error
 from pydantic import BaseModel, Field
 import json
-from typing import Dict
+from typing import Dict, Any, Optional
 
 
 class DynamoPageToken(BaseModel):
-    start_key: Dict[str, Dict] = Field(
+    start_key: Dict[str, Any] = Field(
         title="Start Key",
-        description="Dynamo start key to get the next value.",
+        description="Dynamo start key to get the next value, holding the index keys when reading an index.",
         default_factory=dict)
-    filters: str = Field(
-        title="Query Filter expression",
-        description="Filters applied to dynamo records.",
-        default="")
+    dag: Optional[str] = Field(
+        title="Dag",
+        description="Dag which tasks are listed. All tasks are listed if not set.",
+        default=None)
 
 
 def serialize_token(token: DynamoPageToken) -> str:
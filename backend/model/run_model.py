@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field
+
+
+class DagRunReport(BaseModel):
+    """Outcome of a dag run"""
+    run_id: str = Field(description="Unique id of the run.")
+    dag: str = Field(description="Dag the run executes the tasks of.")
+    tasks_count: int = Field(default=0, description="Number of task instances of the run.")
+    succeeded_count: int = Field(default=0, description="Number of task instances that succeeded.")
+    failed_count: int = Field(default=0, description="Number of task instances that failed.")
+    duration: float = Field(default=0., description="Duration of the run in seconds.")
+
+    @property
+    def skipped_count(self) -> int:
+        """Instances never started because one of their ancestors failed"""
+        return self.tasks_count - self.succeeded_count - self.failed_count
+
+    @property
+    def succeeded(self) -> bool:
+        return self.succeeded_count == self.tasks_count
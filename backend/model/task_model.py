@@ -1,12 +1,15 @@
 """
 All models describing what a task is according to streamflow
 """
+import hashlib
 import json
 from typing import Optional, List
 
-from pydantic import BaseModel, Field, validator, root_validator
+from pydantic import BaseModel, Field, PrivateAttr, validator, root_validator
 
 from config import DAG_DELIMITER
+from graph.dag_trie import DagTrie
+from templates import get_syntax_error
 
 
 class CallTask(BaseModel):
@@ -38,6 +41,12 @@ class CallTask(BaseModel):
         max_length=10000,
     )
 
+    @validator("url_template", "template")
+    def _check_template_syntax(cls, template: str, field):
+        syntax_error = get_syntax_error(template)
+        assert syntax_error is None, f"Invalid Jinja template in {field.name}, {syntax_error}"
+        return template
+
 
 class Task(BaseModel):
     id: str = Field(title="Task id",
@@ -65,13 +74,35 @@ class Task(BaseModel):
         description="List of all this task depends on",
     )
 
+    _content_hash: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def content_hash(self) -> str:
+        """
+        Stable hash of the task id and content, computed once. Derived links such as next_tasks_ids are left out.
+        Tasks must not be mutated once hashed.
+        """
+        if self._content_hash is None:
+            content = json.dumps(self.dict(include=set(Task.__fields__)), sort_keys=True, separators=(',', ':'))
+            self._content_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        return self._content_hash
+
     @validator("id")
     def _check_task_id(cls, task_id: str):
         # pydantic.ValidationError will be raised at the end so Exception type does not matter
         assert DAG_DELIMITER in task_id, \
             f'A task must always belong to a dag. A task should always contain one char "{DAG_DELIMITER}"'
+        # dags are indexed and locked by the parts of the id : an empty one would not match the dag of the task
+        assert all(task_id.split(DAG_DELIMITER)), \
+            f'Dags and task names of a task id must not be empty : "{DAG_DELIMITER}" can not lead, trail or repeat'
         return task_id
 
+    @validator("pod_template")
+    def _check_pod_template_syntax(cls, pod_template: Optional[str]):
+        syntax_error = get_syntax_error(pod_template) if pod_template is not None else None
+        assert syntax_error is None, f"Invalid Jinja template in pod_template, {syntax_error}"
+        return pod_template
+
     @root_validator
     def _check_at_least_one_template(cls, values):
         assert sum(bool(values.get(field)) for field in cls.__fields__ if "template" in field) == 1, \
@@ -94,8 +125,8 @@ class TasksChange(BaseModel):
     def _ensure_dags_supersedes_tasks_dags(cls, kwargs):
         dags: List[str] = kwargs['dags']
         tasks: List[Task] = kwargs['tasks']
-        tasks_outside_of_dags = sorted(json.dumps(t.id) for t in tasks
-                                       if not any(t.id.startswith(dag_name) for dag_name in dags))
+        dags_trie = DagTrie(dags)
+        tasks_outside_of_dags = sorted(json.dumps(t.id) for t in tasks if not dags_trie.contains_task(t.id))
         assert not tasks_outside_of_dags, \
             f"The following tasks are outside of edited dags {', '.join(tasks_outside_of_dags)}"
         return kwargs
@@ -0,0 +1,113 @@
+"""
+Event driven scheduler of dag runs.
+
+A run snapshots the tasks of a dag into instance items of the tasks runs table, each counting the parents it waits for.
+Tasks without parents in the run are started right away. Once a task succeeds, the counters of its children are
+decremented atomically and the children which counter reaches zero are pushed to the ready queue : fanning out costs
+one update per child, and parents are never read again.
+"""
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import config
+from db import runs as runs_db
+from db import tasks as tasks_db
+from graph.compact import CompactGraph
+from logs import logger
+from model.db import DbTask
+from model.run_model import DagRunReport
+
+TaskRunner = Callable[[DbTask, str], Awaitable[None]]  # runs a task for a run id, raises if the task failed
+
+
+def get_run_structure(tasks: Iterable[DbTask]) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+    """
+    Restricts the links of the tasks to the run : parents outside of the run do not hold back their children.
+    :return: the number of parents of each task in the run, and the ids of the tasks of the run depending on each task
+    """
+    graph = CompactGraph((task.id, task.previous_tasks_ids) for task in tasks)
+    pending_parents: Dict[str, int] = {}
+    next_tasks_ids: Dict[str, List[str]] = {}
+    for node in range(graph.tasks_count):
+        task_id = graph.ids[node]
+        pending_parents[task_id] = len({parent for parent in graph.get_parents(node) if parent < graph.tasks_count})
+        children = graph.get_children(node)
+        if children:
+            next_tasks_ids[task_id] = sorted({graph.ids[child] for child in children})
+    return pending_parents, next_tasks_ids
+
+
+async def run_dag(dag: str,
+                  run_task: TaskRunner,
+                  tasks: Optional[Iterable[DbTask]] = None,
+                  run_id: Optional[str] = None,
+                  max_concurrency: int = config.SCHEDULER_MAX_CONCURRENCY) -> DagRunReport:
+    """
+    Runs all the tasks of a dag, each one once all its parents in the dag succeeded.
+    Descendants of a failed task are not started.
+    :param tasks: tasks of the dag, read from the tasks table by default
+    :param max_concurrency: maximum number of tasks running at once
+    """
+    start = time.perf_counter()
+    if tasks is None:
+        tasks = [task async for task in tasks_db.get_dag_tasks(dag)]
+    tasks_by_id = {task.id: task for task in tasks}
+    run_id = run_id or uuid.uuid4().hex
+    pending_parents, next_tasks_ids = get_run_structure(tasks_by_id.values())
+    report = DagRunReport(run_id=run_id, dag=dag, tasks_count=len(tasks_by_id))
+    await runs_db.create_run(run_id, dag, report.tasks_count)
+
+    ready_queue: asyncio.Queue = asyncio.Queue()
+    for task_id, parents_count in pending_parents.items():
+        if parents_count == 0:
+            ready_queue.put_nowait(task_id)
+    fan_out_semaphore = asyncio.Semaphore(config.WRITE_MAX_CONCURRENCY)
+
+    async def release_child(parent_id: str, child_id: str) -> None:
+        async with fan_out_semaphore:
+            if await runs_db.decrement_pending_parents(run_id, child_id, parent_id) == 0:
+                ready_queue.put_nowait(child_id)
+
+    async def run_instance(task_id: str) -> None:
+        if not await runs_db.set_instance_state(run_id, task_id, runs_db.RUNNING, expected_state=runs_db.PENDING):
+            return  # already started
+        try:
+            await run_task(tasks_by_id[task_id], run_id)
+        except Exception as error:
+            logger.error(f"Task {task_id} failed in run {run_id}: {error!r}")
+            await runs_db.set_instance_state(run_id, task_id, runs_db.FAILED, expected_state=runs_db.RUNNING)
+            report.failed_count += 1
+            return
+        if await runs_db.set_instance_state(run_id, task_id, runs_db.SUCCEEDED, expected_state=runs_db.RUNNING):
+            report.succeeded_count += 1
+            await asyncio.gather(*(release_child(task_id, child_id) for child_id in next_tasks_ids.get(task_id, [])))
+
+    async def worker() -> None:
+        while True:
+            task_id = await ready_queue.get()
+            try:
+                await run_instance(task_id)
+            finally:  # children are queued before, so the queue is only drained once the run is over
+                ready_queue.task_done()
+
+    try:
+        await runs_db.create_instances(run_id, pending_parents, next_tasks_ids)
+        logger.info(f"Starting run {run_id} of dag {dag} with {report.tasks_count} task(s)")
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, min(max_concurrency, report.tasks_count)))]
+        drained = asyncio.create_task(ready_queue.join())
+        try:
+            await asyncio.wait([drained, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for finished_worker in (worker_task for worker_task in workers if worker_task.done()):
+                finished_worker.result()  # workers only stop on errors of the runs table, which are raised here
+        finally:
+            for worker_task in [drained, *workers]:
+                worker_task.cancel()
+    finally:  # the run is ended as failed if it stopped on an error or was cancelled
+        report.duration = time.perf_counter() - start
+        await runs_db.end_run(run_id, runs_db.SUCCEEDED if report.succeeded else runs_db.FAILED,
+                              report.succeeded_count, report.failed_count)
+        logger.info(f"Run {run_id} of dag {dag} ended: {report.succeeded_count} succeeded, "
+                    f"{report.failed_count} failed, {report.skipped_count} skipped in {report.duration:.3f}s")
+    return report
@@ -1,4 +1,4 @@
-from typing import Iterable, Type, List
+from typing import Iterable, Type, List, AsyncIterable
 from itertools import islice
 
 T = Type['T']
@@ -14,3 +14,17 @@ def group(stream: Iterable[T], group_size: int) -> Iterable[List[T]]:
         if not single_group:
             return
         yield single_group
+
+
+async def async_group(stream: AsyncIterable[T], group_size: int) -> AsyncIterable[List[T]]:
+    """ group elements of an asynchronous stream together in batches of requested size """
+    if group_size < 1:
+        raise ValueError("group_size should be a strictly positive integer")
+    single_group = []
+    async for element in stream:
+        single_group.append(element)
+        if len(single_group) == group_size:
+            yield single_group
+            single_group = []
+    if single_group:
+        yield single_group
@@ -0,0 +1,98 @@
+"""
+Compilation and rendering of the Jinja templates of tasks.
+
+Templates are compiled once and kept in a LRU cache keyed by the content hash of their task and their path in the task.
+A task edit changes its hash, so stale templates are never served and are evicted once unused.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from jinja2 import StrictUndefined, Template, TemplateSyntaxError
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+import config
+import metrics
+
+# estimate of the memory used by a compiled template beyond its source, which is what the memory cap accounts
+TEMPLATE_OVERHEAD_BYTES = 2000
+
+# templates are submitted through the api : the sandbox keeps them from reaching python internals or mutating the context
+environment = ImmutableSandboxedEnvironment(undefined=StrictUndefined, autoescape=False)
+
+CACHE_LOOKUPS = metrics.Counter("streamflow_templates_cache_lookups_total",
+                                "Lookups of the compiled templates, by result : miss when the template is compiled.",
+                                label_names=("result",))
+
+
+def compile_template(source: str) -> Template:
+    """:raises TemplateSyntaxError: if the source is not a valid Jinja template"""
+    return environment.from_string(source)
+
+
+def get_syntax_error(source: str) -> Optional[str]:
+    """:return: a description of the syntax error of the template, None if the template is valid"""
+    try:
+        environment.parse(source)
+    except TemplateSyntaxError as error:
+        return f"line {error.lineno}: {error.message}"
+    return None
+
+
+class TemplatesCache:
+    """LRU cache of compiled templates, bounded in number of templates and in estimated memory"""
+
+    def __init__(self, max_entries: int = config.TEMPLATES_CACHE_MAX_ENTRIES,
+                 max_bytes: int = config.TEMPLATES_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._templates: 'OrderedDict[Tuple[str, str], Tuple[Template, int]]' = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, task_hash: str, path: str, source: str) -> Template:
+        """
+        Gets the compiled template, compiling it on miss
+        :param task_hash: content hash of the task the template belongs to
+        :param path: path of the template in the task, such as "pod_template" or "call_templates.0.template"
+        :raises TemplateSyntaxError: if the source is not a valid Jinja template
+        """
+        key = (task_hash, path)
+        entry = self._templates.get(key)
+        if entry is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            self._templates.move_to_end(key)
+            return entry[0]
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        template = compile_template(source)
+        size = len(source) + TEMPLATE_OVERHEAD_BYTES
+        self._templates[key] = (template, size)
+        self.size_bytes += size
+        self._evict()
+        return template
+
+    def _evict(self) -> None:
+        """Drops the least recently used templates until the cache fits its bounds. The newest one is always kept."""
+        while len(self._templates) > 1 and \
+                (len(self._templates) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, (_, size) = self._templates.popitem(last=False)
+            self.size_bytes -= size
+            self.evictions += 1
+
+    def render_batch(self, task_hash: str, path: str, source: str, contexts: Iterable[Dict[str, Any]]) -> List[str]:
+        """Renders the template once per context, looking it up once for the whole batch"""
+        template = self.get(task_hash, path, source)
+        return [template.render(context) for context in contexts]
+
+    def clear(self) -> None:
+        self._templates.clear()
+        self.size_bytes = 0
+
+
+templates_cache = TemplatesCache()
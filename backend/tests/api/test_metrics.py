@@ -0,0 +1,39 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.metrics import ROUTE as METRICS_ROUTE, PROFILE_HEADER, add_metrics_resources
+from api.tasks import ROUTE, add_tasks_resources
+from model.task_model import TasksChange
+from tests.model.utils import make_task
+from tests.db.mocked_tasks import *
+
+
+def make_client(mocker, request_profiling: bool) -> TestClient:
+    """Client of an app built with the profiling config, which is read once the routes are added"""
+    mocker.patch("config.REQUEST_PROFILING", request_profiling)
+    app = FastAPI()
+    add_tasks_resources(app)
+    add_metrics_resources(app)
+    return TestClient(app)
+
+
+def test_put_stages_are_measured(mocker, scan_table_mock, mock_task_lock, mock_update_db, mock_tasks_version):
+    client = make_client(mocker, request_profiling=True)
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    tasks_change = TasksChange(dags=["dag"], tasks=[make_task(id="dag/task")])
+    response = client.put(ROUTE, tasks_change.json(exclude_unset=True), headers={PROFILE_HEADER: "1"})
+    assert response.status_code == 200, response.json()
+    timed_stages = [timing.split(";")[0] for timing in response.headers["Server-Timing"].split(", ")]
+    assert {"queue_wait", "load_tasks", "lock", "plan", "validate", "unlock"} <= set(timed_stages)
+
+    metrics_response = client.get(METRICS_ROUTE)
+    assert metrics_response.status_code == 200
+    assert 'streamflow_stage_duration_seconds_count{stage="plan"}' in metrics_response.text
+    assert "streamflow_graph_tasks 1" in metrics_response.text
+
+
+def test_profiling_requires_config(mocker):
+    client = make_client(mocker, request_profiling=False)
+    response = client.get(METRICS_ROUTE, headers={PROFILE_HEADER: "1"})
+    assert "Server-Timing" not in response.headers
+    assert not client.app.user_middleware
@@ -1,11 +1,17 @@
+import asyncio
+
 from fastapi.testclient import TestClient
 
 from main_api import app
-from api.tasks import ROUTE
-from model.db import TasksPage, DbTasksChange, Task
+from api.tasks import ROUTE, EXPORT_ROUTE, IMPORT_ROUTE, VALIDATION_ROUTE, TasksCommitQueue, \
+    InconsistentTasksDependencies
+from model.db import TasksPage, DbTasksChange, GraphValidation, Task
 from model.task_model import TasksChange
 from tests.model.utils import make_task, make_task_db
 from tests.db.mocked_tasks import *
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+from db.tasks import _serialize_downward_task, LOCK_TASK_ID, VERSION_TASK_ID, TASK_KEY_PREFIX
 
 
 client = TestClient(app)
@@ -19,7 +25,102 @@ def test_get_empty_tasks(scan_table_mock):
     assert response.json() == TasksPage(tasks=[], next_page_token=None).dict()
 
 
-def test_put_valid_object_in_empty_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def get_all_pages(**params) -> List[str]:
+    tasks_ids = []
+    while True:
+        response = client.get(ROUTE, params=params)
+        assert response.status_code == 200, response.json()
+        page = TasksPage(**response.json())
+        tasks_ids.extend(task.id for task in page.tasks)
+        if page.next_page_token is None:
+            return tasks_ids
+        params = dict(params, page_token=page.next_page_token)
+
+
+def test_get_dag_tasks_pages(mocker):
+    tasks = [make_task_db(id=f"dag_{i % 11}/task_{i}") for i in range(1100)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks]
+                        + [{"id": LOCK_TASK_ID, "owner": "other"}, {"id": VERSION_TASK_ID, "version": 1}])
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    dag_tasks_ids = get_all_pages(dag="dag_1", limit=30)
+    assert sorted(dag_tasks_ids) == sorted(task.id for task in tasks if task.id.startswith("dag_1/"))
+    assert table.evaluated_items == len(dag_tasks_ids)
+    assert sorted(get_all_pages(limit=70)) == sorted(task.id for task in tasks)
+
+
+def test_get_tasks_etag(mocker):
+    tasks = [make_task_db(id=f"{dag}/task_{i}") for i in range(3)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks])
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    response = client.get(ROUTE, params={"dag": dag})
+    etag = response.headers["ETag"]
+    not_modified_response = client.get(ROUTE, params={"dag": dag}, headers={"If-None-Match": f'"other", {etag}'})
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.content == b""
+
+    new_task = make_task_db(id=f"{dag}/task_1", pod_template="new_template")
+    table.items[TASK_KEY_PREFIX + new_task.id] = _serialize_downward_task(new_task)
+    modified_response = client.get(ROUTE, params={"dag": dag}, headers={"If-None-Match": etag})
+    assert modified_response.status_code == 200
+    assert modified_response.headers["ETag"] != etag
+
+
+def test_get_tasks_etag_follows_children(mocker):
+    tasks = [make_task_db(id=f"{dag}/task_{i}") for i in range(2)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks])
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    etag = client.get(ROUTE, params={"dag": dag}).headers["ETag"]
+
+    parent_task = make_task_db(id=tasks[0].id, next_tasks_ids=[f"other_{dag}/child_task"])
+    assert parent_task.content_hash == tasks[0].content_hash
+    table.items[TASK_KEY_PREFIX + parent_task.id] = _serialize_downward_task(parent_task)
+    modified_response = client.get(ROUTE, params={"dag": dag}, headers={"If-None-Match": etag})
+    assert modified_response.status_code == 200
+    assert modified_response.headers["ETag"] != etag
+
+
+def test_export_tasks(mocker):
+    tasks = [make_task_db(id=f"dag_{i % 3}/task_{i}", previous_tasks_ids=[f"dag_{i % 3}/task_{i - 3}"] if i > 2 else [])
+             for i in range(300)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks] + [{"id": VERSION_TASK_ID}],
+                        page_size=40)
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    response = client.get(EXPORT_ROUTE)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported_tasks = [DbTask.parse_raw(line) for line in response.text.splitlines()]
+    assert sorted(exported_tasks, key=lambda task: task.id) == sorted(tasks, key=lambda task: task.id)
+    dag_response = client.get(EXPORT_ROUTE, params={"dag": "dag_1"})
+    assert sorted(DbTask.parse_raw(line).id for line in dag_response.text.splitlines()) == \
+           sorted(task.id for task in tasks if task.id.startswith("dag_1/"))
+
+
+def test_validate_stored_graph(mocker, tmp_path):
+    mocker.patch("config.GRAPH_SNAPSHOT_PATH", str(tmp_path / "graph"))
+    tasks = [make_task_db(id=f"{dag}/a", previous_tasks_ids=[f"{dag}/b"]),
+             make_task_db(id=f"{dag}/b", previous_tasks_ids=[f"{dag}/a"]),
+             make_task_db(id=f"{dag}/c", previous_tasks_ids=[f"{dag}/missing"])]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks]
+                        + [{"id": VERSION_TASK_ID, "version": 1}])
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    tasks_cache.clear()
+    validation = GraphValidation(**client.get(VALIDATION_ROUTE).json())
+    assert validation.tasks_count == 3
+    assert validation.inconsistent_links == [([f"{dag}/missing"], f"{dag}/c")]
+    assert [sorted(cycle) for cycle in validation.cycles] == [[f"{dag}/a", f"{dag}/b"]]
+
+    tasks_cache.clear()  # a new process reads the graph from the snapshot, without scanning the table
+    table.items = {VERSION_TASK_ID: table.items[VERSION_TASK_ID]}
+    assert GraphValidation(**client.get(VALIDATION_ROUTE).json()) == validation
+    tasks_cache.clear()
+
+
+def test_get_tasks_with_invalid_page_token():
+    response = client.get(ROUTE, params={"page_token": "not a token"})
+    assert response.status_code == 400, response.json()
+
+
+def test_put_valid_object_in_empty_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     scan_table_mock.return_value = make_scan_table_response(results=[])
     task = make_task(id=f'{dag}/task')
     put_response = client.put(ROUTE, TasksChange(dags=[dag], tasks=[task]).json(exclude_unset=True))
@@ -28,10 +129,10 @@ def test_put_valid_object_in_empty_dag(scan_table_mock, mock_task_lock, mock_upd
     mock_update_db.assert_awaited_once_with(DbTasksChange(
         ids_to_remove=set(),
         tasks_to_update=[DbTask(next_tasks_ids=[], **task.dict())]
-    ))
+    ), lease=ANY)
 
 
-def test_put_task_outside_of_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_task_outside_of_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     scan_table_mock.return_value = make_scan_table_response(results=[])
     task = make_task(id=f'other_{dag}/task')
     put_response = client.put(ROUTE, TasksChange.construct(dags=[dag], tasks=[task]).json(exclude_unset=True))
@@ -40,7 +141,7 @@ def test_put_task_outside_of_dag(scan_table_mock, mock_task_lock, mock_update_db
     mock_update_db.assert_not_awaited()
 
 
-def test_put_update_tasks_in_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_update_tasks_in_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     initial_task_id, new_task_id = (f"{dag}/initial_task", f"{dag}/new_task")
     scan_table_mock.return_value = make_scan_table_response(results=[make_task_db(id=f"{dag}/initial_task")])
     new_task = make_task(id=new_task_id)
@@ -50,10 +151,10 @@ def test_put_update_tasks_in_dag(scan_table_mock, mock_task_lock, mock_update_db
     mock_update_db.assert_awaited_once_with(DbTasksChange(
         ids_to_remove={initial_task_id},
         tasks_to_update=[DbTask(**new_task.dict(exclude_unset=True))]
-    ))
+    ), lease=ANY)
 
 
-def test_put_delete_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_delete_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     existing_task = make_task_db(id=f"{dag}/task_id")
     scan_table_mock.return_value = make_scan_table_response(results=[existing_task])
     put_response = client.put(ROUTE, TasksChange(dags=[dag], tasks=[]).json(exclude_unset=True))
@@ -62,18 +163,31 @@ def test_put_delete_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMo
     mock_update_db.assert_awaited_once_with(DbTasksChange(
         ids_to_remove={existing_task.id},
         tasks_to_update=[]
-    ))
+    ), lease=ANY)
 
 
-def test_put_delete_non_existent_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_delete_non_existent_dag(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     scan_table_mock.return_value = make_scan_table_response(results=[])
     put_response = client.put(ROUTE, TasksChange.construct(dags=["non_existent_dag"], tasks=[]).json(exclude_unset=True))
     assert put_response.status_code == 200, put_response.json()
-    assert mock_task_lock.mock_calls == EXPECT_MOCK_CALLS
+    assert mock_task_lock.mock_calls == []  # the dag already holds no task
+    mock_update_db.assert_not_awaited()
+
+
+def test_put_unchanged_dag_is_skipped(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
+    parent = make_task_db(id=f"{dag}/parent", next_tasks_ids=[f"{dag}/child"])
+    child = make_task_db(id=f"{dag}/child", previous_tasks_ids=[parent.id])
+    scan_table_mock.return_value = make_scan_table_response(results=[parent, child])
+    tasks = [make_task(id=child.id, previous_tasks_ids=[parent.id]), make_task(id=parent.id)]
+    put_response = client.put(ROUTE, TasksChange(dags=[dag], tasks=tasks).json(exclude_unset=True))
+    assert put_response.status_code == 200, put_response.json()
+    assert put_response.json() == "No changes to perform."
+    assert mock_task_lock.mock_calls == []
     mock_update_db.assert_not_awaited()
 
 
-def test_delete_tasks_that_has_downstream(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_delete_tasks_that_has_downstream(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                          mock_tasks_version):
     upstream_dag = f"upstream_dag"
     upstream_task_id = f"{upstream_dag}/task"
     downstream_task_id = f"{dag}/downstream_task"
@@ -88,7 +202,7 @@ def test_delete_tasks_that_has_downstream(scan_table_mock, mock_task_lock, mock_
     mock_update_db.assert_not_awaited()
 
 
-def test_put_add_downstream_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_add_downstream_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     upstream_task_id = f"upstream_dag/task"
     existing_db_task = make_task_db(id=upstream_task_id, next_tasks_ids=[])
 
@@ -106,10 +220,11 @@ def test_put_add_downstream_task(scan_table_mock, mock_task_lock, mock_update_db
                 next_tasks_ids=[new_downstream_task.id]
             ),
         ]
-    ))
+    ), lease=ANY)
 
 
-def test_put_task_with_invalid_upstream_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_task_with_invalid_upstream_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                             mock_tasks_version):
     scan_table_mock.return_value = make_scan_table_response(results=[])
     task = make_task(id=f"{dag}/task", previous_tasks_ids=[f"other_{dag}/non_existant_task"])
     put_response = client.put(ROUTE, TasksChange(dags=[dag], tasks=[task]).json(exclude_unset=True))
@@ -118,7 +233,7 @@ def test_put_task_with_invalid_upstream_task(scan_table_mock, mock_task_lock, mo
     mock_update_db.assert_not_awaited()
 
 
-def test_put_circular_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_put_circular_task(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
     scan_table_mock.return_value = make_scan_table_response(results=[])
     task_id = f"{dag}/circular_task"
     task = make_task(id=task_id, previous_tasks_ids=[task_id])
@@ -128,7 +243,8 @@ def test_put_circular_task(scan_table_mock, mock_task_lock, mock_update_db: Asyn
     mock_update_db.assert_not_awaited()
 
 
-def test_add_circular_link_between_tasks(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock):
+def test_add_circular_link_between_tasks(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                         mock_tasks_version):
     upstream_task_id = f"{dag}/taskA"
     downstream_task_id = f"dagB/taskB"
     upstream_task_db = make_task_db(id=upstream_task_id, next_tasks_ids=[downstream_task_id])
@@ -141,3 +257,114 @@ def test_add_circular_link_between_tasks(scan_table_mock, mock_task_lock, mock_u
     assert mock_task_lock.mock_calls == EXPECT_MOCK_CALLS
     assert put_response.status_code == 400, put_response.json()
     mock_update_db.assert_not_awaited()
+
+
+def test_concurrent_changes_are_committed_in_one_batch(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                                       mock_tasks_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    tasks_changes = [TasksChange(dags=[f"dag_{i}"], tasks=[make_task(id=f"dag_{i}/task")]) for i in range(3)]
+
+    async def submit_all():
+        queue = TasksCommitQueue()
+        return await asyncio.gather(*(queue.submit(tasks_change) for tasks_change in tasks_changes))
+
+    results = asyncio.run(submit_all())
+    assert mock_task_lock.mock_calls == EXPECT_MOCK_CALLS
+    mock_update_db.assert_awaited_once()
+    assert [[task.id for task in result.tasks_to_update] for result in results] == \
+           [[f"dag_{i}/task"] for i in range(3)]
+
+
+def test_overlapping_changes_are_committed_in_order(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                                    mock_tasks_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    tasks_changes = [TasksChange(dags=[dag], tasks=[make_task(id=f"{dag}/first_task")]),
+                     TasksChange(dags=[f"{dag}/nested_dag"], tasks=[make_task(id=f"{dag}/nested_dag/task")]),
+                     TasksChange(dags=["other_dag"], tasks=[make_task(id="other_dag/task")])]
+
+    async def submit_all():
+        queue = TasksCommitQueue()
+        return await asyncio.gather(*(queue.submit(tasks_change) for tasks_change in tasks_changes))
+
+    asyncio.run(submit_all())
+    updated_ids = [{task.id for task in update_call.args[0].tasks_to_update}
+                   for update_call in mock_update_db.await_args_list]
+    assert updated_ids == [{f"{dag}/first_task", "other_dag/task"}, {f"{dag}/nested_dag/task"}]
+
+
+def test_blocked_batch_does_not_hold_back_other_dags(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                                     mock_tasks_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    blocked_change = TasksChange(dags=[dag], tasks=[make_task(id=f"{dag}/task")])
+    other_change = TasksChange(dags=["other_dag"], tasks=[make_task(id="other_dag/task")])
+
+    async def submit_all():
+        release = asyncio.Event()
+
+        async def update_db(db_changes: DbTasksChange, **_):
+            if any(task.id == f"{dag}/task" for task in db_changes.tasks_to_update):
+                await release.wait()  # stands for a slow write or a lock wait
+        mock_update_db.side_effect = update_db
+        queue = TasksCommitQueue()
+        blocked_result = asyncio.create_task(queue.submit(blocked_change))
+        await asyncio.sleep(0.01)
+        other_result = await asyncio.wait_for(queue.submit(other_change), timeout=5)
+        assert not blocked_result.done()
+        release.set()
+        return await blocked_result, other_result
+
+    blocked_result, other_result = asyncio.run(submit_all())
+    assert [task.id for task in blocked_result.tasks_to_update] == [f"{dag}/task"]
+    assert [task.id for task in other_result.tasks_to_update] == ["other_dag/task"]
+
+
+def test_invalid_change_fails_alone(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    valid_change = TasksChange(dags=["valid_dag"], tasks=[make_task(id="valid_dag/task")])
+    invalid_change = TasksChange(dags=[dag], tasks=[make_task(id=f"{dag}/task", previous_tasks_ids=["missing/task"])])
+
+    async def submit_all():
+        queue = TasksCommitQueue()
+        return await asyncio.gather(queue.submit(valid_change), queue.submit(invalid_change), return_exceptions=True)
+
+    valid_result, invalid_result = asyncio.run(submit_all())
+    assert [task.id for task in valid_result.tasks_to_update] == ["valid_dag/task"]
+    assert isinstance(invalid_result, InconsistentTasksDependencies)
+    mock_update_db.assert_awaited_once()
+
+
+def test_import_tasks(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
+    existing_task = make_task_db(id=f"{dag}/existing_task")
+    scan_table_mock.return_value = make_scan_table_response(results=[existing_task])
+    tasks = [make_task(id=f"{dag}/task_{i}", previous_tasks_ids=[f"{dag}/task_{i - 1}"] if i else [])
+             for i in range(50)]
+    body = "\n".join(task.json(exclude_unset=True) for task in tasks) + "\n"
+    response = client.put(IMPORT_ROUTE, params={"dags": [dag]}, data=body.encode())
+    assert response.status_code == 200, response.json()
+    assert mock_task_lock.mock_calls == EXPECT_MOCK_CALLS
+    [update_call] = mock_update_db.await_args_list
+    assert update_call.args[0].ids_to_remove == {existing_task.id}
+    assert sorted(task.id for task in update_call.args[0].tasks_to_update) == sorted(task.id for task in tasks)
+
+
+def test_import_rejects_invalid_records(scan_table_mock, mock_task_lock, mock_update_db: AsyncMock,
+                                       mock_tasks_version):
+    valid_line = make_task(id=f"{dag}/task").json(exclude_unset=True)
+    for invalid_line in ('{"id": "no_dag_task", "pod_template": "template"}',
+                         make_task(id="other_dag/task").json(exclude_unset=True),
+                         valid_line,
+                         "not json"):
+        response = client.put(IMPORT_ROUTE, params={"dags": [dag]}, data=f"{valid_line}\n\n{invalid_line}")
+        assert response.status_code == 422, response.json()
+        assert response.json()["line_number"] == 3
+    mock_update_db.assert_not_awaited()
+    assert mock_task_lock.mock_calls == []
+
+
+def test_import_limits(mocker, scan_table_mock, mock_task_lock, mock_update_db: AsyncMock, mock_tasks_version):
+    mocker.patch("config.IMPORT_MAX_TASKS", 2)
+    body = "\n".join(make_task(id=f"{dag}/task_{i}").json(exclude_unset=True) for i in range(3))
+    assert client.put(IMPORT_ROUTE, params={"dags": [dag]}, data=body).status_code == 413
+    mocker.patch("config.IMPORT_MAX_RECORD_BYTES", 10)
+    assert client.put(IMPORT_ROUTE, params={"dags": [dag]}, data=body).status_code == 413
+    mock_update_db.assert_not_awaited()
@@ -0,0 +1,162 @@
+"""
+Local stand-in of the dynamodb http api, serving memory tables. It speaks the json protocol of dynamodb, so tests can
+run the native storage backend end to end.
+"""
+import json
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set, Union
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from tests.db.memory_table import MemoryTable, ConditionParser
+
+_deserializer = TypeDeserializer()
+_serializer = TypeSerializer()
+
+
+def _deserialize_item(item: Dict) -> Dict:
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+def _serialize_item(item: Dict) -> Dict:
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+class DynamoDbHandler(BaseHTTPRequestHandler):
+    """Serves the table calls of the tables of the server. Counts the connections opened by clients."""
+    protocol_version = "HTTP/1.1"  # keeps connections alive
+    disable_nagle_algorithm = True  # headers and body are written separately
+    server: 'DynamoDbServer'
+
+    def _answer(self, status: int, body: Dict) -> None:
+        encoded_body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))), parse_float=Decimal)
+        operation = self.headers["X-Amz-Target"].split('.')[-1]
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.operations.append(operation)
+            failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure is not None:
+            status, code = (400, failure) if isinstance(failure, str) else (failure, "InternalServerError")
+            self._answer(status, {"__type": f"com.amazonaws.dynamodb.v20120810#{code}"})
+            return
+        try:
+            response = getattr(self, f"_{operation}")(body)
+        except ClientError as error:
+            error_body = {"__type": f"com.amazonaws.dynamodb.v20120810#{error.response['Error']['Code']}",
+                          "message": error.response['Error']['Message']}
+            if 'CancellationReasons' in error.response:
+                error_body['CancellationReasons'] = error.response['CancellationReasons']
+            self._answer(400, error_body)
+            return
+        self._answer(200, response)
+
+    def _table(self, body: Dict) -> MemoryTable:
+        return self.server.tables[body['TableName']]
+
+    @staticmethod
+    def _arguments(body: Dict) -> Dict:
+        """Arguments of the memory table call : python values and conditions instead of their serialized version"""
+        names = body.get('ExpressionAttributeNames', {})
+        values = _deserialize_item(body.get('ExpressionAttributeValues', {}))
+        arguments = {name: value for name, value in body.items() if name != 'TableName'}
+        for name in ('Key', 'Item', 'ExclusiveStartKey'):
+            if name in body:
+                arguments[name] = _deserialize_item(body[name])
+        for name in ('ConditionExpression', 'FilterExpression', 'KeyConditionExpression'):
+            if name in body:
+                arguments[name] = ConditionParser(body[name], names, values).parse()
+        if 'ExpressionAttributeValues' in body:
+            arguments['ExpressionAttributeValues'] = values
+        return arguments
+
+    @staticmethod
+    def _serialize_response(response: Dict) -> Dict:
+        serialized_response = dict(response)
+        for name in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if name in response:
+                serialized_response[name] = _serialize_item(response[name])
+        if 'Items' in response:
+            serialized_response['Items'] = [_serialize_item(item) for item in response['Items']]
+        return serialized_response
+
+    def _GetItem(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).get_item(**self._arguments(body)))
+
+    def _PutItem(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).put_item(**self._arguments(body)))
+
+    def _UpdateItem(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).update_item(**self._arguments(body)))
+
+    def _DeleteItem(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).delete_item(**self._arguments(body)))
+
+    def _Scan(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).scan(**self._arguments(body)))
+
+    def _Query(self, body: Dict) -> Dict:
+        return self._serialize_response(self._table(body).query(**self._arguments(body)))
+
+    def _BatchWriteItem(self, body: Dict) -> Dict:
+        unprocessed_items = {}
+        for table_name, write_requests in body['RequestItems'].items():
+            requests = [
+                {'PutRequest': {'Item': _deserialize_item(request['PutRequest']['Item'])}} if 'PutRequest' in request
+                else {'DeleteRequest': {'Key': _deserialize_item(request['DeleteRequest']['Key'])}}
+                for request in write_requests
+            ]
+            response = self.server.tables[table_name].batch_write_item(RequestItems={table_name: requests})
+            for request in response['UnprocessedItems'].get(table_name, []):
+                unprocessed_items.setdefault(table_name, []).append(
+                    {'PutRequest': {'Item': _serialize_item(request['PutRequest']['Item'])}} if 'PutRequest' in request
+                    else {'DeleteRequest': {'Key': _serialize_item(request['DeleteRequest']['Key'])}})
+        return {'UnprocessedItems': unprocessed_items}
+
+    def _TransactWriteItems(self, body: Dict) -> Dict:
+        transact_items = [{operation: {**self._arguments(request), 'TableName': request['TableName']}}
+                          for transact_item in body['TransactItems'] for operation, request in transact_item.items()]
+        table_name, = {request['TableName'] for transact_item in transact_items for request in transact_item.values()}
+        return self.server.tables[table_name].transact_write_items(TransactItems=transact_items)
+
+    def log_message(self, *_):
+        pass
+
+
+class DynamoDbServer(ThreadingHTTPServer):
+    """
+    Serves the memory tables on a local port, by table name.
+    Set failures to the http status, or the error code of client errors, of the next calls to fail, in order.
+    """
+    daemon_threads = True
+
+    def __init__(self, tables: List[MemoryTable]):
+        super().__init__(("127.0.0.1", 0), DynamoDbHandler)
+        self.tables: Dict[str, MemoryTable] = {table.name: table for table in tables}
+        self.connections: Set = set()
+        self.operations: List[str] = []
+        self.failures: List[Union[int, str]] = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self) -> 'DynamoDbServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+        self.server_close()
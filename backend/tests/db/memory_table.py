@@ -0,0 +1,402 @@
+import bisect
+import copy
+import re
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Dict, Iterable, Optional, List, Any, Set, Tuple
+
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr, ConditionBase
+
+_MISSING = object()
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+_CONDITION_TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),]|[#:]?[\w.#]+)')
+_CONDITION_COMPARISONS = {'=': 'eq', '<>': 'ne', '<': 'lt', '<=': 'lte', '>': 'gt', '>=': 'gte'}
+_CONDITION_FUNCTIONS = {'attribute_exists': 'exists', 'attribute_not_exists': 'not_exists',
+                        'begins_with': 'begins_with', 'contains': 'contains'}
+
+
+def _get_path(item: Dict, path: List[str]) -> Any:
+    value = item
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _matches(condition: ConditionBase, item: Dict) -> bool:
+    """Evaluates the few boto3 conditions used by streamflow against an item"""
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return all(_matches(sub_condition, item) for sub_condition in values)
+    if operator == 'OR':
+        return any(_matches(sub_condition, item) for sub_condition in values)
+    if operator == 'NOT':
+        return not _matches(values[0], item)
+    attribute_value = _get_path(item, values[0].name.split('.'))
+    if operator == 'attribute_exists':
+        return attribute_value is not _MISSING
+    if operator == 'attribute_not_exists':
+        return attribute_value is _MISSING
+    if attribute_value is _MISSING:
+        return False
+    if operator == 'begins_with':
+        return isinstance(attribute_value, str) and attribute_value.startswith(values[1])
+    if operator == 'contains':
+        return values[1] in attribute_value
+    if operator in _COMPARISONS:
+        return _COMPARISONS[operator](attribute_value, values[1])
+    raise NotImplementedError(f"Condition operator {operator} is not supported by the memory table")
+
+
+def _project(item: Dict, projection: Optional[str], names: Dict[str, str]) -> Dict:
+    """Keeps the top level attributes of the projection expression, all attributes without projection"""
+    if projection is None:
+        return item
+    attributes = {names.get(name.strip(), name.strip()) for name in projection.split(',')}
+    return {name: value for name, value in item.items() if name in attributes}
+
+
+class ConditionParser:
+    """Parses the condition expressions boto3 builds back into boto3 conditions, which memory tables evaluate"""
+
+    def __init__(self, expression: str, names: Dict[str, str], values: Dict[str, Any]):
+        self.tokens: List[str] = _CONDITION_TOKEN.findall(expression)
+        self.names = names
+        self.values = values
+        self.position = 0
+
+    def _next(self, expected: Optional[str] = None) -> str:
+        token = self.tokens[self.position]
+        if expected is not None and token != expected:
+            raise ValueError(f"Expected {expected} in condition expression, got {token}")
+        self.position += 1
+        return token
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _path(self, token: str) -> str:
+        return '.'.join(self.names.get(part, part) for part in token.split('.'))
+
+    def parse(self) -> ConditionBase:
+        condition = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected {self._peek()} in condition expression")
+        return condition
+
+    def _or(self) -> ConditionBase:
+        condition = self._and()
+        while self._peek() == 'OR':
+            self._next()
+            condition = condition | self._and()
+        return condition
+
+    def _and(self) -> ConditionBase:
+        condition = self._not()
+        while self._peek() == 'AND':
+            self._next()
+            condition = condition & self._not()
+        return condition
+
+    def _not(self) -> ConditionBase:
+        if self._peek() == 'NOT':
+            self._next()
+            return ~self._not()
+        return self._primary()
+
+    def _primary(self) -> ConditionBase:
+        token = self._next()
+        if token == '(':
+            condition = self._or()
+            self._next(')')
+            return condition
+        if token in _CONDITION_FUNCTIONS:
+            self._next('(')
+            attribute = Attr(self._path(self._next()))
+            arguments = []
+            while self._next() == ',':
+                arguments.append(self.values[self._next()])
+            return getattr(attribute, _CONDITION_FUNCTIONS[token])(*arguments)
+        return getattr(Attr(self._path(token)), _CONDITION_COMPARISONS[self._next()])(self.values[self._next()])
+
+
+def _conditional_check_failed(operation: str) -> ClientError:
+    return ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                  'Message': 'The conditional request failed'}}, operation)
+
+
+class _UpdateExpression:
+    """Applies the subset of update expressions used by streamflow : SET, REMOVE, ADD and DELETE clauses"""
+    _CLAUSE = re.compile(r'\b(SET|REMOVE|ADD|DELETE)\b')
+    _IF_NOT_EXISTS = re.compile(r'if_not_exists\(\s*([^,]+?)\s*,\s*(\S+?)\s*\)')
+
+    def __init__(self, expression: str, names: Dict[str, str], values: Dict[str, Any]):
+        self.names = names
+        self.values = values
+        parts = self._CLAUSE.split(expression)
+        self.clauses = [(parts[i], parts[i + 1]) for i in range(1, len(parts), 2)]
+
+    def _path(self, raw_path: str) -> List[str]:
+        return [self.names.get(part, part) for part in raw_path.strip().split('.')]
+
+    def _operand(self, item: Dict, raw_operand: str) -> Any:
+        raw_operand = raw_operand.strip()
+        if_not_exists = self._IF_NOT_EXISTS.fullmatch(raw_operand)
+        if if_not_exists:
+            value = _get_path(item, self._path(if_not_exists.group(1)))
+            return self._operand(item, if_not_exists.group(2)) if value is _MISSING else value
+        if raw_operand.startswith(':'):
+            return copy.deepcopy(self.values[raw_operand])
+        return copy.deepcopy(_get_path(item, self._path(raw_operand)))
+
+    @staticmethod
+    def _set(item: Dict, path: List[str], value: Any) -> None:
+        parent = _get_path(item, path[:-1])
+        if not isinstance(parent, dict):
+            raise ClientError({'Error': {'Code': 'ValidationException',
+                                         'Message': 'The document path provided in the update expression is invalid'}},
+                              'UpdateItem')
+        parent[path[-1]] = value
+
+    def apply(self, item: Dict) -> None:
+        for clause, actions in self.clauses:
+            for action in filter(None, (action.strip() for action in actions.split(','))):
+                if clause == 'SET':
+                    raw_path, raw_value = action.split('=', 1)
+                    operation = re.split(r'\s([+-])\s', raw_value, maxsplit=1)
+                    value = self._operand(item, operation[0])
+                    if len(operation) == 3:
+                        increment = self._operand(item, operation[2])
+                        value = value + increment if operation[1] == '+' else value - increment
+                    self._set(item, self._path(raw_path), value)
+                elif clause == 'REMOVE':
+                    path = self._path(action)
+                    parent = _get_path(item, path[:-1])
+                    if isinstance(parent, dict):
+                        parent.pop(path[-1], None)
+                else:
+                    raw_path, raw_value = action.split()
+                    path = self._path(raw_path)
+                    current = _get_path(item, path)
+                    value = self._operand(item, raw_value)
+                    if clause == 'ADD':
+                        if current is not _MISSING:
+                            value = current | value if isinstance(value, set) else current + value
+                        self._set(item, path, value)
+                    elif current is not _MISSING:
+                        remaining = current - value
+                        if remaining:
+                            self._set(item, path, remaining)
+                        else:  # dynamodb sets can not be empty
+                            _get_path(item, path[:-1]).pop(path[-1])
+
+
+def _cancel_transaction(reasons: List[Dict]) -> None:
+    raise ClientError({'Error': {'Code': 'TransactionCanceledException',
+                                 'Message': 'Transaction cancelled, please refer cancellation reasons'},
+                       'CancellationReasons': reasons}, 'TransactWriteItems')
+
+
+class MemoryTable:
+    """In memory stand-in of a boto3 dynamodb Table, hashed on "id", implementing the calls made by streamflow"""
+
+    def __init__(self, items: Iterable[Dict] = (), page_size: int = 100, max_processed_items: Optional[int] = None,
+                 name: str = "memory_table", indexes: Optional[Dict[str, Tuple[str, str]]] = None,
+                 latency: float = 0.):
+        """
+        :param page_size: maximum number of items evaluated by a scan or query call
+        :param max_processed_items: number of items processed per batch write call, the others are left unprocessed
+        :param indexes: hash and range keys of the global secondary indexes, by index name
+        :param latency: seconds each call blocks for, to model the network round trip to dynamodb
+        """
+        self.items: Dict[str, Dict] = {item['id']: dict(item) for item in items}
+        self.page_size = page_size
+        self.max_processed_items = max_processed_items
+        self.name = name
+        self.meta = SimpleNamespace(client=self)
+        self.indexes = indexes if indexes is not None else {"dag_index": ("dag", "id")}
+        self.scan_calls = 0
+        self.evaluated_items = 0  # number of items read by scan and query calls
+        self.batch_write_calls: List[List[Dict]] = []
+        self.latency = latency
+        self.transaction_conflicts = 0
+        self._writes = 0
+        self._transacted_keys: Set[str] = set()  # items of the transactions in progress
+        self._transactions_lock = threading.Lock()
+        self._sorted_items: Dict[Tuple, Tuple[Tuple[int, int], List[Dict], List[List]]] = {}
+
+    def _wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_sorted_items(self, key_names: List[str], segment: Optional[int],
+                          total_segments: Optional[int]) -> Tuple[List[Dict], List[List]]:
+        """Items of the segment with their keys, in key order. Kept until the next write so paging stays linear."""
+        cache_key = (tuple(key_names), segment, total_segments)
+        state = (self._writes, len(self.items))
+        cached = self._sorted_items.get(cache_key)
+        if cached is None or cached[0] != state:
+            items = sorted((item for item in self.items.values()
+                            if all(key_name in item for key_name in key_names) and
+                            (total_segments is None or zlib.crc32(item['id'].encode()) % total_segments == segment)),
+                           key=lambda item: [item[key_name] for key_name in key_names])
+            cached = self._sorted_items[cache_key] = \
+                (state, items, [[item[key_name] for key_name in key_names] for item in items])
+        return cached[1], cached[2]
+
+    def scan(self,
+             IndexName: Optional[str] = None,
+             FilterExpression: Optional[ConditionBase] = None,
+             ExclusiveStartKey: Optional[Dict] = None,
+             Segment: Optional[int] = None,
+             TotalSegments: Optional[int] = None,
+             Limit: Optional[int] = None,
+             ProjectionExpression: Optional[str] = None,
+             ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+             **_) -> Dict:
+        self._wait()
+        self.scan_calls += 1
+        key_names = ['id'] if IndexName is None else list(self.indexes[IndexName])
+        items, keys = self._get_sorted_items(key_names, Segment, TotalSegments)
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = bisect.bisect_right(keys, [ExclusiveStartKey[key_name] for key_name in key_names])
+        page_size = min(Limit or self.page_size, self.page_size)
+        page_items = items[start:start + page_size]
+        self.evaluated_items += len(page_items)
+        filtered_items = [_project(copy.deepcopy(item), ProjectionExpression, ExpressionAttributeNames or {})
+                          for item in page_items if FilterExpression is None or _matches(FilterExpression, item)]
+        response = {'Items': filtered_items, 'Count': len(filtered_items), 'ScannedCount': len(page_items)}
+        if len(items) > start + page_size:
+            response['LastEvaluatedKey'] = {key_name: page_items[-1][key_name] for key_name in {'id', *key_names}}
+        return response
+
+    def query(self, IndexName: str, KeyConditionExpression: ConditionBase,
+              ExclusiveStartKey: Optional[Dict] = None,
+              Limit: Optional[int] = None,
+              **_) -> Dict:
+        self._wait()
+        hash_key, range_key = self.indexes[IndexName]
+        items = sorted((item for item in self.items.values()
+                        if hash_key in item and range_key in item and _matches(KeyConditionExpression, item)),
+                       key=lambda item: item[range_key])
+        if ExclusiveStartKey is not None:
+            items = [item for item in items if item[range_key] > ExclusiveStartKey[range_key]]
+        page_size = min(Limit or self.page_size, self.page_size)
+        page_items = [copy.deepcopy(item) for item in items[:page_size]]
+        self.evaluated_items += len(page_items)
+        response = {'Items': page_items, 'Count': len(page_items), 'ScannedCount': len(page_items)}
+        if len(items) > page_size:
+            last_item = page_items[-1]
+            response['LastEvaluatedKey'] = {key: last_item[key] for key in {'id', hash_key, range_key}}
+        return response
+
+    def get_item(self, Key: Dict, **_) -> Dict:
+        self._wait()
+        item = self.items.get(Key['id'])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def _check_condition(self, key: str, condition: Optional[ConditionBase], operation: str) -> None:
+        if condition is not None and not _matches(condition, self.items.get(key, {})):
+            raise _conditional_check_failed(operation)
+
+    def put_item(self, Item: Dict, ConditionExpression: Optional[ConditionBase] = None, **_) -> Dict:
+        self._wait()
+        self._check_condition(Item['id'], ConditionExpression, 'PutItem')
+        self.items[Item['id']] = copy.deepcopy(Item)
+        self._writes += 1
+        return {}
+
+    def delete_item(self, Key: Dict, ConditionExpression: Optional[ConditionBase] = None, **_) -> Dict:
+        self._wait()
+        self._check_condition(Key['id'], ConditionExpression, 'DeleteItem')
+        self.items.pop(Key['id'], None)
+        self._writes += 1
+        return {}
+
+    def update_item(self, Key: Dict, UpdateExpression: str,
+                    ConditionExpression: Optional[ConditionBase] = None,
+                    ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                    ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+                    ReturnValues: str = 'NONE', **_) -> Dict:
+        self._wait()
+        self._check_condition(Key['id'], ConditionExpression, 'UpdateItem')
+        item = copy.deepcopy(self.items.get(Key['id'], dict(Key)))
+        _UpdateExpression(UpdateExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {}).apply(item)
+        self.items[Key['id']] = item
+        self._writes += 1
+        return {'Attributes': copy.deepcopy(item)} if ReturnValues != 'NONE' else {}
+
+    def transact_write_items(self, TransactItems: List[Dict]) -> Dict:
+        """
+        Writes the items if all conditions hold. Conditions are evaluated before any write, as one transaction.
+        Like dynamodb, a transaction involving an item of another transaction in progress is cancelled with
+        TransactionConflict.
+        """
+        assert len(TransactItems) <= 100, "dynamodb does not support more than 100 actions in a transaction"
+        keys = []
+        for transact_item in TransactItems:
+            (operation, request), = transact_item.items()
+            assert request['TableName'] == self.name, "transactions across tables are not supported"
+            keys.append(request['Item']['id'] if operation == 'Put' else request['Key']['id'])
+        with self._transactions_lock:
+            conflicting_keys = self._transacted_keys.intersection(keys)
+            if not conflicting_keys:
+                self._transacted_keys.update(keys)
+        if conflicting_keys:
+            self.transaction_conflicts += 1
+            _cancel_transaction([{'Code': 'TransactionConflict', 'Message': 'Transaction is ongoing for the item'}
+                                 if key in conflicting_keys else {'Code': 'None'} for key in keys])
+        try:
+            self._wait()
+            reasons = []
+            for transact_item, key in zip(TransactItems, keys):
+                (operation, request), = transact_item.items()
+                condition = request.get('ConditionExpression')
+                if isinstance(condition, str):  # built by the caller, as boto3 does not build nested conditions
+                    condition = ConditionParser(condition, request.get('ExpressionAttributeNames', {}),
+                                                request.get('ExpressionAttributeValues', {})).parse()
+                reasons.append({'Code': 'None'} if condition is None or _matches(condition, self.items.get(key, {}))
+                               else {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                _cancel_transaction(reasons)
+            for transact_item in TransactItems:
+                (operation, request), = transact_item.items()
+                if operation == 'Put':
+                    self.items[request['Item']['id']] = copy.deepcopy(request['Item'])
+                elif operation == 'Delete':
+                    self.items.pop(request['Key']['id'], None)
+            self._writes += 1
+            return {}
+        finally:
+            with self._transactions_lock:
+                self._transacted_keys.difference_update(keys)
+
+    def batch_write_item(self, RequestItems: Dict[str, List[Dict]]) -> Dict:
+        self._wait()
+        write_requests = RequestItems[self.name]
+        assert len(write_requests) <= 25, "dynamodb does not support more than 25 elements in a batch call"
+        self.batch_write_calls.append(write_requests)
+        self._writes += 1
+        processed_count = len(write_requests) if self.max_processed_items is None else self.max_processed_items
+        for write_request in write_requests[:processed_count]:
+            if 'PutRequest' in write_request:
+                item = write_request['PutRequest']['Item']
+                self.items[item['id']] = copy.deepcopy(item)
+            else:
+                self.items.pop(write_request['DeleteRequest']['Key']['id'], None)
+        unprocessed_requests = write_requests[processed_count:]
+        return {'UnprocessedItems': {self.name: unprocessed_requests} if unprocessed_requests else {}}
@@ -1,8 +1,10 @@
+import itertools
 from typing import Optional, List
-from unittest.mock import AsyncMock, call
+from unittest.mock import AsyncMock, MagicMock, call, ANY
 
 import pytest
 
+from db.cache import tasks_cache
 from db.tasks import TASK_KEY_PREFIX
 from model.db import DbTask
 
@@ -23,16 +25,16 @@ def make_scan_table_response(results: Optional[List[DbTask]] = None, next_key: O
 @pytest.fixture
 def mock_task_lock(mocker):
     lock_mock = AsyncMock()
-    acquire_lock_mock = AsyncMock()
-    lock_mock.attach_mock(acquire_lock_mock, 'acquire_lock')
+    acquire_lock_mock = AsyncMock(return_value=MagicMock(**{"covers.return_value": True}))
+    lock_mock.attach_mock(acquire_lock_mock, 'acquire_dags_lease')
     release_lock_mock = AsyncMock()
-    lock_mock.attach_mock(release_lock_mock, 'release_lock')
-    mocker.patch("db.tasks.acquire_lock", side_effect=lock_mock.acquire_lock)
-    mocker.patch("db.tasks.release_lock", side_effect=lock_mock.release_lock)
+    lock_mock.attach_mock(release_lock_mock, 'release_dags_lease')
+    mocker.patch("db.locks.acquire_dags_lease", side_effect=lock_mock.acquire_dags_lease)
+    mocker.patch("db.locks.release_dags_lease", side_effect=lock_mock.release_dags_lease)
     return lock_mock
 
 
-EXPECT_MOCK_CALLS = [call.acquire_lock(), call.release_lock()]
+EXPECT_MOCK_CALLS = [call.acquire_dags_lease(ANY), call.release_dags_lease(ANY)]
 
 
 @pytest.fixture
@@ -40,3 +42,13 @@ def mock_update_db(mocker):
     update_mock = AsyncMock()
     mocker.patch('db.tasks.update_db', side_effect=update_mock)
     return update_mock
+
+
+@pytest.fixture
+def mock_tasks_version(mocker):
+    """Mocks the tasks table version with a new version on every read so that the tasks cache is always refreshed"""
+    tasks_cache.clear()
+    version_mock = AsyncMock(side_effect=itertools.count())
+    mocker.patch("db.tasks.get_tasks_version", side_effect=version_mock)
+    mocker.patch("db.tasks.bump_tasks_version", side_effect=AsyncMock(return_value=-1))
+    return version_mock
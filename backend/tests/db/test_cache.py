@@ -0,0 +1,125 @@
+import asyncio
+import itertools
+from unittest.mock import AsyncMock
+
+from pytest import fixture
+
+from db.cache import TasksCache, CACHE_LOOKUPS
+from graph.hashes import get_dags_hashes
+from graph.snapshot import open_snapshot, read_deltas
+from model.db import DbTasksChange
+from tests.db.mocked_tasks import *
+from tests.model.utils import make_task_db
+
+
+@fixture
+def stored_version(mocker):
+    version_mock = AsyncMock(return_value=1)
+    mocker.patch("db.tasks.get_tasks_version", side_effect=version_mock)
+    return version_mock
+
+
+@fixture
+def bumped_version(mocker):
+    bump_mock = AsyncMock(side_effect=itertools.count(2))
+    mocker.patch("db.tasks.bump_tasks_version", side_effect=bump_mock)
+    return bump_mock
+
+
+def write_changes(cache: TasksCache, db_changes: DbTasksChange) -> None:
+    async def scenario():
+        begun_version = await cache.begin_changes()
+        await cache.apply_changes(db_changes, begun_version)
+    asyncio.run(scenario())
+
+
+def test_cache_is_refreshed_only_on_new_version(scan_table_mock, stored_version):
+    task = make_task_db(id="dag/task")
+    scan_table_mock.return_value = make_scan_table_response(results=[task])
+    cache = TasksCache()
+    hits, misses = CACHE_LOOKUPS.get(result="hit"), CACHE_LOOKUPS.get(result="miss")
+    assert asyncio.run(cache.get_tasks()) == {task.id: task}
+    scan_calls = scan_table_mock.await_count
+    assert asyncio.run(cache.get_tasks()) == {task.id: task}
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert scan_table_mock.await_count == scan_calls
+
+    stored_version.return_value = 3
+    asyncio.run(cache.get_tasks())
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert (CACHE_LOOKUPS.get(result="hit") - hits, CACHE_LOOKUPS.get(result="miss") - misses) == (1, 2)
+    assert scan_table_mock.await_count == 2 * scan_calls
+
+
+def test_cache_applies_own_changes(scan_table_mock, stored_version, bumped_version):
+    task, new_task = make_task_db(id="dag/task"), make_task_db(id="dag/new_task")
+    scan_table_mock.return_value = make_scan_table_response(results=[task])
+    cache = TasksCache()
+    asyncio.run(cache.get_tasks())
+    scan_calls = scan_table_mock.await_count
+    write_changes(cache, DbTasksChange(ids_to_remove={task.id}, tasks_to_update=[new_task]))
+    stored_version.return_value = 3
+    assert asyncio.run(cache.get_tasks()) == {new_task.id: new_task}
+    assert scan_table_mock.await_count == scan_calls
+
+
+def test_cache_updates_dags_hashes(scan_table_mock, stored_version, bumped_version):
+    tasks = [make_task_db(id="dag/task"), make_task_db(id="dag/nested_dag/task"), make_task_db(id="other_dag/task")]
+    scan_table_mock.return_value = make_scan_table_response(results=tasks)
+    cache = TasksCache()
+    asyncio.run(cache.get_tasks())
+    cache.get_dags_hashes()
+    new_task = make_task_db(id="dag/nested_dag/task", pod_template="new_template")
+    write_changes(cache, DbTasksChange(ids_to_remove={"dag/task"}, tasks_to_update=[new_task]))
+    assert cache.get_dags_hashes() == get_dags_hashes([new_task, tasks[2]])
+
+
+def test_cache_is_cleared_on_concurrent_change(scan_table_mock, stored_version, bumped_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    cache = TasksCache()
+    asyncio.run(cache.get_tasks())
+    bumped_version.side_effect = iter([2, 4])  # another writer bumped the version during the write
+    write_changes(cache, DbTasksChange(ids_to_remove=set(), tasks_to_update=[]))
+    assert cache.version is None
+
+
+def test_version_is_bumped_before_changes_are_written(scan_table_mock, stored_version, bumped_version):
+    scan_table_mock.return_value = make_scan_table_response(results=[])
+    writer_cache, reader_cache = TasksCache(), TasksCache()
+    asyncio.run(reader_cache.get_tasks())
+    begun_version = asyncio.run(writer_cache.begin_changes())
+    stored_version.return_value = begun_version  # the writer dies before apply_changes
+    asyncio.run(reader_cache.get_tasks())
+    assert reader_cache.misses == 2
+
+
+def test_graph_is_read_from_snapshot_and_deltas(scan_table_mock, stored_version, bumped_version, tmp_path, mocker):
+    mocker.patch("config.GRAPH_SNAPSHOT_PATH", str(tmp_path / "graph"))
+    parent, child = make_task_db(id="dag/parent"), make_task_db(id="dag/child", previous_tasks_ids=["dag/parent"])
+    scan_table_mock.return_value = make_scan_table_response(results=[parent, child])
+    writer_cache = TasksCache()
+    asyncio.run(writer_cache.get_graph())  # scans the table and writes the snapshot of version 1
+    new_task = make_task_db(id="dag/new_task", previous_tasks_ids=["dag/child"])
+    write_changes(writer_cache, DbTasksChange(ids_to_remove=set(), tasks_to_update=[new_task]))
+    scan_calls = scan_table_mock.await_count
+
+    stored_version.return_value = 3
+    graph = asyncio.run(TasksCache().get_graph())
+    assert scan_table_mock.await_count == scan_calls
+    assert graph.get_ancestors_ids([new_task.id]) == {parent.id, child.id, new_task.id}
+
+    stored_version.return_value = 4  # committed by another host : no delta
+    asyncio.run(TasksCache().get_graph())
+    assert scan_table_mock.await_count > scan_calls
+
+
+def test_snapshot_is_rewritten_once_deltas_pile_up(scan_table_mock, stored_version, bumped_version, tmp_path, mocker):
+    path = str(tmp_path / "graph")
+    mocker.patch("config.GRAPH_SNAPSHOT_PATH", path)
+    mocker.patch("config.GRAPH_SNAPSHOT_MAX_DELTAS", 1)
+    scan_table_mock.return_value = make_scan_table_response(results=[make_task_db(id="dag/task")])
+    cache = TasksCache()
+    asyncio.run(cache.get_graph())
+    write_changes(cache, DbTasksChange(ids_to_remove={"dag/task"}, tasks_to_update=[]))
+    assert open_snapshot(path).version == 3 and "dag/task" not in open_snapshot(path)
+    assert read_deltas(path, version=1) == []
@@ -0,0 +1,128 @@
+import asyncio
+
+from botocore.exceptions import ClientError
+from pytest import fixture, raises
+
+import config
+
+from db.locks import acquire_dags_lease, release_dags_lease, extend_dags_lease, normalize_dags, \
+    DagsLocked, LeaseLost, _lease_key
+from db import tasks as tasks_db
+from db.storage import ThreadedTable
+from model.db import DbTask, DbTasksChange
+from tests.db.memory_table import MemoryTable
+
+
+@fixture
+def lock_table(mocker) -> MemoryTable:
+    table = MemoryTable()
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    mocker.patch("config.LOCK_ACQUIRE_TIMEOUT", 0)  # fail at first conflict
+    return table
+
+
+def test_normalize_dags():
+    assert normalize_dags(["b/", "a/b", "a", "a-b", "a/b/c"]) == ["a", "a-b", "b"]
+
+
+def test_unrelated_dags_are_locked_in_parallel(lock_table):
+    async def scenario():
+        first_lease = await acquire_dags_lease(["team_a/dag"])
+        second_lease = await acquire_dags_lease(["team_a/other_dag", "team_b"])
+        assert first_lease.covers("team_a/dag/nested_dag") and not first_lease.covers("team_a/other_dag")
+        await release_dags_lease(first_lease)
+        await release_dags_lease(second_lease)
+    asyncio.run(scenario())
+    assert not any("owner" in item or "intents" in item for item in lock_table.items.values())
+
+
+def test_nested_dags_conflict(lock_table):
+    async def scenario():
+        lease = await acquire_dags_lease(["team_a/dag"])
+        with raises(DagsLocked):
+            await acquire_dags_lease(["team_a"])
+        with raises(DagsLocked):
+            await acquire_dags_lease(["team_a/dag/nested_dag"])
+        await release_dags_lease(lease)
+        await release_dags_lease(await acquire_dags_lease(["team_a"]))
+    asyncio.run(scenario())
+
+
+def test_extend_lease_to_parent_dag(lock_table):
+    async def scenario():
+        lease = await acquire_dags_lease(["team_a/dag"])
+        await extend_dags_lease(lease, ["team_a"])
+        assert lease.covers("team_a/other_dag")
+        await release_dags_lease(lease)
+    asyncio.run(scenario())
+
+
+def test_dead_holder_locks_are_reclaimed(lock_table):
+    async def scenario():
+        dead_lease = await acquire_dags_lease(["team_a/dag"])
+        dead_lease.heartbeat.cancel()
+        lock_table.items[_lease_key(dead_lease.owner)['id']]['expires_at'] = 0
+        dead_lease.expires_at = 0
+        lease = await acquire_dags_lease(["team_a/dag"])
+        assert _lease_key(dead_lease.owner)['id'] not in lock_table.items  # fences the writes of the dead holder
+        assert await tasks_db.get_tasks_version() == 1  # the dead holder may have written part of its changes
+        with raises(LeaseLost):
+            dead_lease.ensure_held()
+        await release_dags_lease(lease)
+    asyncio.run(scenario())
+
+
+def test_writes_of_reclaimed_leases_are_fenced(lock_table):
+    task = DbTask(id="team_a/dag/task", pod_template="template", previous_tasks_ids=[])
+
+    async def scenario():
+        dead_lease = await acquire_dags_lease(["team_a/dag"])
+        dead_lease.heartbeat.cancel()
+        lock_table.items[_lease_key(dead_lease.owner)['id']]['expires_at'] = 0
+        lease = await acquire_dags_lease(["team_a"])
+        await tasks_db.update_db(DbTasksChange(tasks_to_update=[task], ids_to_remove=set()), lease=lease)
+        with raises(LeaseLost):  # the local expiry check is passed : the lease item expired while the holder paused
+            await tasks_db.update_db(DbTasksChange(tasks_to_update=[], ids_to_remove={task.id}), lease=dead_lease)
+        await release_dags_lease(lease)
+    asyncio.run(scenario())
+    assert tasks_db.TASK_KEY_PREFIX + task.id in lock_table.items
+
+
+def test_fenced_batches_of_sibling_dags_do_not_conflict(lock_table):
+    lock_table.latency = 0.001  # transactions overlap in time
+    changes = {dag: DbTasksChange(tasks_to_update=[DbTask(id=f"{dag}/task_{i}", pod_template="template")
+                                                   for i in range(250)], ids_to_remove=set())
+               for dag in ["team_a/dag_b", "team_a/dag_c"]}
+
+    async def write(dag: str):
+        lease = await acquire_dags_lease([dag])
+        report = await tasks_db.update_db(changes[dag], lease=lease, max_concurrency=8)
+        await release_dags_lease(lease)
+        return report
+
+    async def scenario():
+        return await asyncio.gather(*(write(dag) for dag in changes))
+    reports = asyncio.run(scenario())
+    assert lock_table.transaction_conflicts == 0
+    assert [report.items_written for report in reports] == [250, 250]
+    assert all(tasks_db.TASK_KEY_PREFIX + task.id in lock_table.items
+               for change in changes.values() for task in change.tasks_to_update)
+
+
+def test_transaction_conflicts_are_retried_then_raised(lock_table, mocker):
+    mocker.patch("db.tasks.asyncio.sleep", side_effect=mocker.AsyncMock())  # backoff waits
+    task = DbTask(id="team_a/dag/task", pod_template="template")
+    conflict = ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                            'CancellationReasons': [{'Code': 'None'}, {'Code': 'TransactionConflict'}]},
+                           'TransactWriteItems')
+    transact_mock = mocker.patch.object(lock_table, "transact_write_items", side_effect=conflict)
+
+    async def scenario():
+        lease = await acquire_dags_lease(["team_a/dag"])
+        try:
+            with raises(ClientError):
+                await tasks_db.update_db(DbTasksChange(tasks_to_update=[task], ids_to_remove=set()), lease=lease)
+        finally:
+            await release_dags_lease(lease)
+    asyncio.run(scenario())
+    assert transact_mock.call_count == config.WRITE_MAX_RETRIES + 1
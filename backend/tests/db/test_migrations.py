@@ -0,0 +1,25 @@
+import asyncio
+
+from db.migrations import add_tasks_dag_attribute
+from db.tasks import _serialize_downward_task, get_dag_tasks, DAG_ATTRIBUTE, VERSION_TASK_ID
+from model.db import DbTask
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+
+def test_add_tasks_dag_attribute(mocker):
+    tasks = [DbTask(id=f"dag_{i % 3}/task_{i}", pod_template="template") for i in range(90)]
+    legacy_items = [_serialize_downward_task(task) for task in tasks]
+    for item in legacy_items[:60]:
+        del item[DAG_ATTRIBUTE]
+    table = MemoryTable(items=legacy_items + [{"id": VERSION_TASK_ID, "version": 3}], page_size=7)
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+
+    async def collect_dag_tasks(dag: str):
+        return [task async for task in get_dag_tasks(dag)]
+
+    assert asyncio.run(add_tasks_dag_attribute()) == 60
+    assert asyncio.run(add_tasks_dag_attribute()) == 0
+    assert sorted(asyncio.run(collect_dag_tasks("dag_0")), key=lambda task: task.id) == \
+           sorted((task for task in tasks if task.id.startswith("dag_0/")), key=lambda task: task.id)
+    assert DAG_ATTRIBUTE not in table.items[VERSION_TASK_ID]
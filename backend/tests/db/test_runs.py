@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from botocore.exceptions import ClientError
+from pytest import fixture, raises
+
+from db import runs as runs_db
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+
+@fixture
+def runs_table(mocker) -> MemoryTable:
+    table = MemoryTable(max_processed_items=20)
+    mocker.patch("db.runs.RUNS_TABLE", ThreadedTable(table))
+    mocker.patch("db.writes.asyncio.sleep", side_effect=AsyncMock())
+    return table
+
+
+def test_create_instances(runs_table):
+    pending_parents = {f"dag/task_{index}": index % 3 for index in range(60)}
+    asyncio.run(runs_db.create_instances("run", pending_parents, next_tasks_ids={"dag/task_0": ["dag/task_1"]}))
+    instances = {item["task_id"]: item for item in runs_table.items.values()}
+    assert {task_id: item["pending_parents"] for task_id, item in instances.items()} == pending_parents
+    assert instances["dag/task_0"]["next_tasks_ids"] == ["dag/task_1"]
+    assert all(item["state"] == runs_db.PENDING for item in instances.values())
+
+
+def test_decrement_pending_parents_reaches_zero_once(runs_table):
+    async def scenario():
+        await runs_db.create_instances("run", {"dag/task": 3}, next_tasks_ids={})
+        remaining = await asyncio.gather(*(runs_db.decrement_pending_parents("run", "dag/task", f"dag/parent_{i}")
+                                           for i in range(3)))
+        assert sorted(remaining) == [0, 1, 2]
+        with raises(ClientError):
+            await runs_db.decrement_pending_parents("run", "dag/task", "dag/other_parent")
+    asyncio.run(scenario())
+
+
+class RetryingTable(MemoryTable):
+    """Performs each update twice, as the storage does when the response of a successful call is lost"""
+
+    def update_item(self, **kwargs):
+        super().update_item(**kwargs)
+        return super().update_item(**kwargs)
+
+
+def test_instance_updates_are_idempotent(mocker):
+    mocker.patch("db.runs.RUNS_TABLE", ThreadedTable(RetryingTable()))
+
+    async def scenario():
+        await runs_db.create_instances("run", {"dag/task": 2}, next_tasks_ids={})
+        assert await runs_db.decrement_pending_parents("run", "dag/task", "dag/parent") == 1
+        assert await runs_db.decrement_pending_parents("run", "dag/task", "dag/parent") == 1
+        assert await runs_db.decrement_pending_parents("run", "dag/task", "dag/other_parent") == 0
+        assert await runs_db.set_instance_state("run", "dag/task", runs_db.RUNNING, expected_state=runs_db.PENDING)
+        assert not await runs_db.set_instance_state("run", "dag/task", runs_db.RUNNING, expected_state=runs_db.PENDING)
+    asyncio.run(scenario())
+
+
+def test_set_instance_state_is_conditional(runs_table):
+    async def scenario():
+        await runs_db.create_instances("run", {"dag/task": 0}, next_tasks_ids={})
+        assert await runs_db.set_instance_state("run", "dag/task", runs_db.RUNNING, expected_state=runs_db.PENDING)
+        assert not await runs_db.set_instance_state("run", "dag/task", runs_db.RUNNING, expected_state=runs_db.PENDING)
+    asyncio.run(scenario())
@@ -0,0 +1,212 @@
+import asyncio
+from typing import List
+
+import httpx
+from boto3.dynamodb.conditions import Attr
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+from pytest import fixture, raises
+
+import config
+
+from db import runs as runs_db
+from db import storage
+from db.storage import DynamoDbHttpClient, NativeTable, ThreadedTable, open_table
+from db.tasks import TASK_KEY_PREFIX, _serialize_downward_task, get_all_tasks, get_dag_tasks, update_db
+from model.db import DbTask, DbTasksChange
+from tests.db.dynamodb_server import DynamoDbServer
+from tests.db.memory_table import MemoryTable
+
+
+@fixture
+def tasks_table() -> MemoryTable:
+    return MemoryTable(name="tasks", page_size=30)
+
+
+@fixture
+def server(tasks_table):
+    with DynamoDbServer([tasks_table, MemoryTable(name="runs", max_processed_items=20)]) as dynamodb_server:
+        yield dynamodb_server
+
+
+@fixture
+def client(server, mocker) -> DynamoDbHttpClient:
+    mocker.patch("db.storage.asyncio.sleep", side_effect=mocker.AsyncMock())  # backoff waits
+    return DynamoDbHttpClient(region_name="eu-west-1", endpoint_url=server.url, max_connections=4,
+                              credentials=Credentials("access_key", "secret_key"))
+
+
+def test_item_calls_round_trip(client):
+    table = NativeTable("tasks", client)
+
+    async def scenario():
+        await table.put_item(Item={"id": "item", "count": 1, "tags": {"a"}},
+                             ConditionExpression=Attr("id").not_exists())
+        response = await table.update_item(Key={"id": "item"}, UpdateExpression="ADD #count :increment",
+                                           ConditionExpression=Attr("count").gt(0),
+                                           ExpressionAttributeNames={"#count": "count"},
+                                           ExpressionAttributeValues={":increment": 2}, ReturnValues="UPDATED_NEW")
+        assert response["Attributes"]["count"] == 3
+        assert (await table.get_item(Key={"id": "item"}))["Item"] == {"id": "item", "count": 3, "tags": {"a"}}
+        with raises(ClientError) as error:
+            await table.put_item(Item={"id": "item"}, ConditionExpression=Attr("id").not_exists())
+        assert error.value.response["Error"]["Code"] == "ConditionalCheckFailedException"
+        await table.delete_item(Key={"id": "item"})
+        assert "Item" not in await table.get_item(Key={"id": "item"})
+        await client.close()
+    asyncio.run(scenario())
+
+
+def test_transactions_report_cancellation_reasons(client, tasks_table):
+    table = NativeTable("tasks", client)
+
+    async def scenario():
+        await table.transact_write_items(TransactItems=[{'Put': {'TableName': "tasks", 'Item': {"id": "item"}}}])
+        with raises(ClientError) as error:
+            await table.transact_write_items(TransactItems=[
+                {'Put': {'TableName': "tasks", 'Item': {"id": "other_item"}}},
+                {'ConditionCheck': {'TableName': "tasks", 'Key': {"id": "item"},
+                                    'ConditionExpression': "attribute_exists(#count)",
+                                    'ExpressionAttributeNames': {"#count": "count"}}},
+            ])
+        await client.close()
+        return error.value.response
+    response = asyncio.run(scenario())
+    assert [reason["Code"] for reason in response["CancellationReasons"]] == ["None", "ConditionalCheckFailed"]
+    assert set(tasks_table.items) == {"item"}
+
+
+def test_tasks_reads_and_writes_through_native_table(client, tasks_table, mocker):
+    mocker.patch("db.tasks.TASK_TABLE", NativeTable("tasks", client))
+    tasks = [DbTask(id=f"dag_{i % 3}/task_{i}", pod_template="template", previous_tasks_ids=[]) for i in range(100)]
+
+    async def scenario() -> List[str]:
+        await update_db(DbTasksChange(tasks_to_update=tasks, ids_to_remove=set()))
+        assert sorted([task.id async for task in get_all_tasks(total_segments=4)]) == sorted(task.id for task in tasks)
+        dag_tasks_ids = [task.id async for task in get_dag_tasks("dag_1")]
+        await client.close()
+        return dag_tasks_ids
+
+    assert sorted(asyncio.run(scenario())) == sorted(task.id for task in tasks if task.id.startswith("dag_1/"))
+    assert tasks_table.items[TASK_KEY_PREFIX + tasks[0].id] == _serialize_downward_task(tasks[0])
+
+
+def test_runs_unprocessed_items_and_conditions_through_native_table(client, mocker):
+    mocker.patch("db.runs.RUNS_TABLE", NativeTable("runs", client))
+    mocker.patch("db.writes.asyncio.sleep", side_effect=mocker.AsyncMock())
+
+    async def scenario():
+        await runs_db.create_instances("run", {f"dag/task_{i}": 2 for i in range(60)}, next_tasks_ids={})
+        remaining = await asyncio.gather(*(runs_db.decrement_pending_parents("run", "dag/task_0", f"dag/parent_{i}")
+                                           for i in range(2)))
+        assert sorted(remaining) == [0, 1]
+        assert await runs_db.decrement_pending_parents("run", "dag/task_0", "dag/parent_0") == 0
+        with raises(ClientError):
+            await runs_db.decrement_pending_parents("run", "dag/task_0", "dag/other_parent")
+        await client.close()
+    asyncio.run(scenario())
+
+
+def test_connections_are_pooled_and_kept_alive(client, server):
+    table = NativeTable("tasks", client)
+
+    async def scenario():
+        await asyncio.gather(*(table.put_item(Item={"id": f"item_{i}"}) for i in range(200)))
+        await client.close()
+    asyncio.run(scenario())
+    assert len(server.operations) == 200
+    assert len(server.connections) <= client.max_connections
+
+
+def test_server_errors_are_retried(client, server):
+    server.failures = [500, 503]
+
+    async def scenario():
+        await NativeTable("tasks", client).put_item(Item={"id": "item"})
+        await client.close()
+    asyncio.run(scenario())
+    assert server.operations == ["PutItem"] * 3
+
+
+def test_server_errors_of_non_idempotent_calls_are_not_retried(client, server):
+    server.failures = [500]
+
+    async def scenario():
+        table = NativeTable("tasks", client)
+        with raises(ClientError) as error:  # the counter may have been incremented already
+            await table.update_item(Key={"id": "item"}, UpdateExpression="ADD #count :increment",
+                                    ExpressionAttributeNames={"#count": "count"},
+                                    ExpressionAttributeValues={":increment": 1})
+        server.failures = [500]
+        with raises(ClientError):
+            await table.put_item(Item={"id": "item"}, ConditionExpression=Attr("id").not_exists())
+        server.failures = [500]
+        await table.transact_write_items(TransactItems=[{'Put': {'TableName': "tasks", 'Item': {"id": "other"}}}])
+        await client.close()
+        return error.value.response
+    assert asyncio.run(scenario())["Error"]["Code"] == "InternalServerError"
+    assert server.operations == ["UpdateItem", "PutItem", "TransactWriteItems", "TransactWriteItems"]
+
+
+def test_read_timeouts_are_only_retried_for_idempotent_calls(client, mocker):
+    post_mock = mocker.patch("httpx.AsyncClient.post", side_effect=httpx.ReadTimeout("timeout"))
+    table = NativeTable("tasks", client)
+
+    async def scenario():
+        with raises(httpx.ReadTimeout):
+            await table.update_item(Key={"id": "item"}, UpdateExpression="SET #state = :state",
+                                    ExpressionAttributeNames={"#state": "state"},
+                                    ExpressionAttributeValues={":state": "running"})
+        assert post_mock.await_count == 1
+        with raises(httpx.ReadTimeout):
+            await table.get_item(Key={"id": "item"})
+        await client.close()
+    asyncio.run(scenario())
+    assert post_mock.await_count == 1 + config.DYNAMODB_MAX_RETRIES + 1
+
+
+def test_throttled_calls_are_retried(client, server):
+    server.failures = ["ProvisionedThroughputExceededException", "ThrottlingException"]
+    key = {"id": "item"}
+
+    async def scenario():
+        table = NativeTable("tasks", client)
+        await table.put_item(Item=key)
+        server.failures = ["RequestLimitExceeded"] * (config.DYNAMODB_MAX_RETRIES + 1)
+        with raises(ClientError) as error:  # retries exhausted
+            await table.get_item(Key=key)
+        await client.close()
+        return error.value.response
+    assert asyncio.run(scenario())["Error"]["Code"] == "RequestLimitExceeded"
+    assert server.operations == ["PutItem"] * 3 + ["GetItem"] * (config.DYNAMODB_MAX_RETRIES + 1)
+    assert key == {"id": "item"}  # parameters of the caller are not transformed in place
+
+
+def test_credentials_are_refreshed_only_near_expiry(client, mocker):
+    credentials = mocker.Mock(get_frozen_credentials=mocker.Mock(return_value=Credentials("key", "secret")),
+                              refresh_needed=mocker.Mock(return_value=False))
+    client._credentials = credentials
+    table = NativeTable("tasks", client)
+
+    async def scenario():
+        await asyncio.gather(*(table.put_item(Item={"id": f"item_{i}"}) for i in range(5)))
+        credentials.refresh_needed.return_value = True
+        await table.get_item(Key={"id": "item_0"})
+        await client.close()
+    asyncio.run(scenario())
+    assert credentials.get_frozen_credentials.call_count <= 2
+
+
+def test_open_table_follows_storage_backend(mocker):
+    mocker.patch("db.storage._http_client", None)
+    mocker.patch("config.STORAGE_BACKEND", storage.NATIVE_BACKEND)
+    mocker.patch("config.DYNAMODB_ENDPOINT_URL", "http://127.0.0.1:8000")
+    table = open_table("tasks")
+    assert isinstance(table, NativeTable) and table.client.endpoint_url == "http://127.0.0.1:8000"
+    assert open_table("runs").client is table.client
+    mocker.patch("db.dynamodb.dynamodb", mocker.Mock())
+    mocker.patch("config.STORAGE_BACKEND", storage.THREADED_BACKEND)
+    assert isinstance(open_table("tasks"), ThreadedTable)
+    mocker.patch("config.STORAGE_BACKEND", "unknown")
+    with raises(EnvironmentError):
+        open_table("tasks")
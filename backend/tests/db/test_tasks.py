@@ -1,7 +1,19 @@
-from pytest import fixture
+import asyncio
+from typing import List
+from unittest.mock import AsyncMock
 
-from model.db import DbTask
-from db.tasks import _deserialize_downward_task, _serialize_downward_task
+from botocore.exceptions import ClientError
+from pytest import fixture, raises
+
+from model.db import DbTask, DbTasksChange
+from model.task_model import CallTask
+from db.tasks import _deserialize_downward_task, _serialize_downward_task, get_all_tasks, get_dag_tasks, update_db, \
+    LOCK_TASK_ID, TASK_KEY_PREFIX, HASH_ATTRIBUTE
+from db.storage import ThreadedTable
+from db.writes import UnprocessedItemsError
+from metrics import collect_spans
+from tests.db.memory_table import MemoryTable
+from tests.db.mocked_tasks import scan_table_mock
 
 
 @fixture()
@@ -16,3 +28,100 @@ def initial_db_task():
 def test_serialisation(initial_db_task: DbTask):
     processed_db_tasks = _deserialize_downward_task(_serialize_downward_task(initial_db_task))
     assert processed_db_tasks == initial_db_task
+
+
+def test_trusted_deserialisation_matches_validated_deserialisation():
+    tasks = [
+        DbTask(id="dag/pod_task", pod_template="template", next_tasks_ids=["dag/call_task"]),
+        DbTask(id="dag/call_task", previous_tasks_ids=["dag/pod_task"],
+               call_templates=[CallTask(url_template="url", method="POST", log_response=True)]),
+    ]
+    for task in tasks:
+        item = _serialize_downward_task(task)
+        trusted_task, validated_task = _deserialize_downward_task(item, trusted=True), _deserialize_downward_task(item)
+        assert trusted_task == validated_task == task
+        assert trusted_task.__fields_set__ == validated_task.__fields_set__
+        assert trusted_task.content_hash == item[HASH_ATTRIBUTE] == task.content_hash
+    assert isinstance(_deserialize_downward_task(_serialize_downward_task(tasks[1]), trusted=True).call_templates[0],
+                      CallTask)
+
+
+async def collect_all_tasks(**kwargs) -> List[DbTask]:
+    return [task async for task in get_all_tasks(**kwargs)]
+
+
+def test_parallel_scan_matches_sequential_scan(mocker):
+    tasks = [DbTask(id=f"dag_{i % 7}/task_{i}", pod_template="template") for i in range(1000)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks] + [{"id": LOCK_TASK_ID}], page_size=30)
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    sequential_tasks = asyncio.run(collect_all_tasks(total_segments=1, max_concurrency=1))
+    parallel_tasks = asyncio.run(collect_all_tasks(total_segments=8, max_concurrency=3))
+    assert len(parallel_tasks) == len(tasks)
+    assert sorted(parallel_tasks, key=lambda t: t.id) == sorted(sequential_tasks, key=lambda t: t.id)
+
+
+def test_scanned_tasks_keep_their_stored_hash(mocker):
+    item = {**_serialize_downward_task(DbTask(id="dag/task", pod_template="template")), HASH_ATTRIBUTE: "stored_hash"}
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(MemoryTable(items=[item])))
+    scanned_task, = asyncio.run(collect_all_tasks(total_segments=1, max_concurrency=1))
+    assert scanned_task.content_hash == "stored_hash"
+
+
+def test_scan_span_leaves_out_the_caller_time(mocker):
+    tasks = [DbTask(id=f"dag/task_{i}", pod_template="template") for i in range(3)]
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(MemoryTable(items=[_serialize_downward_task(task)
+                                                                         for task in tasks])))
+
+    async def scenario():
+        with collect_spans() as spans:
+            async for _ in get_all_tasks(total_segments=1, max_concurrency=1):
+                await asyncio.sleep(0.05)
+        return spans
+    [(stage, duration)] = asyncio.run(scenario())
+    assert stage == "scan" and duration < 0.05
+
+
+def test_dag_tasks_are_queried_from_the_dag_partition(mocker):
+    tasks = [DbTask(id=f"dag_{i % 11}/task_{i}", pod_template="template") for i in range(1100)]
+    tasks += [DbTask(id=f"dag_1/nested_dag/task_{i}", pod_template="template") for i in range(50)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in tasks] + [{"id": LOCK_TASK_ID}], page_size=30)
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+
+    async def collect_dag_tasks(dag: str) -> List[str]:
+        return [task.id async for task in get_dag_tasks(dag)]
+
+    dag_tasks_ids = asyncio.run(collect_dag_tasks("dag_1"))
+    assert sorted(dag_tasks_ids) == sorted(task.id for task in tasks if task.id.startswith("dag_1/"))
+    assert table.evaluated_items == len(dag_tasks_ids)  # dag_10 tasks are not read
+    assert len(asyncio.run(collect_dag_tasks("dag_1/nested_dag/"))) == 50
+
+
+def test_parallel_scan_raises_segment_error(scan_table_mock):
+    scan_table_mock.side_effect = ClientError({"Error": {}}, "scan")
+    with raises(ClientError):
+        asyncio.run(collect_all_tasks(total_segments=4, max_concurrency=2))
+
+
+def test_update_db_resubmits_unprocessed_items(mocker):
+    existing_tasks = [DbTask(id=f"dag/old_task_{i}", pod_template="template") for i in range(60)]
+    table = MemoryTable(items=[_serialize_downward_task(task) for task in existing_tasks], max_processed_items=20)
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(table))
+    mocker.patch("db.writes.asyncio.sleep", side_effect=AsyncMock())
+    new_tasks = [DbTask(id=f"dag/new_task_{i}", pod_template="template") for i in range(70)]
+    report = asyncio.run(update_db(
+        DbTasksChange(tasks_to_update=new_tasks, ids_to_remove={task.id for task in existing_tasks}),
+        max_concurrency=3,
+    ))
+    assert table.items == {TASK_KEY_PREFIX + task.id: _serialize_downward_task(task) for task in new_tasks}
+    assert report.items_written == 130
+    assert report.retries > 0
+    first_delete_call = next(i for i, call in enumerate(table.batch_write_calls) if 'DeleteRequest' in call[0])
+    assert all('PutRequest' in request
+               for call in table.batch_write_calls[:first_delete_call] for request in call)
+
+
+def test_update_db_fails_on_persistent_unprocessed_items(mocker):
+    mocker.patch("db.tasks.TASK_TABLE", ThreadedTable(MemoryTable(max_processed_items=0)))
+    mocker.patch("db.writes.asyncio.sleep", side_effect=AsyncMock())
+    with raises(UnprocessedItemsError):
+        asyncio.run(update_db(DbTasksChange(tasks_to_update=[], ids_to_remove={"dag/task"})))
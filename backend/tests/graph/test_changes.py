@@ -0,0 +1,77 @@
+from model.db import DbTask, DbTasksChange
+from model.task_model import TasksChange
+from graph.changes import build_db_changes, build_new_graph, get_tasks_with_new_parents
+from graph.utils import get_children_index
+from tests.model.utils import make_task, make_task_db
+
+
+def test_children_index():
+    tasks = [
+        make_task(id="dag/a"),
+        make_task(id="dag/c", previous_tasks_ids=["dag/a", "dag/b"]),
+        make_task(id="dag/b", previous_tasks_ids=["dag/a", "dag/a"]),
+    ]
+    assert get_children_index(tasks) == {"dag/a": ["dag/b", "dag/c"], "dag/b": ["dag/c"]}
+
+
+def test_build_db_changes_sets_children_across_dags():
+    upstream_task = make_task_db(id="upstream_dag/task")
+    downstream_task = make_task(id="dag/task", previous_tasks_ids=[upstream_task.id])
+    db_changes = build_db_changes(
+        change=TasksChange(dags=["dag"], tasks=[downstream_task]),
+        current_tasks={upstream_task.id: upstream_task},
+    )
+    tasks_to_update = {task.id: task for task in db_changes.tasks_to_update}
+    assert tasks_to_update[upstream_task.id].next_tasks_ids == [downstream_task.id]
+    assert tasks_to_update[downstream_task.id].next_tasks_ids == []
+
+
+def test_new_graph_fixes_stale_children():
+    parent = make_task_db(id="dag/parent", next_tasks_ids=["dag/removed_child"])
+    removed_child = make_task_db(id="dag/removed_child", previous_tasks_ids=[parent.id])
+    child = make_task(id="dag/child", previous_tasks_ids=[parent.id])
+    new_graph = build_new_graph(change=TasksChange(dags=["dag"], tasks=[make_task(id=parent.id), child]),
+                                current_tasks={parent.id: parent, removed_child.id: removed_child})
+    assert new_graph.get_children_ids(parent.id) == [child.id]
+    assert removed_child.id not in new_graph
+
+
+def test_build_db_changes_skips_unchanged_tasks():
+    parent = make_task_db(id="dag/parent", next_tasks_ids=["dag/child"])
+    child = make_task_db(id="dag/child", previous_tasks_ids=[parent.id])
+    other_dag_task = make_task_db(id="other_dag/task")
+    current_tasks = {task.id: task for task in (parent, child, other_dag_task)}
+    new_task = make_task(id="dag/new_task", previous_tasks_ids=[parent.id])
+    db_changes = build_db_changes(
+        change=TasksChange(dags=["dag"], tasks=[
+            make_task(id=parent.id),
+            make_task(id=child.id, previous_tasks_ids=[parent.id]),
+            new_task,
+        ]),
+        current_tasks=current_tasks,
+    )
+    assert db_changes.ids_to_remove == set()
+    assert db_changes.tasks_to_update == [
+        DbTask(id=new_task.id, pod_template="template", previous_tasks_ids=[parent.id]),
+        DbTask(id=parent.id, pod_template="template", next_tasks_ids=[child.id, new_task.id]),
+    ]
+
+
+def test_build_db_changes_updates_parent_outside_of_dag_on_deletion():
+    parent = make_task_db(id="other_dag/parent", next_tasks_ids=["dag/child"])
+    child = make_task_db(id="dag/child", previous_tasks_ids=[parent.id])
+    db_changes = build_db_changes(change=TasksChange(dags=["dag"], tasks=[]),
+                                  current_tasks={parent.id: parent, child.id: child})
+    assert db_changes.ids_to_remove == {child.id}
+    assert db_changes.tasks_to_update == [DbTask(id=parent.id, pod_template="template")]
+
+
+def test_tasks_with_new_parents():
+    parent = make_task_db(id="dag/parent")
+    child = make_task_db(id="dag/child", previous_tasks_ids=[parent.id])
+    current_tasks = {task.id: task for task in (parent, child)}
+    db_changes = DbTasksChange(ids_to_remove={child.id}, tasks_to_update=[
+        make_task_db(id=parent.id, next_tasks_ids=["dag/new_child"]),
+        make_task_db(id="dag/new_child", previous_tasks_ids=[parent.id]),
+    ])
+    assert get_tasks_with_new_parents(db_changes, current_tasks) == ["dag/new_child"]
@@ -0,0 +1,30 @@
+from graph.compact import CompactGraph
+
+
+def test_children_are_transposed_parents():
+    graph = CompactGraph([
+        ("dag/c", ["dag/a", "dag/b"]),
+        ("dag/a", []),
+        ("dag/b", ["dag/a", "dag/a"]),
+    ])
+    assert graph.get_children_ids("dag/a") == ["dag/b", "dag/c"]
+    assert graph.get_children_ids("dag/c") == []
+    assert graph.get_children_ids("dag/unknown") == []
+
+
+def test_missing_parents_are_not_tasks():
+    graph = CompactGraph([("dag/a", ["dag/missing"]), ("dag/b", ["dag/a"])])
+    assert "dag/a" in graph and "dag/missing" not in graph
+    assert graph.get_missing_parents() == {"dag/a": ["dag/missing"]}
+    assert graph.get_children_ids("dag/missing") == ["dag/a"]
+
+
+def test_last_task_occurrence_is_kept():
+    graph = CompactGraph([("dag/a", []), ("dag/b", ["dag/a"]), ("dag/b", [])])
+    assert graph.get_children_ids("dag/a") == []
+
+
+def test_ancestors_ids():
+    graph = CompactGraph([("dag/a", []), ("dag/b", ["dag/a"]), ("dag/c", ["dag/b"]), ("dag/d", ["dag/a"])])
+    assert graph.get_ancestors_ids(["dag/c"]) == {"dag/a", "dag/b", "dag/c"}
+    assert graph.get_ancestors_ids(iter(["dag/d", "dag/unknown"])) == {"dag/a", "dag/d", "dag/unknown"}
@@ -0,0 +1,22 @@
+from graph.dag_trie import DagTrie
+from graph.utils import is_task_in_dag
+
+
+def test_find_task_dag():
+    dags = DagTrie(["team_a/dag", "team_b/", "team_a/dag/nested_dag"])
+    assert dags.find_task_dag("team_a/dag/task") == "team_a/dag"
+    assert dags.find_task_dag("team_a/dag/nested_dag/task") == "team_a/dag"
+    assert dags.find_task_dag("team_b/dag/task") == "team_b/"
+    assert dags.find_task_dag("team_a/task") is None
+    assert dags.find_task_dag("team_a/dag") is None
+
+
+def test_dags_match_whole_dag_parts():
+    assert is_task_in_dag("dag1/task", ["dag1"])
+    assert not is_task_in_dag("dag10/task", ["dag1"])
+    assert not is_task_in_dag("dag1_task", DagTrie(["dag1"]))
+
+
+def test_root_dag_contains_all_tasks():
+    assert DagTrie([""]).contains_task("dag/task")
+    assert not DagTrie([]).contains_task("dag/task")
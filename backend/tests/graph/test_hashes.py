@@ -0,0 +1,34 @@
+from graph.hashes import get_dags_hashes, update_dags_hashes, is_change_applied
+from model.task_model import TasksChange
+from tests.model.utils import make_task, make_task_db
+
+
+def test_content_hash_ignores_children_links():
+    task = make_task_db(id="dag/task", previous_tasks_ids=["dag/parent"])
+    assert task.content_hash == make_task_db(id="dag/task", previous_tasks_ids=["dag/parent"],
+                                             next_tasks_ids=["dag/child"]).content_hash
+    assert task.content_hash == make_task(id="dag/task", previous_tasks_ids=["dag/parent"]).content_hash
+    assert task.content_hash != make_task_db(id="dag/task").content_hash
+    assert task.content_hash != make_task_db(id="dag/other_task", previous_tasks_ids=["dag/parent"]).content_hash
+
+
+def test_dags_hashes_aggregate_nested_dags():
+    tasks = [make_task_db(id="dag/task"), make_task_db(id="dag/nested_dag/task"), make_task_db(id="other_dag/task")]
+    dags_hashes = get_dags_hashes(tasks)
+    assert set(dags_hashes) == {"dag", "dag/nested_dag", "other_dag"}
+    assert dags_hashes == get_dags_hashes(reversed(tasks))
+    assert dags_hashes["dag"] == get_dags_hashes(tasks[:2])["dag"]
+    update_dags_hashes(dags_hashes, removed_tasks=tasks[1:], added_tasks=[])
+    assert dags_hashes == get_dags_hashes(tasks[:1])
+
+
+def test_is_change_applied():
+    tasks = [make_task_db(id="dag/task"), make_task_db(id="dag/nested_dag/task"), make_task_db(id="other_dag/task")]
+    dags_hashes = get_dags_hashes(tasks)
+    assert is_change_applied(TasksChange(dags=["dag/"], tasks=[make_task(id="dag/nested_dag/task"),
+                                                               make_task(id="dag/task")]), dags_hashes)
+    assert not is_change_applied(TasksChange(dags=["dag"], tasks=[make_task(id="dag/task")]), dags_hashes)
+    assert not is_change_applied(TasksChange(dags=["dag"], tasks=[make_task(id="dag/task"), make_task(id="dag/task"),
+                                                                  make_task(id="dag/nested_dag/task")]),
+                                 dags_hashes)
+    assert is_change_applied(TasksChange(dags=["new_dag"], tasks=[]), dags_hashes)
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from graph.compact import CompactGraph
+from graph.snapshot import GraphDelta, append_delta, drop_deltas, load_graph, open_snapshot, read_deltas, \
+    write_snapshot
+
+
+def make_graph() -> CompactGraph:
+    return CompactGraph([("dag/a", []), ("dag/b", ["dag/a"]), ("dag/c", ["dag/a", "dag/b"]),
+                         ("dag/é", ["dag/missing"])])
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "graph")
+    graph = make_graph()
+    write_snapshot(path, graph, version=7)
+    mapped_graph = open_snapshot(path)
+    assert mapped_graph.version == 7 and mapped_graph.tasks_count == graph.tasks_count
+    assert list(mapped_graph.ids) == graph.ids
+    assert mapped_graph.ids[1:graph.tasks_count] == graph.ids[1:graph.tasks_count]
+    assert all(mapped_graph.nodes[task_id] == node for task_id, node in graph.nodes.items())
+    assert "dag/c" in mapped_graph and "dag/missing" not in mapped_graph and "dag/unknown" not in mapped_graph
+    assert mapped_graph.get_children_ids("dag/a") == ["dag/b", "dag/c"]
+    assert mapped_graph.get_missing_parents() == {"dag/é": ["dag/missing"]}
+    assert mapped_graph.get_ancestors_ids(["dag/c"]) == {"dag/a", "dag/b", "dag/c"}
+
+
+def test_unreadable_snapshots_are_ignored(tmp_path):
+    path = tmp_path / "graph"
+    assert open_snapshot(str(path)) is None
+    path.write_bytes(b"")
+    assert open_snapshot(str(path)) is None
+    path.write_bytes(b"not a snapshot" * 10)
+    assert open_snapshot(str(path)) is None
+    write_snapshot(str(path), make_graph(), version=1)
+    path.write_bytes(path.read_bytes()[:100])
+    assert open_snapshot(str(path)) is None
+
+
+def test_deltas_are_replayed_while_versions_follow(tmp_path):
+    path = str(tmp_path / "graph")
+    write_snapshot(path, make_graph(), version=1)
+    append_delta(path, GraphDelta(version=2, removed_ids=["dag/b"], tasks_parents={"dag/c": ["dag/a"]}))
+    append_delta(path, GraphDelta(version=3, removed_ids=[], tasks_parents={"dag/d": ["dag/c"]}))
+    append_delta(path, GraphDelta(version=5, removed_ids=["dag/a"], tasks_parents={}))  # version 4 is missing
+    graph, version = load_graph(path)
+    assert version == 3
+    assert "dag/b" not in graph and "dag/d" in graph
+    assert graph.get_children_ids("dag/a") == ["dag/c"]
+    assert graph.get_ancestors_ids(["dag/d"]) == {"dag/a", "dag/c", "dag/d"}
+
+    drop_deltas(path, version=2)
+    assert [delta.version for delta in read_deltas(path, version=2)] == [3]
+    assert read_deltas(path, version=1) == []
+
+
+def test_deltas_appended_while_dropping_are_kept(tmp_path):
+    path = str(tmp_path / "graph")
+    versions = range(2, 202)
+
+    def drop_all():
+        for _ in versions:
+            drop_deltas(path, version=1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        dropping = executor.submit(drop_all)
+        list(executor.map(lambda version: append_delta(path, GraphDelta(version, [], {})), versions))
+        dropping.result()
+    assert [delta.version for delta in read_deltas(path, version=1)] == list(versions)
@@ -0,0 +1,63 @@
+from typing import Dict, List
+
+from graph.compact import CompactGraph
+from graph.validation import get_tasks_cycles, get_introduced_cycles, get_orphan_tasks
+
+
+def make_graph(edges: Dict[str, List[str]]) -> CompactGraph:
+    parents: Dict[str, List[str]] = {task_id: [] for task_id in edges}
+    for parent, children in edges.items():
+        for child in children:
+            parents.setdefault(child, []).append(parent)
+    return CompactGraph((f"dag/{task_id}", [f"dag/{parent}" for parent in parents[task_id]]) for task_id in edges)
+
+
+def test_no_cycle():
+    assert get_tasks_cycles(make_graph({"a": ["b", "c"], "b": ["c"], "c": []})) == []
+
+
+def test_self_loop_cycle():
+    assert get_tasks_cycles(make_graph({"a": ["a"], "b": []})) == [["dag/a"]]
+
+
+def test_one_witness_cycle_per_component():
+    cycles = get_tasks_cycles(make_graph({
+        "a": ["b"], "b": ["c"], "c": ["a", "d"], "d": ["e"], "e": ["d"],
+    }))
+    assert sorted(sorted(cycle) for cycle in cycles) == [["dag/a", "dag/b", "dag/c"], ["dag/d", "dag/e"]]
+
+
+def test_witness_cycle_follows_edges():
+    graph = make_graph({"a": ["b", "c"], "b": ["c"], "c": ["a"]})
+    [cycle] = get_tasks_cycles(graph)
+    for task_id, next_task_id in zip(cycle, cycle[1:] + cycle[:1]):
+        assert next_task_id in graph.get_children_ids(task_id)
+
+
+def test_max_cycles():
+    graph = make_graph({task_id: [task_id] for task_id in "abcdef"})
+    assert len(get_tasks_cycles(graph, max_cycles=2)) == 2
+
+
+def test_dense_component_is_reported_once():
+    nodes = [str(i) for i in range(30)]  # holds far too many elementary cycles to be enumerated
+    graph = make_graph({node: [other for other in nodes if other != node] for node in nodes})
+    assert len(get_tasks_cycles(graph)) == 1
+
+
+def test_deep_graph_does_not_recurse():
+    depth = 20_000
+    graph = make_graph({str(i): [str(i + 1)] for i in range(depth)})
+    assert get_tasks_cycles(graph) == []
+
+
+def test_introduced_cycles_only_visit_ancestors():
+    graph = make_graph({"a": ["b"], "b": ["a"], "c": ["d"], "d": []})
+    assert get_introduced_cycles(graph, starting_tasks_ids=["dag/d"]) == []
+    assert len(get_introduced_cycles(graph, starting_tasks_ids=["dag/b"])) == 1
+
+
+def test_orphan_tasks():
+    graph = CompactGraph([("dag/a", []), ("dag/b", ["dag/a", "dag/missing"]), ("dag/c", ["other_dag/missing"])])
+    assert get_orphan_tasks(graph) == [("dag/b", ["dag/missing"]), ("dag/c", ["other_dag/missing"])]
+    assert get_orphan_tasks(CompactGraph([("dag/a", []), ("dag/b", ["dag/a"])])) == []
@@ -1,9 +1,9 @@
 from pydantic import ValidationError
 from pytest import raises
 
-from model.task_model import CallTask
+from model.task_model import CallTask, TasksChange
 from model.db import DbTask
-from tests.model.utils import make_task_dict
+from tests.model.utils import make_task_dict, make_task
 
 
 def test_db_task_validation_can_pass():
@@ -26,7 +26,26 @@ def test_task_must_contain_at_most_one_template():
         DbTask(**task_data)
 
 
+def test_templates_syntax_is_checked_on_validation():
+    with raises(ValidationError):
+        DbTask(**make_task_dict(pod_template="{% if %}"))
+    with raises(ValidationError):
+        DbTask(**make_task_dict(pod_template=None, call_templates=[CallTask(url_template="{{ url", method="POST")]))
+
+
 def test_task_id_must_contain_dag():
     task_data = make_task_dict(id="no_separator_indicating_dage_of_task")
     with raises(ValidationError):
         DbTask(**task_data)
+
+
+def test_task_id_parts_must_not_be_empty():
+    for task_id in ["/dag/task", "dag//task", "dag/task/"]:
+        with raises(ValidationError):
+            DbTask(**make_task_dict(id=task_id))
+
+
+def test_tasks_change_dags_match_whole_dag_parts():
+    TasksChange(dags=["dag1/"], tasks=[make_task(id="dag1/task"), make_task(id="dag1/nested_dag/task")])
+    with raises(ValidationError):
+        TasksChange(dags=["dag1"], tasks=[make_task(id="dag10/task")])
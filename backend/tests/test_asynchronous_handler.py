@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+from asynchronous_handler import BlockingPool, make_async, CALLS_IN_FLIGHT, QUEUED_CALLS, QUEUE_WAIT
+
+
+def test_pool_bounds_concurrent_calls():
+    pool = BlockingPool("test_bounded", max_workers=2)
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+    queued_calls = []
+
+    def blocking_call(value: int) -> int:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+        return value
+
+    async def scenario():
+        calls = asyncio.gather(*(pool.run(blocking_call, value) for value in range(6)))
+        await asyncio.sleep(0)
+        queued_calls.append(QUEUED_CALLS.get(pool="test_bounded"))
+        return await calls
+
+    assert asyncio.run(scenario()) == list(range(6))
+    assert max_running == 2
+    assert queued_calls == [4]
+    assert CALLS_IN_FLIGHT.get(pool="test_bounded") == 0
+    assert QUEUE_WAIT.get(pool="test_bounded") == 6  # number of observed waits
+
+
+def test_cancelled_calls_stay_in_flight_until_their_thread_is_done():
+    pool = BlockingPool("test_cancelled", max_workers=1)
+    release = threading.Event()
+    in_flight_calls = []
+
+    async def scenario():
+        call = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        await asyncio.sleep(0)
+        in_flight_calls.append(CALLS_IN_FLIGHT.get(pool="test_cancelled"))
+        release.set()
+        await pool.run(lambda: None)  # runs once the cancelled call freed the thread
+
+    asyncio.run(scenario())
+    assert in_flight_calls == [1]
+    assert CALLS_IN_FLIGHT.get(pool="test_cancelled") == 0
+
+
+def test_make_async():
+    pool = BlockingPool("test_make_async", max_workers=1)
+
+    @make_async(pool=pool)
+    def add(first: int, second: int) -> int:
+        return first + second
+
+    @make_async
+    def get_thread_name() -> str:
+        return threading.current_thread().name
+
+    assert asyncio.run(add(1, second=2)) == 3
+    assert asyncio.run(get_thread_name()).startswith("streamflow-read")
+    assert add.__name__ == "add"
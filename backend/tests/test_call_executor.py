@@ -0,0 +1,151 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set
+from unittest.mock import AsyncMock
+
+from pytest import fixture, raises
+
+import call_executor
+from call_executor import CallFailed, CallTemplateError, render_call, run_call_task, perform_call
+from db import runs as runs_db
+from model.db import DbTask
+from model.task_model import CallTask
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers /json with the request, /large with a large body, /flaky with an error every other call"""
+    protocol_version = "HTTP/1.1"  # keeps connections alive
+    requests: List[Dict] = []
+    connections: Set[int] = set()
+
+    def _answer(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.connections.add(self.client_address[1])
+        self.requests.append({"path": self.path, "body": body})
+        if self.path.startswith("/large"):
+            self._answer(200, b"x" * 100_000)
+        elif self.path.startswith("/flaky") and len(self.requests) % 2:
+            self._answer(503, b"")
+        elif self.path.startswith("/missing"):
+            self._answer(404, b"")
+        else:
+            self._answer(200, json.dumps({"path": self.path, "body": body.decode()}).encode())
+
+    do_PUT = do_POST
+
+    def log_message(self, *_):
+        pass
+
+
+@fixture
+def server_url():
+    StandInHandler.requests, StandInHandler.connections = [], set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@fixture
+def runs_table(mocker) -> MemoryTable:
+    table = MemoryTable()
+    mocker.patch("db.runs.RUNS_TABLE", ThreadedTable(table))
+    return table
+
+
+def make_call_task(url_template: str, **kwargs) -> CallTask:
+    return CallTask(url_template=url_template, method="POST", **kwargs)
+
+
+def test_render_call():
+    call_task = make_call_task("http://api/{{ task_id }}", template='{"json": {"run": "{{ run_id }}"}}')
+    assert render_call(call_task, {"task_id": "dag/task", "run_id": "run"}) == \
+        ("http://api/dag/task", {"json": {"run": "run"}})
+    with raises(CallTemplateError):
+        render_call(make_call_task("http://api/{{ missing }}"), {})
+    with raises(CallTemplateError):
+        render_call(make_call_task("http://api", template='{"body": 1}'), {})
+
+
+def test_calls_share_connections(server_url):
+    async def scenario():
+        try:
+            await asyncio.gather(*(perform_call("POST", f"{server_url}/json", {"json": index}, keep_body=False)
+                                   for index in range(50)))
+        finally:
+            await call_executor.close_http_client()
+    asyncio.run(scenario())
+    assert len(StandInHandler.requests) == 50
+    assert len(StandInHandler.connections) <= call_executor.config.CALL_MAX_CONNECTIONS_PER_HOST
+
+
+def test_calls_retry_server_errors(server_url, mocker):
+    mocker.patch("call_executor.asyncio.sleep", side_effect=AsyncMock())
+
+    async def scenario():
+        try:
+            assert await perform_call("PUT", f"{server_url}/flaky", {}, keep_body=True)
+            with raises(CallFailed):
+                await perform_call("POST", f"{server_url}/missing", {}, keep_body=True)
+        finally:
+            await call_executor.close_http_client()
+    asyncio.run(scenario())
+    assert [request["path"] for request in StandInHandler.requests] == ["/flaky", "/flaky", "/missing"]
+
+
+def test_non_idempotent_calls_are_not_sent_again(server_url, mocker):
+    mocker.patch("call_executor.asyncio.sleep", side_effect=AsyncMock())
+
+    async def scenario():
+        try:
+            with raises(CallFailed) as error:
+                await perform_call("POST", f"{server_url}/flaky", {}, keep_body=True)
+            assert error.value.status_code == 503
+        finally:
+            await call_executor.close_http_client()
+    asyncio.run(scenario())
+    assert [request["path"] for request in StandInHandler.requests] == ["/flaky"]
+
+
+def test_large_responses_are_capped(server_url, mocker):
+    mocker.patch("config.CALL_MAX_RESPONSE_BYTES", 10_000)
+
+    async def scenario():
+        try:
+            assert await perform_call("POST", f"{server_url}/large", {}, keep_body=False) is None
+            with raises(CallFailed):
+                await perform_call("POST", f"{server_url}/large", {}, keep_body=True)
+        finally:
+            await call_executor.close_http_client()
+    asyncio.run(scenario())
+
+
+def test_run_call_task_chains_and_logs_responses(server_url, runs_table):
+    task = DbTask(id="dag/task", call_templates=[
+        make_call_task(f"{server_url}/json", response_name="first", template='{"json": "{{ run_id }}"}'),
+        make_call_task(f"{server_url}/json/{{{{ responses.first.path[1:] }}}}", response_name="second",
+                       log_response=True),
+    ])
+
+    async def scenario():
+        await runs_db.create_instances("run", {task.id: 0}, next_tasks_ids={})
+        try:
+            return await run_call_task(task, "run")
+        finally:
+            await call_executor.close_http_client()
+    responses = asyncio.run(scenario())
+    assert responses == {"first": {"path": "/json", "body": '"run"'}, "second": {"path": "/json/json", "body": ""}}
+    instance = runs_table.items[runs_db._instance_key("run", task.id)["id"]]
+    assert instance["responses"] == {"second": json.dumps(responses["second"])}
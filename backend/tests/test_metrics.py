@@ -0,0 +1,40 @@
+from pytest import fixture
+
+from metrics import Counter, Gauge, Histogram, render_metrics, span, collect_spans
+
+
+@fixture(autouse=True)
+def registry(mocker):
+    """Unregisters the metrics created by the tests, which would otherwise be served along with streamflow ones"""
+    mocker.patch.dict("metrics._registry")
+
+
+def test_render_metrics():
+    counter = Counter("test_calls_total", "Calls.", label_names=("operation",))
+    counter.inc(operation='say "hi"')
+    counter.inc(2, operation='say "hi"')
+    Gauge("test_size", "Size.").set(3)
+    histogram = Histogram("test_duration_seconds", "Duration.", buckets=(.1, 1.))
+    histogram.observe(.5)
+    histogram.observe(2.)
+    assert counter.get(operation='say "hi"') == 3
+    rendered = render_metrics().splitlines()
+    assert "# TYPE test_calls_total counter" in rendered
+    assert 'test_calls_total{operation="say \\"hi\\""} 3.0' in rendered
+    assert "test_size 3" in rendered
+    assert [line for line in rendered if line.startswith("test_duration_seconds")] == [
+        'test_duration_seconds_bucket{le="0.1"} 0',
+        'test_duration_seconds_bucket{le="1.0"} 1',
+        'test_duration_seconds_bucket{le="+Inf"} 2',
+        'test_duration_seconds_sum 2.5',
+        'test_duration_seconds_count 2',
+    ]
+
+
+def test_spans_are_collected_in_context():
+    with span("outside"):
+        pass
+    with collect_spans() as spans:
+        with span("stage"):
+            pass
+    assert [stage for stage, _ in spans] == ["stage"]
@@ -0,0 +1,94 @@
+import asyncio
+from typing import List
+
+from botocore.exceptions import ClientError
+from pytest import fixture, raises
+
+from db import runs as runs_db
+from model.db import DbTask
+from scheduler import get_run_structure, run_dag
+from db.storage import ThreadedTable
+from tests.db.memory_table import MemoryTable
+
+
+def make_task(task_id: str, *previous_tasks_ids: str) -> DbTask:
+    return DbTask(id=task_id, pod_template="template", previous_tasks_ids=list(previous_tasks_ids))
+
+
+@fixture
+def runs_table(mocker) -> MemoryTable:
+    table = MemoryTable()
+    mocker.patch("db.runs.RUNS_TABLE", ThreadedTable(table))
+    return table
+
+
+@fixture
+def diamond_tasks() -> List[DbTask]:
+    return [
+        make_task("dag/a", "other_dag/external"),
+        make_task("dag/b", "dag/a"),
+        make_task("dag/c", "dag/a", "dag/a"),
+        make_task("dag/d", "dag/b", "dag/c"),
+    ]
+
+
+def test_get_run_structure(diamond_tasks):
+    pending_parents, next_tasks_ids = get_run_structure(diamond_tasks)
+    assert pending_parents == {"dag/a": 0, "dag/b": 1, "dag/c": 1, "dag/d": 2}
+    assert next_tasks_ids == {"dag/a": ["dag/b", "dag/c"], "dag/b": ["dag/d"], "dag/c": ["dag/d"]}
+
+
+def test_run_dag_respects_dependencies(runs_table, diamond_tasks):
+    started: List[str] = []
+
+    async def run_task(task: DbTask, run_id: str):
+        started.append(task.id)
+        await asyncio.sleep(0)
+
+    report = asyncio.run(run_dag("dag", run_task, tasks=diamond_tasks, run_id="run"))
+    assert report.succeeded and report.succeeded_count == 4
+    assert started[0] == "dag/a" and started[-1] == "dag/d" and sorted(started) == ["dag/a", "dag/b", "dag/c", "dag/d"]
+    assert runs_table.items[f"{runs_db.RUN_KEY_PREFIX}run"]["state"] == runs_db.SUCCEEDED
+    assert all(item["state"] == runs_db.SUCCEEDED for item in runs_table.items.values()
+               if item["id"].startswith(runs_db.INSTANCE_KEY_PREFIX))
+
+
+def test_run_dag_skips_descendants_of_failed_tasks(runs_table, diamond_tasks):
+    async def run_task(task: DbTask, run_id: str):
+        if task.id == "dag/b":
+            raise RuntimeError("failure")
+
+    report = asyncio.run(run_dag("dag", run_task, tasks=diamond_tasks, run_id="run"))
+    assert (report.succeeded_count, report.failed_count, report.skipped_count) == (2, 1, 1)
+    assert runs_table.items[f"{runs_db.RUN_KEY_PREFIX}run"]["state"] == runs_db.FAILED
+    assert runs_table.items[runs_db._instance_key("run", "dag/d")["id"]]["state"] == runs_db.PENDING
+
+
+def test_run_dag_large_fan_out(runs_table):
+    tasks = [make_task("dag/root")] + [make_task(f"dag/task_{index}", "dag/root") for index in range(300)]
+    tasks.append(make_task("dag/end", *(task.id for task in tasks[1:])))
+    running = 0
+    max_running = 0
+
+    async def run_task(task: DbTask, run_id: str):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0)
+        running -= 1
+
+    report = asyncio.run(run_dag("dag", run_task, tasks=tasks, max_concurrency=8))
+    assert report.succeeded_count == len(tasks)
+    assert 1 < max_running <= 8
+
+
+def test_run_dag_is_ended_as_failed_on_errors(runs_table, diamond_tasks, mocker):
+    mocker.patch("db.runs.decrement_pending_parents", side_effect=ClientError({"Error": {}}, "UpdateItem"))
+
+    async def run_task(task: DbTask, run_id: str):
+        pass
+
+    with raises(ClientError):
+        asyncio.run(run_dag("dag", run_task, tasks=diamond_tasks, run_id="run"))
+    run_item = runs_table.items[f"{runs_db.RUN_KEY_PREFIX}run"]
+    assert run_item["state"] == runs_db.FAILED and run_item["succeeded_count"] == 1
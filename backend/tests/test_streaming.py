@@ -1,6 +1,9 @@
+import asyncio
+from typing import List, Iterable
+
 from pytest import fixture, raises
 
-from streaming import group
+from streaming import group, async_group
 
 
 @fixture
@@ -23,3 +26,19 @@ def test_group_end_corresponds_to_stream_end(list_stream):
 def test_group_with_bad_size_arg(list_stream):
     with raises(ValueError):
         list(group(list_stream, group_size=0))
+
+
+def collect_async_groups(stream: Iterable, group_size: int) -> List[List]:
+    async def async_stream():
+        for element in stream:
+            yield element
+
+    async def collect():
+        return [single_group async for single_group in async_group(async_stream(), group_size)]
+    return asyncio.run(collect())
+
+
+def test_async_group(list_stream):
+    assert collect_async_groups(list_stream, len(list_stream)-1) == [list_stream[:-1], [list_stream[-1]]]
+    assert collect_async_groups(list_stream, len(list_stream)) == [list_stream]
+    assert collect_async_groups([], 1) == []
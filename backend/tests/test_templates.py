@@ -0,0 +1,50 @@
+from jinja2 import TemplateError, TemplateSyntaxError
+from pytest import raises
+
+from templates import TemplatesCache, TEMPLATE_OVERHEAD_BYTES, CACHE_LOOKUPS, compile_template, get_syntax_error
+
+
+def test_templates_are_compiled_once():
+    cache = TemplatesCache()
+    hits, misses = CACHE_LOOKUPS.get(result="hit"), CACHE_LOOKUPS.get(result="miss")
+    assert cache.render_batch("hash", "pod_template", "{{ name }}", [{"name": "a"}, {"name": "b"}]) == ["a", "b"]
+    assert cache.get("hash", "pod_template", "{{ name }}") is cache.get("hash", "pod_template", "{{ name }}")
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 1)
+    assert (CACHE_LOOKUPS.get(result="hit") - hits, CACHE_LOOKUPS.get(result="miss") - misses) == (2, 1)
+
+
+def test_least_recently_used_templates_are_evicted():
+    cache = TemplatesCache(max_entries=2)
+    first_template = cache.get("first", "pod_template", "first")
+    cache.get("second", "pod_template", "second")
+    assert cache.get("first", "pod_template", "first") is first_template
+    cache.get("third", "pod_template", "third")
+    assert cache.evictions == 1
+    assert cache.get("first", "pod_template", "first") is first_template
+    cache.get("second", "pod_template", "second")
+    assert cache.misses == 4
+
+
+def test_memory_cap():
+    cache = TemplatesCache(max_bytes=3 * (TEMPLATE_OVERHEAD_BYTES + 10))
+    for index in range(5):
+        cache.get(str(index), "pod_template", "x" * 10)
+    assert len(cache) == 3 and cache.size_bytes <= cache.max_bytes
+    cache.get("large", "pod_template", "x" * cache.max_bytes)
+    assert len(cache) == 1  # the newest template is kept even if it does not fit
+
+
+def test_syntax_errors():
+    assert get_syntax_error("{{ valid }}") is None
+    assert "line 1" in get_syntax_error("{% for %}")
+    with raises(TemplateSyntaxError):
+        TemplatesCache().get("hash", "pod_template", "{{ invalid")
+
+
+def test_templates_are_sandboxed():
+    source = "{{ cycler.__init__.__globals__.os.getcwd() }}"
+    assert get_syntax_error(source) is None  # unsafe attributes are only known when rendering
+    with raises(TemplateError):
+        TemplatesCache().render_batch("hash", "pod_template", source, [{}])
+    with raises(TemplateError):
+        compile_template("{{ items.append(1) }}").render(items=[])
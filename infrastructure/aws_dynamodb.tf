@@ -7,6 +7,17 @@ resource "aws_dynamodb_table" "tasks" {
     name = "id"
     type = "S"  # string
   }
+  attribute {
+    name = "dag"
+    type = "S"  # string
+  }
+  # sparse index of the task items by root dag : reads of a dag query its partition instead of scanning the table
+  global_secondary_index {
+    name = var.task_table_dag_index_name
+    hash_key = "dag"
+    range_key = "id"
+    projection_type = "ALL"
+  }
   server_side_encryption {
     enabled = true
   }
@@ -60,11 +71,14 @@ data "aws_iam_policy_document" "streamflow_admin" {
       "dynamodb:BatchWrite*",
       "dynamodb:CreateTable",
       "dynamodb:Update*",
-      "dynamodb:PutItem"
+      "dynamodb:PutItem",
+      "dynamodb:DeleteItem",
+      "dynamodb:ConditionCheckItem"
     ]
     effect = "Allow"
     resources = [
       aws_dynamodb_table.tasks.arn,
+      "${aws_dynamodb_table.tasks.arn}/index/*",
       aws_dynamodb_table.tasks_instances.arn
     ]
   }
@@ -7,6 +7,12 @@ variable "task_table_name" {
   default = "streamflow_tasks"
 }
 
+variable "task_table_dag_index_name" {
+  type = string
+  description = "Name of the task table index listing tasks by dag"
+  default = "dag_index"
+}
+
 #####################
 # task_instance table
 